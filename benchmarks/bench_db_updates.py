@@ -0,0 +1,91 @@
+"""
+Бенчмарк записи статусов групп в SQLite.
+
+Каждый запуск задачи параллельно обновляет статусы групп, как вступление в группы. Режимы:
+- legacy: новый движок с журналом SQL-запросов на каждый запуск (журнал DELETE, synchronous=FULL),
+  update_group_chat - по одной транзакции на группу. Журнал SQL-запросов пишется в /dev/null;
+- shared: общий движок процесса (WAL, synchronous=NORMAL, кэш страниц), update_group_chat;
+- write-behind: общий движок и очередь отложенной записи GroupUpdateQueue - пачки одной транзакцией.
+Отчёт: время, обновлений в секунду, количество групп с итоговым статусом.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_db_updates --groups 500 --runs 5
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import tempfile
+import time
+from typing import Dict
+
+
+async def run_benchmark(args) -> Dict[str, object]:
+    from src.database.database import Database
+    from src.task_container.group_updates import GroupUpdateQueue
+
+    class LegacyDatabase(Database):
+        sqlite_pragmas = {'journal_mode': 'DELETE', 'synchronous': 'FULL'}
+
+    directory = tempfile.mkdtemp()
+    url = f'sqlite+aiosqlite:///{os.path.join(directory, "bench.db")}'
+    setup = LegacyDatabase(url, echo=False)
+    await setup.create_tables()
+    for i in range(args.groups):
+        await setup.create_group_chat(name=f'bench_group_{i}', status='second')
+    ids = [chat.id for chat in await setup.get_all_group_chats()]
+    await setup.close()
+
+    started = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for run in range(args.runs):
+            status = f'status_{run}'
+            if args.mode == 'legacy':
+                db = LegacyDatabase(url, echo=args.echo)
+            else:
+                db = Database.shared(url)
+            if args.mode == 'write-behind':
+                updates = GroupUpdateQueue.shared(db)
+                await asyncio.gather(*(updates.put(chat_id, {'status': status, 'channel_id': chat_id}) for chat_id in ids))
+            else:
+                await asyncio.gather(*(db.update_group_chat(chat_id, status=status, channel_id=chat_id) for chat_id in ids))
+            if args.mode == 'legacy':
+                await db.close()
+        await GroupUpdateQueue.close_all()
+        await Database.shared(url).close()
+    elapsed = time.perf_counter() - started
+    check = LegacyDatabase(url, echo=False)
+    written = len(await check.get_chats_by_status(f'status_{args.runs - 1}'))
+    await check.close()
+    updates = args.groups * args.runs
+    return {
+        'mode': args.mode,
+        'updates': updates,
+        'elapsed_s': round(elapsed, 2),
+        'updates_per_s': round(updates / elapsed, 1),
+        'written': written,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=['shared', 'legacy', 'write-behind'], default='shared')
+    parser.add_argument('--groups', type=int, default=500, help='Групп в одном запуске задачи')
+    parser.add_argument('--runs', type=int, default=5, help='Запусков задачи')
+    parser.add_argument('--no-echo', dest='echo', action='store_false',
+                        help='Без журнала SQL-запросов в прежней настройке')
+    parser.add_argument('--json', action='store_true', help='Вывести результат в JSON')
+    args = parser.parse_args()
+
+    result = asyncio.run(run_benchmark(args))
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False))
+        return
+    print(f"Режим: {result['mode']}, обновлений: {result['updates']}")
+    print(f"Время: {result['elapsed_s']} с, {result['updates_per_s']} обновлений/с")
+    print(f"Групп с итоговым статусом: {result['written']}")
+
+
+if __name__ == '__main__':
+    main()
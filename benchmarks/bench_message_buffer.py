@@ -0,0 +1,48 @@
+"""
+Сравнение памяти очереди сообщений: события Telethon против компактных записей BufferedMessage.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_message_buffer --count 10000
+"""
+import argparse
+import gc
+import tracemalloc
+from typing import Callable, List
+
+from telethon import TelegramClient, events
+from telethon.sessions import MemorySession
+
+from benchmarks.synthetic import SyntheticTraffic
+from src.task_container.models import BufferedMessage
+
+
+def measure(count: int, build: Callable[[List[events.NewMessage.Event]], list]) -> int:
+    """Возвращает количество байт, которое остаётся занятым буфером из count сообщений."""
+    client = TelegramClient(MemorySession(), 1, 'benchmark')
+    traffic = SyntheticTraffic(chats=5000, seed=0)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    buffer = build([traffic.next_event(client)[1] for _ in range(count)])
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del buffer
+    return after - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=10000, help='Количество сообщений в буфере')
+    args = parser.parse_args()
+
+    events_bytes = measure(args.count, lambda batch: batch)
+    records_bytes = measure(args.count, lambda batch: [BufferedMessage.from_event(event) for event in batch])
+    print(f"Сообщений в буфере: {args.count}")
+    print(f"События Telethon:   {events_bytes / 1024:10.1f} KiB ({events_bytes / args.count:7.1f} B/сообщение)")
+    print(f"BufferedMessage:    {records_bytes / 1024:10.1f} KiB ({records_bytes / args.count:7.1f} B/сообщение)")
+    print(f"Экономия: {events_bytes / max(records_bytes, 1):.1f}x")
+
+
+if __name__ == '__main__':
+    main()
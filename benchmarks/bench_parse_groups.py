@@ -0,0 +1,141 @@
+"""
+Бенчмарк парсинга групп (/start_pars).
+
+Сравнивает последовательную обработку групп (история -> Mistral -> запись статуса, затем следующая группа)
+с конвейером GroupParsePipeline. Telegram и Mistral заменены заглушками в памяти с заданной задержкой,
+статусы записываются во временную базу SQLite.
+Отчёт: время, групп в минуту, максимум одновременных запросов к Mistral, записанные статусы.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_parse_groups --groups 300 --accounts 2 --fetch-latency 0.05 --latency 0.3
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Dict
+
+from telethon import types
+
+
+class FakeTelegram:
+    """Заглушка клиента Telegram: имя группы -> peer, история из limit сообщений за последние минуты."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    async def get_input_entity(self, name: str):
+        await asyncio.sleep(self.latency)
+        return types.InputPeerChannel(int(name.rsplit('_', 1)[1]) + 1, 1)
+
+    async def get_messages(self, peer, limit: int = 10, min_id: int = 0, **kwargs):
+        await asyncio.sleep(self.latency)
+        now = datetime.now(timezone.utc)
+        return [SimpleNamespace(id=i, text=f'Сообщение {i}', message=f'Сообщение {i}', sender_id=i,
+                                date=now - timedelta(minutes=limit - i)) for i in range(min_id + 1, limit + 1)]
+
+
+class FakeMistral:
+    """Заглушка Mistral: отвечает count_message с задержкой latency ± jitter."""
+
+    def __init__(self, latency: float, jitter: float, seed: int):
+        self.latency = latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = 0
+
+    async def chat(self, message: str, prompt: str) -> str:
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter)))
+            return json.dumps({'group': True, 'count_message': self.random.randint(0, 8)})
+        finally:
+            self.in_flight -= 1
+
+
+async def sequential(pool, db, mistral, prompt, since, chats, limit: int) -> None:
+    """Обработка групп по одной, как до конвейера."""
+    from src.utils.mistralAi import get_count_message
+    client = next(iter(pool.clients.values()))
+    for chat in chats:
+        messages = await client.get_messages(await client.get_input_entity(chat.name), limit=limit)
+        message_list = ''.join(f"id:{m.sender_id}, message: {m.message}\n" for m in messages if m.date >= since)
+        status = 'second' if await get_count_message(await mistral.chat(message_list, prompt)) > 3 else 'bad_second'
+        await db.update_group_chat(chat.id, status=status)
+
+
+async def run_benchmark(args) -> Dict[str, object]:
+    from src.database.database import Database
+    from src.task_container.parse_pipeline import GroupParsePipeline
+    from src.telethone_client.client_pool import ClientPool
+
+    directory = tempfile.mkdtemp()
+    db = Database(f'sqlite+aiosqlite:///{os.path.join(directory, "bench.db")}')
+    await db.create_tables()
+    for i in range(args.groups):
+        await db.create_group_chat(name=f'bench_group_{i}', status='test')
+    chats = await db.get_chats_by_status('test')
+
+    pool = ClientPool({f'account{i}': FakeTelegram(args.fetch_latency) for i in range(args.accounts)})
+    mistral = FakeMistral(args.latency, args.jitter, args.seed)
+    since = datetime.now(timezone.utc) - timedelta(hours=24)
+    started = time.perf_counter()
+    if args.mode == 'sequential':
+        await sequential(pool, db, mistral, 'prompt', since, chats, args.history_limit)
+    else:
+        pipeline = GroupParsePipeline(pool, db, mistral, 'prompt', since, fetch_rate=args.fetch_rate,
+                                      classify_concurrency=args.concurrency, progress_interval=0,
+                                      history_limit=args.history_limit)
+        await pipeline.run(chats)
+    elapsed = time.perf_counter() - started
+    statuses: Dict[str, int] = {}
+    for chat in await db.get_all_group_chats():
+        statuses[chat.status] = statuses.get(chat.status, 0) + 1
+    await db.close()
+    return {
+        'mode': args.mode,
+        'groups': args.groups,
+        'elapsed_s': round(elapsed, 2),
+        'groups_per_min': round(args.groups / elapsed * 60, 1),
+        'mistral_requests': mistral.requests,
+        'mistral_max_in_flight': mistral.max_in_flight,
+        'statuses': statuses,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=['pipeline', 'sequential'], default='pipeline')
+    parser.add_argument('--groups', type=int, default=300, help='Количество групп')
+    parser.add_argument('--accounts', type=int, default=2, help='Аккаунтов в пуле')
+    parser.add_argument('--fetch-latency', type=float, default=0.05, help='Задержка запроса к Telegram, с')
+    parser.add_argument('--fetch-rate', type=float, default=0, help='PARSE_FETCH_RATE (0 - без ограничения)')
+    parser.add_argument('--history-limit', type=int, default=10, help='PARSE_HISTORY_LIMIT')
+    parser.add_argument('--latency', type=float, default=0.3, help='Средняя задержка заглушки Mistral, с')
+    parser.add_argument('--jitter', type=float, default=0.1, help='Разброс задержки заглушки Mistral, с')
+    parser.add_argument('--concurrency', type=int, default=4, help='MISTRAL_MAX_CONCURRENCY')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help='Вывести результат в JSON')
+    args = parser.parse_args()
+
+    result = asyncio.run(run_benchmark(args))
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False))
+        return
+    print(f"Режим: {result['mode']}, групп: {result['groups']}")
+    print(f"Время: {result['elapsed_s']} с, {result['groups_per_min']} групп/мин")
+    print(f"Запросов к Mistral: {result['mistral_requests']}, одновременно не больше {result['mistral_max_in_flight']}")
+    print(f"Статусы: {result['statuses']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+"""
+Сквозной бенчмарк обработки групповых сообщений.
+
+Синтетические события NewMessage с заданной частотой проходят через обработчики, зарегистрированные
+BaseTelegramClient, MainHandlers.handle_group_message, MessageProcessor и пересылку. Mistral заменён
+локальной заглушкой (benchmarks.fake_mistral) в отдельном процессе, пересылка - приёмником в памяти.
+Отчёт: сообщений в секунду, задержка от получения до пересылки p50/p95/p99, пиковый RSS,
+запросов к Mistral на 1000 сообщений.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_pipeline --count 5000 --rate 500 --latency 0.3 --error-rate 0.05
+
+Проверка, что конвейер работает (CI, .github/workflows/benchmarks.yml): небольшой прогон с --check
+завершается с кодом 1, если переслана не каждая заявка:
+    python -m benchmarks.bench_pipeline --count 300 --rate 2000 --latency 0.05 --check
+"""
+import argparse
+import asyncio
+import inspect
+import json
+import multiprocessing
+import os
+import resource
+import socket
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+from telethon.utils import get_peer_id
+
+from benchmarks import fake_mistral
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+class ForwardSink:
+    """Приёмник пересылок: запоминает время пересылки каждого сообщения."""
+
+    def __init__(self):
+        self.forwarded: Dict[Tuple[int, int], float] = {}
+        self.calls = 0
+
+    async def forward_messages(self, entity, messages, from_peer=None, **kwargs):
+        now = time.perf_counter()
+        self.calls += 1
+        chat_id = get_peer_id(from_peer)
+        for message_id in messages:
+            self.forwarded.setdefault((chat_id, message_id), now)
+
+
+async def dispatch(client, event) -> None:
+    """
+    Передаёт событие обработчикам клиента так же, как Telethon при получении обновления:
+    только обработчикам, зарегистрированным на этот тип события.
+    """
+    for callback, builder in client.list_event_handlers():
+        if not isinstance(event, type(builder).Event):
+            continue
+        await builder.resolve(client)
+        passed = builder.filter(event)
+        if inspect.isawaitable(passed):
+            passed = await passed
+        if passed:
+            await callback(event)
+
+
+async def run_benchmark(args, mistral_url: str) -> dict:
+    from telethon.sessions import MemorySession
+
+    from benchmarks.synthetic import SyntheticTraffic
+    from telethon import types
+
+    from src.task_container import MessageProcessor, TrackedChats
+    from src.task_container.workers import ClassifierWorkers
+    from src.telethone_client.telethone_client_bot import MainTelegramClient
+    from src.utils.mistralAi import MistralAI
+
+    bot = MainTelegramClient(1, 'benchmark', MemorySession())
+    bot.register_handlers()
+    sink = ForwardSink()
+    bot.client.forward_messages = sink.forward_messages
+    traffic = SyntheticTraffic(chats=args.chats, lead_ratio=args.lead_ratio, seed=args.seed)
+    # Все синтетические группы считаются подключёнными
+    TrackedChats.replace(get_peer_id(types.PeerChannel(chat_id)) for chat_id in range(1, args.chats + 1))
+    if args.wal:
+        MessageProcessor.open_wal(os.path.join(tempfile.mkdtemp(), 'message_wal.jsonl'))
+
+    sent_at: Dict[Tuple[int, int], float] = {}
+    leads = set()
+    processed = 0
+    stopping = False
+
+    async def consumer():
+        # Повторяет MessageProcessor.processing_loop, дополнительно считая обработанные сообщения.
+        # После подачи в очередь кладётся None: когда он забран, все поданные сообщения уже в пачках
+        nonlocal processed
+        while True:
+            batch = await MessageProcessor._collect_batch()
+            await MessageProcessor._process_buffered_messages(batch)
+            processed += len(batch)
+            if stopping and MessageProcessor._messages_queue.empty():
+                return
+
+    workers = None
+    if args.processes:
+        # Многопроцессный режим: классификация в процессах-классификаторах, здесь только приём и пересылка
+        workers = ClassifierWorkers(args.processes)
+        workers.start()
+        MessageProcessor.set_workers(workers)
+        # Ждём готовности процессов, чтобы время их запуска не попало в замер
+        await workers.wait_ready()
+        consumer_task = None
+    else:
+        consumer_task = asyncio.create_task(consumer())
+    started = time.perf_counter()
+    for number in range(args.count):
+        # Равномерная подача с заданной частотой; если обработчик не успевает, подаём без пауз
+        delay = started + number / args.rate - time.perf_counter()
+        # Даже без паузы отдаём управление event loop, как при чтении обновлений из сети
+        await asyncio.sleep(max(delay, 0))
+        kind, event = traffic.next_event(bot.client)
+        sent_at[(event.chat_id, event.id)] = time.perf_counter()
+        if kind == 'lead':
+            leads.add((event.chat_id, event.id))
+        await dispatch(bot.client, event)
+    ingest_done = time.perf_counter()
+
+    if workers is not None:
+        MessageProcessor.set_workers(None)
+        await workers.stop()
+        processed = workers.processed
+    else:
+        stopping = True
+        await MessageProcessor._messages_queue.put((time.monotonic(), None))
+        await consumer_task
+    finished = time.perf_counter()
+    await MistralAI.close_all()
+    await MessageProcessor.close_wal()
+
+    latencies = [sink.forwarded[key] - sent_at[key] for key in sink.forwarded if key in sent_at]
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {
+        'messages': args.count,
+        'processed': processed,
+        'leads': len(leads),
+        'forwarded': len(sink.forwarded),
+        'forward_calls': sink.calls,
+        'elapsed_s': round(finished - started, 3),
+        'ingest_s': round(ingest_done - started, 3),
+        'messages_per_s': round(args.count / (finished - started), 1),
+        'latency_p50_s': round(percentile(latencies, 50), 3),
+        'latency_p95_s': round(percentile(latencies, 95), 3),
+        'latency_p99_s': round(percentile(latencies, 99), 3),
+        'peak_rss_mb': round(peak_rss_mb, 1),
+        # В многопроцессном режиме кэш и фильтр работают в процессах-классификаторах
+        'cache': None if workers else MessageProcessor.cache_stats(),
+        'prefilter': None if workers else MessageProcessor.prefilter_stats(),
+    }
+
+
+def print_report(result: dict) -> None:
+    print(f"Сообщений: {result['messages']} (заявок {result['leads']}, переслано {result['forwarded']}, "
+          f"запросов пересылки {result['forward_calls']})")
+    print(f"Время: {result['elapsed_s']} с (подача {result['ingest_s']} с), "
+          f"пропускная способность {result['messages_per_s']} сообщений/с")
+    print(f"Задержка до пересылки: p50 {result['latency_p50_s']} с, p95 {result['latency_p95_s']} с, "
+          f"p99 {result['latency_p99_s']} с")
+    print(f"Пиковый RSS: {result['peak_rss_mb']} МБ")
+    print(f"Запросов к Mistral: {result['llm_requests']} (ошибок {result['llm_errors']}), "
+          f"{result['llm_calls_per_1k']} на 1000 сообщений")
+    print(f"Кэш: {result['cache']}")
+    print(f"Предварительный фильтр: {result['prefilter']}")
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=5000, help='Количество сообщений')
+    parser.add_argument('--rate', type=float, default=500, help='Частота подачи, сообщений в секунду')
+    parser.add_argument('--chats', type=int, default=500, help='Количество групп')
+    parser.add_argument('--lead-ratio', type=float, default=0.05, help='Доля заявок на строительство')
+    parser.add_argument('--latency', type=float, default=0.3, help='Средняя задержка заглушки Mistral, с')
+    parser.add_argument('--jitter', type=float, default=0.1, help='Разброс задержки заглушки Mistral, с')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Доля ответов 429/500 заглушки Mistral')
+    parser.add_argument('--batch-size', type=int, default=100, help='MESSAGE_BATCH_SIZE')
+    parser.add_argument('--batch-age', type=float, default=1.0, help='MESSAGE_BATCH_MAX_AGE, с')
+    parser.add_argument('--concurrency', type=int, default=4, help='MISTRAL_MAX_CONCURRENCY')
+    parser.add_argument('--rps', type=float, default=0, help='MISTRAL_REQUESTS_PER_SECOND (0 - без ограничения)')
+    parser.add_argument('--streaming', choices=['true', 'false'], default='true', help='MISTRAL_STREAMING')
+    parser.add_argument('--processes', type=int, default=0,
+                        help='Процессов-классификаторов (CLASSIFIER_PROCESSES), 0 - в одном процессе')
+    parser.add_argument('--wal', action='store_true', help='Включить журнал предзаписи очереди')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help='Вывести результат в JSON')
+    parser.add_argument('--check', action='store_true',
+                        help='Код возврата 1, если переслана не каждая заявка (только с --error-rate 0)')
+    args = parser.parse_args()
+
+    port = free_port()
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(
+        target=fake_mistral.run, args=('127.0.0.1', port, args.latency, args.jitter, args.error_rate, ready),
+        daemon=True)
+    server.start()
+    ready.wait(10)
+    mistral_url = f'http://127.0.0.1:{port}'
+
+    # Настройки читаются config.py при импорте модулей проекта, поэтому задаём их до импорта
+    os.environ.update({
+        'MISTRAL_SERVER_URL': mistral_url,
+        'MISTRAL_API_KEY': 'benchmark',
+        'FORWARD_CLIENT_USERNAME': 'benchmark_sink',
+        'MESSAGE_BATCH_SIZE': str(args.batch_size),
+        'MESSAGE_BATCH_MAX_AGE': str(args.batch_age),
+        'MESSAGE_QUEUE_MAXSIZE': str(max(args.batch_size * 10, 1000)),
+        'MISTRAL_MAX_CONCURRENCY': str(args.concurrency),
+        'MISTRAL_REQUESTS_PER_SECOND': str(args.rps),
+        'MISTRAL_STREAMING': args.streaming,
+        'MISTRAL_BASE_BACKOFF': '0.2',
+        'PREFILTER_RULES_PATH': '',
+    })
+    try:
+        result = asyncio.run(run_benchmark(args, mistral_url))
+        import httpx
+        stats = httpx.get(f'{mistral_url}/stats').json()
+    finally:
+        server.terminate()
+    result['llm_requests'] = stats['requests']
+    result['llm_errors'] = stats['errors']
+    result['llm_calls_per_1k'] = round(stats['requests'] * 1000 / args.count, 2)
+
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False))
+    else:
+        print_report(result)
+    if args.check and (result['forwarded'] != result['leads'] or not result['processed']):
+        print(f"Проверка не пройдена: заявок {result['leads']}, переслано {result['forwarded']}, "
+              f"обработано {result['processed']}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
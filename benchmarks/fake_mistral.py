@@ -0,0 +1,159 @@
+"""
+Локальная заглушка API Mistral для бенчмарков.
+Отвечает на POST /v1/chat/completions (обычный и потоковый режим) вердиктами по ключевым словам,
+с настраиваемой задержкой и долей ошибок 429/500. GET /stats возвращает количество запросов.
+
+Запуск отдельно:
+    python -m benchmarks.fake_mistral --port 8089 --latency 0.5 --error-rate 0.05
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+from typing import Dict, List, Tuple
+
+MARKDOWN_RE = re.compile(r'[*_`~]+')
+MESSAGE_LINE_RE = re.compile(r'Message id: (-?\d+), chanel_id: (-?\d+), sender_id: (-?\d+|None), text: (.*)')
+
+
+def classify(text: str) -> str:
+    """Категория сообщения по ключевым словам, как её вернула бы модель."""
+    # Текст приходит в markdown (event.text), разметка не должна мешать поиску слов
+    text = MARKDOWN_RE.sub('', text).lower()
+    if 'ищу' in text or 'нужен' in text or 'нужна' in text:
+        return 'seeking_ok'
+    if 'выиграйте' in text or 'оцени меня' in text:
+        return 'spam'
+    if 'скидка' in text or 'бесплатно' in text or 'звоните' in text:
+        return 'advertising'
+    return 'irrelevant'
+
+
+def make_verdicts(content: str) -> str:
+    verdicts = []
+    for message_id, chat_id, sender_id, text in MESSAGE_LINE_RE.findall(content):
+        verdicts.append({
+            'message_id': int(message_id),
+            'chanel_id': int(chat_id),
+            'sender_id': None if sender_id == 'None' else int(sender_id),
+            'category': classify(text),
+        })
+    return '```json\n' + json.dumps(verdicts, ensure_ascii=False, indent=1) + '\n```'
+
+
+class FakeMistralServer:
+    def __init__(self, latency: float = 0.3, jitter: float = 0.1, error_rate: float = 0.0,
+                 stream_chunk: int = 64, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.stream_chunk = stream_chunk
+        self.rng = random.Random(seed)
+        self.stats: Dict[str, int] = {'requests': 0, 'errors': 0, 'messages': 0}
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Tuple[str, str, bytes]:
+        request_line = (await reader.readline()).decode()
+        if not request_line:
+            raise ConnectionError
+        method, path, _ = request_line.split(' ', 2)
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode().strip()
+            if not line:
+                break
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get('content-length', 0)))
+        return method, path, body
+
+    @staticmethod
+    def _response(writer: asyncio.StreamWriter, status: int, body: bytes,
+                  content_type: str = 'application/json') -> None:
+        reason = {200: 'OK', 404: 'Not Found', 429: 'Too Many Requests', 500: 'Internal Server Error'}[status]
+        writer.write(f'HTTP/1.1 {status} {reason}\r\ncontent-type: {content_type}\r\n'
+                     f'content-length: {len(body)}\r\n\r\n'.encode() + body)
+
+    async def _stream(self, writer: asyncio.StreamWriter, content: str) -> None:
+        writer.write(b'HTTP/1.1 200 OK\r\ncontent-type: text/event-stream\r\ntransfer-encoding: chunked\r\n\r\n')
+        parts: List[str] = [content[i:i + self.stream_chunk] for i in range(0, len(content), self.stream_chunk)]
+        for part in parts:
+            event = {'id': 'bench', 'object': 'chat.completion.chunk', 'model': 'bench', 'created': 0,
+                     'choices': [{'index': 0, 'delta': {'content': part}, 'finish_reason': None}]}
+            data = f'data: {json.dumps(event, ensure_ascii=False)}\n\n'.encode()
+            writer.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+            await writer.drain()
+            # Модель отдаёт ответ постепенно: задержка распределена по фрагментам
+            await asyncio.sleep(self.latency / max(len(parts), 1))
+        data = b'data: [DONE]\n\n'
+        writer.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n0\r\n\r\n')
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                method, path, body = await self._read_request(reader)
+                if method == 'GET' and path == '/stats':
+                    self._response(writer, 200, json.dumps(self.stats).encode())
+                elif method == 'POST' and path.endswith('/chat/completions'):
+                    await self._completion(writer, json.loads(body))
+                else:
+                    self._response(writer, 404, b'{"message": "not found"}')
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _completion(self, writer: asyncio.StreamWriter, request: dict) -> None:
+        self.stats['requests'] += 1
+        if self.rng.random() < self.error_rate:
+            self.stats['errors'] += 1
+            await asyncio.sleep(self.latency / 10)
+            status = self.rng.choice([429, 500])
+            self._response(writer, status, b'{"message": "fake error"}')
+            return
+        content = ''.join(message['content'] for message in request['messages'] if message['role'] == 'user')
+        self.stats['messages'] += len(MESSAGE_LINE_RE.findall(content))
+        answer = make_verdicts(content)
+        if request.get('stream'):
+            await self._stream(writer, answer)
+            return
+        await asyncio.sleep(max(0.0, self.rng.gauss(self.latency, self.jitter)))
+        response = {
+            'id': 'bench', 'object': 'chat.completion', 'model': request.get('model', 'bench'), 'created': 0,
+            'usage': {'prompt_tokens': len(content) // 3, 'completion_tokens': len(answer) // 3,
+                      'total_tokens': (len(content) + len(answer)) // 3},
+            'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': answer}}],
+        }
+        self._response(writer, 200, json.dumps(response, ensure_ascii=False).encode())
+
+    async def serve(self, host: str, port: int, ready=None) -> None:
+        server = await asyncio.start_server(self.handle, host, port)
+        if ready is not None:
+            ready.set()
+        async with server:
+            await server.serve_forever()
+
+
+def run(host: str, port: int, latency: float, jitter: float, error_rate: float, ready=None) -> None:
+    """Запускает заглушку; используется как цель отдельного процесса."""
+    server = FakeMistralServer(latency=latency, jitter=jitter, error_rate=error_rate)
+    try:
+        asyncio.run(server.serve(host, port, ready))
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.3, help='Средняя задержка ответа, с')
+    parser.add_argument('--jitter', type=float, default=0.1, help='Разброс задержки, с')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Доля ответов 429/500')
+    args = parser.parse_args()
+    run(args.host, args.port, args.latency, args.jitter, args.error_rate)
+
+
+if __name__ == '__main__':
+    main()
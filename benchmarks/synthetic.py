@@ -0,0 +1,103 @@
+"""
+Генератор синтетических событий NewMessage для бенчмарков.
+События собираются из настоящих TL-объектов Telethon так же, как их получает обработчик клиента.
+"""
+import random
+from datetime import datetime
+from typing import Optional, Tuple
+
+from telethon import TelegramClient, events, types
+
+CHATTER_TEXTS = [
+    '1', 'На завтра', 'Я могу', 'Будет 2', 'Сколько надо человек?', 'Сегодня к 9 вечера?', 'Спасибо!',
+    'Кто едет завтра на объект?', 'Всем привет', 'Ок', 'Договорились', 'А где это?',
+]
+LEAD_TEMPLATES = [
+    'Ищу бригаду для строительства бани {a} на {b} из бруса, {place}',
+    'Нужен прораб на строительство дома из газобетона, {place}, бюджет {price} руб',
+    'Ищу мастера по укладке плитки в ванной, {place}. Телефон {phone}',
+    'Нужна консультация по фундаменту под дом {a}x{b}, участок в {place}',
+]
+AD_TEMPLATES = [
+    'Выполняем полный комплекс работ по благоустройству: монтаж брусчатки, бордюров, газон с гарантией. '
+    'Звоните {phone} 🔥',
+    'Скидка {a}% на кровельные работы только до конца месяца! Закажите сейчас {phone}',
+    'ГАРАНТИРОВАННО в СРОК сделаем ремонт вашего дома. БЕСПЛАТНО замер и смета. Пишите {phone}',
+]
+SPAM_TEMPLATES = [
+    'Выиграйте iPhone бесплатно! Переходите по ссылке http://promo{a}.example и забирайте приз',
+    'Оцени меня 😍 переходи в профиль, там ссылка {a}',
+]
+PLACES = ['Опалиха', 'Истра', 'Красногорск', 'Дмитров', 'Звенигород', 'Одинцово']
+
+
+def random_phone(rng: random.Random) -> str:
+    digits = f'9{rng.randint(0, 99):02d}{rng.randint(0, 9999999):07d}'
+    formats = ['+7 ({0}) {1}-{2}-{3}', '8{0}{1}{2}{3}', '+7{0}{1}{2}{3}', '8 {0} {1} {2} {3}']
+    return rng.choice(formats).format(digits[:3], digits[3:6], digits[6:8], digits[8:])
+
+
+class SyntheticTraffic:
+    """
+    Поток синтетических групповых сообщений: болтовня, заявки на строительство, реклама и спам.
+    Рекламу и спам рассылают одни и те же отправители по многим группам, как в реальном трафике.
+    """
+
+    def __init__(self, chats: int = 500, lead_ratio: float = 0.05, ad_ratio: float = 0.15,
+                 spam_ratio: float = 0.05, seed: int = 0):
+        self.rng = random.Random(seed)
+        self.chats = chats
+        self.lead_ratio = lead_ratio
+        self.ad_ratio = ad_ratio
+        self.spam_ratio = spam_ratio
+        self._spammers = [self.rng.randint(10 ** 9, 2 * 10 ** 9) for _ in range(20)]
+        self._next_id = 0
+
+    def _fill(self, template: str) -> str:
+        rng = self.rng
+        return template.format(a=rng.randint(2, 12), b=rng.randint(2, 12), place=rng.choice(PLACES),
+                               price=rng.randint(1, 50) * 100000, phone=random_phone(rng))
+
+    def next_text(self) -> Tuple[str, str, int]:
+        """Возвращает (вид сообщения, текст, id отправителя)."""
+        rng = self.rng
+        roll = rng.random()
+        if roll < self.lead_ratio:
+            return 'lead', self._fill(rng.choice(LEAD_TEMPLATES)), rng.randint(1, 10 ** 9)
+        roll -= self.lead_ratio
+        if roll < self.ad_ratio:
+            return 'ad', self._fill(rng.choice(AD_TEMPLATES)), rng.choice(self._spammers)
+        roll -= self.ad_ratio
+        if roll < self.spam_ratio:
+            return 'spam', self._fill(rng.choice(SPAM_TEMPLATES)), rng.choice(self._spammers)
+        return 'chatter', rng.choice(CHATTER_TEXTS), rng.randint(1, 10 ** 9)
+
+    def next_event(self, client: TelegramClient) -> Tuple[str, events.NewMessage.Event]:
+        """Возвращает (вид сообщения, событие нового сообщения в группе)."""
+        kind, text, sender_id = self.next_text()
+        self._next_id += 1
+        chat_id = self.rng.randint(1, self.chats)
+        return kind, make_event(client, self._next_id, text, chat_id, sender_id)
+
+
+def make_event(client: TelegramClient, message_id: int, text: str, chat_id: int, sender_id: int,
+               date: Optional[datetime] = None) -> events.NewMessage.Event:
+    """Собирает событие нового сообщения в супергруппе вместе с сущностями обновления."""
+    message = types.Message(
+        id=message_id,
+        peer_id=types.PeerChannel(chat_id),
+        date=date or datetime.now(),
+        message=text,
+        from_id=types.PeerUser(sender_id),
+        entities=[types.MessageEntityBold(offset=0, length=min(4, len(text)))],
+    )
+    event = events.NewMessage.Event(message)
+    # Сущности приходят вместе с обновлением и хранятся в событии
+    event._entities = {
+        chat_id: types.Channel(id=chat_id, title=f'group {chat_id}', photo=types.ChatPhotoEmpty(),
+                               date=datetime.now(), access_hash=chat_id * 7919, megagroup=True),
+        sender_id: types.User(id=sender_id, access_hash=sender_id * 104729, first_name='Имя',
+                              last_name='Фамилия', username=f'user{sender_id}'),
+    }
+    event._set_client(client)
+    return event
@@ -9,17 +9,118 @@ API_ID = int(os.getenv('TELEGRAM_API_ID', '0'))
 API_HASH = os.getenv('TELEGRAM_API_HASH', '')
 SESSION_NAME = os.getenv('TELEGRAM_SESSION_NAME', 'tg_session')
 SYSTEM_VERSION = os.getenv('TELEGRAM_SYSTEM_VERSION', '4.16.30-debian')
+# Дополнительные аккаунты (имена сессий через запятую) для распределения групп между аккаунтами
+EXTRA_SESSION_NAMES = [name.strip() for name in os.getenv('TELEGRAM_EXTRA_SESSIONS', '').split(',') if name.strip()]
+
+# Каталог с промптами и правилами фильтрации
+PROMPTS_DIR = os.getenv('PROMPTS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src', 'prompts'))
 
 # Mistral AI
 MISTRAL_API_KEY = os.getenv('MISTRAL_API_KEY', '')
 MISTRAL_API_MODEL = os.getenv('MISTRAL_API_MODEL', 'mistral-tiny')
 MISTRAL_API_KEY_PARSING_GROUP = os.getenv('MISTRAL_API_KEY_PARSING_GROUP', '')
+# Бюджет токенов на один запрос классификации (промпт + сообщения), пачка делится на чанки
+MISTRAL_CHUNK_TOKEN_BUDGET = int(os.getenv('MISTRAL_CHUNK_TOKEN_BUDGET', '6000'))
+# Максимальное количество одновременных запросов к Mistral
+MISTRAL_MAX_CONCURRENCY = int(os.getenv('MISTRAL_MAX_CONCURRENCY', '4'))
+# Адрес API Mistral (пусто - адрес по умолчанию SDK), можно указать локальную заглушку для тестов
+MISTRAL_SERVER_URL = os.getenv('MISTRAL_SERVER_URL', '')
+# Ограничение скорости на один ключ API: запросов в секунду и токенов в секунду (0 - без ограничения).
+# По умолчанию выключено, чтобы не сводить на нет MISTRAL_MAX_CONCURRENCY; задаётся по лимитам тарифа
+MISTRAL_REQUESTS_PER_SECOND = float(os.getenv('MISTRAL_REQUESTS_PER_SECOND', '0'))
+MISTRAL_TOKENS_PER_SECOND = float(os.getenv('MISTRAL_TOKENS_PER_SECOND', '0'))
+# Повторы при 429/5xx и сетевых ошибках: количество, базовая и максимальная задержка в секундах
+MISTRAL_MAX_RETRIES = int(os.getenv('MISTRAL_MAX_RETRIES', '4'))
+MISTRAL_BASE_BACKOFF = float(os.getenv('MISTRAL_BASE_BACKOFF', '1'))
+MISTRAL_MAX_BACKOFF = float(os.getenv('MISTRAL_MAX_BACKOFF', '30'))
+# Таймаут HTTP-запроса к Mistral в секундах
+MISTRAL_TIMEOUT = float(os.getenv('MISTRAL_TIMEOUT', '60'))
+# Потоковый режим классификации сообщений: вердикты обрабатываются по мере получения ответа
+MISTRAL_STREAMING = os.getenv('MISTRAL_STREAMING', 'true').lower() in ('1', 'true', 'yes')
+# Кэш категорий сообщений по тексту: время жизни записи в секундах и максимальное количество записей
+CLASSIFICATION_CACHE_TTL = float(os.getenv('CLASSIFICATION_CACHE_TTL', '21600'))
+CLASSIFICATION_CACHE_MAX_SIZE = int(os.getenv('CLASSIFICATION_CACHE_MAX_SIZE', '10000'))
+# Индекс почти одинаковых сообщений (SimHash): окно в секундах, максимальное расстояние Хэмминга
+# между отпечатками, максимальное количество записей и минимальное количество признаков текста
+NEAR_DUPLICATE_WINDOW = float(os.getenv('NEAR_DUPLICATE_WINDOW', '3600'))
+NEAR_DUPLICATE_MAX_DISTANCE = int(os.getenv('NEAR_DUPLICATE_MAX_DISTANCE', '6'))
+NEAR_DUPLICATE_MAX_SIZE = int(os.getenv('NEAR_DUPLICATE_MAX_SIZE', '50000'))
+NEAR_DUPLICATE_MIN_FEATURES = int(os.getenv('NEAR_DUPLICATE_MIN_FEATURES', '5'))
+# Предварительный фильтр сообщений перед Mistral. Правила в JSON перечитываются при изменении файла:
+# {"min_length": 12, "require_cyrillic": true, "keywords": ["строи", ...], "stop_keywords": []}
+# Правило keywords по умолчанию выключено (список строительных слов - CONSTRUCTION_KEYWORDS в src/utils/prefilter.py)
+PREFILTER_ENABLED = os.getenv('PREFILTER_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+PREFILTER_RULES_PATH = os.getenv('PREFILTER_RULES_PATH', os.path.join(PROMPTS_DIR, 'prefilter_rules.json'))
 
 # Database
 DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite+aiosqlite:///src/telegram_clients.db')
+# Журнал SQL-запросов (очень подробный, только для отладки)
+DB_ECHO = os.getenv('DB_ECHO', 'false').lower() in ('1', 'true', 'yes')
+# Пул соединений общего движка БД: постоянные соединения и дополнительные при пиковой нагрузке
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '5'))
+# Настройки SQLite для каждого соединения: режим журнала, синхронизация с диском,
+# кэш страниц в КиБ и ожидание блокировки записи в мс
+SQLITE_JOURNAL_MODE = os.getenv('SQLITE_JOURNAL_MODE', 'WAL')
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_CACHE_SIZE_KB = int(os.getenv('SQLITE_CACHE_SIZE_KB', '16384'))
+SQLITE_BUSY_TIMEOUT = int(os.getenv('SQLITE_BUSY_TIMEOUT', '5000'))
 
 # Logging
 LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
 
 # Имя пользователя, кому пересылаем сообщения
-FORWARD_CHAT_ID = os.getenv('FORWARD_CLIENT_USERNAME', '').split(',')
+FORWARD_CHAT_ID = [chat.strip() for chat in os.getenv('FORWARD_CLIENT_USERNAME', '').split(',') if chat.strip()]
+
+# Обработка групповых сообщений
+# Сброс пачки в Mistral происходит при накоплении MESSAGE_BATCH_SIZE сообщений
+# или когда самому старому сообщению исполнилось MESSAGE_BATCH_MAX_AGE секунд
+MESSAGE_BATCH_SIZE = int(os.getenv('MESSAGE_BATCH_SIZE', '50'))
+MESSAGE_BATCH_MAX_AGE = float(os.getenv('MESSAGE_BATCH_MAX_AGE', '30'))
+# Максимальный размер очереди сообщений, при заполнении add_message ждёт освобождения места
+MESSAGE_QUEUE_MAXSIZE = int(os.getenv('MESSAGE_QUEUE_MAXSIZE', '1000'))
+# Количество процессов-классификаторов. 0 - классификация в процессе клиента Telegram,
+# больше 0 - клиент только принимает сообщения и передаёт их процессам-классификаторам.
+# По умолчанию выключено: на bench_pipeline выигрыша нет, узкое место - ожидание ответов Mistral
+CLASSIFIER_PROCESSES = int(os.getenv('CLASSIFIER_PROCESSES', '0'))
+# Обрабатывать сообщения только из групп со статусом 'connected' в БД
+TRACKED_CHATS_ONLY = os.getenv('TRACKED_CHATS_ONLY', 'true').lower() in ('1', 'true', 'yes')
+# Кэш разрешения имён групп (id, access_hash, тип) в БД: время жизни записи в секундах, 0 - без ограничения
+ENTITY_CACHE_TTL = float(os.getenv('ENTITY_CACHE_TTL', str(7 * 24 * 3600)))
+# Парсинг групп (/start_pars): запросов истории в секунду на аккаунт, размер очередей между этапами
+# и интервал отчёта о ходе парсинга в секундах
+PARSE_FETCH_RATE = float(os.getenv('PARSE_FETCH_RATE', '1'))
+PARSE_QUEUE_SIZE = int(os.getenv('PARSE_QUEUE_SIZE', '100'))
+PARSE_PROGRESS_INTERVAL = float(os.getenv('PARSE_PROGRESS_INTERVAL', '60'))
+# Отложенная запись изменений групп (парсинг, вступление): запись одной транзакцией при накоплении
+# GROUP_UPDATE_BATCH_SIZE групп или через GROUP_UPDATE_FLUSH_INTERVAL мс после первого изменения
+GROUP_UPDATE_BATCH_SIZE = int(os.getenv('GROUP_UPDATE_BATCH_SIZE', '50'))
+GROUP_UPDATE_FLUSH_INTERVAL = float(os.getenv('GROUP_UPDATE_FLUSH_INTERVAL', '1000'))
+# Окно активности группы в часах и максимум новых сообщений за одну проверку группы
+PARSE_WINDOW_HOURS = float(os.getenv('PARSE_WINDOW_HOURS', '24'))
+PARSE_HISTORY_LIMIT = int(os.getenv('PARSE_HISTORY_LIMIT', '100'))
+# Повторная проверка групп 'bad_second', проверенных больше PARSE_RECHECK_HOURS часов назад (0 - только новые
+# группы 'test'); группы 'second' ждут вступления и не перепроверяются. Если интервал меньше окна, загружаются
+# только новые сообщения, и статус меняется, только если по ним группа проходит в 'second'
+PARSE_RECHECK_HOURS = float(os.getenv('PARSE_RECHECK_HOURS', '6'))
+# Аренда массовых заданий (парсинг, вступление в группы) в секундах: задание, аренду которого процесс
+# не продлил за это время, продолжает другой процесс или тот же бот после перезапуска
+JOB_LEASE_SECONDS = float(os.getenv('JOB_LEASE_SECONDS', '120'))
+# Темп вступления в группы для каждого аккаунта: начальный, минимальный и максимальный интервал между
+# вступлениями в секундах. FloodWait умножает темп на JOIN_BACKOFF_FACTOR, каждые JOIN_INCREASE_AFTER
+# успешных вступлений подряд темп осторожно увеличивается. Состояние сохраняется в JOIN_STATE_PATH
+JOIN_INTERVAL = float(os.getenv('JOIN_INTERVAL', '300'))
+JOIN_MIN_INTERVAL = float(os.getenv('JOIN_MIN_INTERVAL', '60'))
+JOIN_MAX_INTERVAL = float(os.getenv('JOIN_MAX_INTERVAL', '3600'))
+JOIN_BACKOFF_FACTOR = float(os.getenv('JOIN_BACKOFF_FACTOR', '0.5'))
+JOIN_INCREASE_AFTER = int(os.getenv('JOIN_INCREASE_AFTER', '5'))
+JOIN_STATE_PATH = os.getenv('JOIN_STATE_PATH', 'src/join_state.json')
+# Журнал предзаписи очереди сообщений: необработанные сообщения восстанавливаются после перезапуска.
+# Пустой путь отключает журнал. Запись на диск - одним fsync раз в MESSAGE_WAL_FLUSH_INTERVAL секунд
+MESSAGE_WAL_PATH = os.getenv('MESSAGE_WAL_PATH', 'src/message_wal.jsonl')
+MESSAGE_WAL_FLUSH_INTERVAL = float(os.getenv('MESSAGE_WAL_FLUSH_INTERVAL', '0.2'))
+MESSAGE_WAL_MAX_BYTES = int(os.getenv('MESSAGE_WAL_MAX_BYTES', str(4 * 1024 * 1024)))
+
+# Метрики в текстовом формате Prometheus: GET http://METRICS_HOST:METRICS_PORT/metrics, 0 отключает сервер
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))
@@ -2,12 +2,16 @@ from __future__ import annotations
 
 import asyncio
 from datetime import datetime
-from typing import List, Optional, Any
+from typing import Dict, List, Optional, Any, Iterable, Set
 
-from sqlalchemy import select, update, delete
+from sqlalchemy import select, update, delete, inspect, text, event, bindparam, func
 from sqlalchemy.ext.asyncio import AsyncAttrs, async_sessionmaker, AsyncSession, create_async_engine
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime
+
+from config import DATABASE_URL, DB_ECHO, DB_POOL_SIZE, DB_MAX_OVERFLOW, SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS, \
+    SQLITE_CACHE_SIZE_KB, SQLITE_BUSY_TIMEOUT
+from src.utils.metrics import DB_QUERY_SECONDS
 
 
 class Base(AsyncAttrs, DeclarativeBase):
@@ -21,6 +25,47 @@ class GroupChats(Base):
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
     status: Mapped[str] = mapped_column(String, default='test')
     channel_id: Mapped[int] = mapped_column(Integer, default=0)
+    # Водяной знак парсинга: последнее просмотренное сообщение (дата в UTC) и статистика активности
+    last_message_id: Mapped[int] = mapped_column(Integer, default=0, server_default='0')
+    last_message_date: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    message_count: Mapped[int] = mapped_column(Integer, default=0, server_default='0')
+    last_checked_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+
+
+class BlockedSenders(Base):
+    __tablename__ = 'blocked_senders'
+    sender_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+
+
+class ResolvedEntities(Base):
+    """Кэш разрешения имён групп: имя пользователя -> id, access_hash и тип сущности для каждого аккаунта"""
+    __tablename__ = 'resolved_entities'
+    # access_hash действителен только для аккаунта, который его получил
+    account: Mapped[str] = mapped_column(String, primary_key=True)
+    username: Mapped[str] = mapped_column(String, primary_key=True)
+    peer_id: Mapped[int] = mapped_column(BigInteger)
+    access_hash: Mapped[int] = mapped_column(BigInteger, default=0)
+    entity_type: Mapped[str] = mapped_column(String)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+
+
+class JobRuns(Base):
+    """Запуски массовых заданий (парсинг групп, вступление в группы) с курсором и арендой"""
+    __tablename__ = 'job_runs'
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    kind: Mapped[str] = mapped_column(String, index=True)
+    # running - выполняется или прерван и будет продолжен; completed, failed - завершён
+    status: Mapped[str] = mapped_column(String, default='running')
+    # id последней группы, до которой (включительно) все группы задания обработаны
+    cursor: Mapped[int] = mapped_column(Integer, default=0)
+    total: Mapped[int] = mapped_column(Integer, default=0)
+    done: Mapped[int] = mapped_column(Integer, default=0)
+    # Процесс, выполняющий задание, и срок аренды: после его истечения задание может продолжить другой процесс
+    owner: Mapped[str] = mapped_column(String)
+    lease_until: Mapped[datetime] = mapped_column(DateTime)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
 
 
 class BaseDatabase:
@@ -28,21 +73,80 @@ class BaseDatabase:
 
 
 class Database(BaseDatabase):
-    def __init__(self, db_url: str = "sqlite+aiosqlite:///src/database/telegram_clients.db"):
-        self.engine = create_async_engine(db_url, echo=True)
+    """
+    Доступ к БД. Задачи используют общий экземпляр процесса (Database.shared): один движок
+    с пулом соединений создаётся при старте бота и не пересоздаётся на каждый запуск задачи.
+    Соединения SQLite настраиваются при открытии: журнал WAL (чтение не блокируется записью),
+    synchronous, кэш страниц и ожидание блокировки записи.
+    """
+    _instances: Dict[str, 'Database'] = {}
+    # Максимум id в одном условии IN (ограничение количества параметров запроса SQLite)
+    IN_CHUNK_SIZE = 500
+    # Отрицательный cache_size - размер кэша в КиБ, а не в страницах
+    sqlite_pragmas: Dict[str, Any] = {
+        'journal_mode': SQLITE_JOURNAL_MODE,
+        'synchronous': SQLITE_SYNCHRONOUS,
+        'cache_size': -SQLITE_CACHE_SIZE_KB,
+        'busy_timeout': SQLITE_BUSY_TIMEOUT,
+    }
+
+    def __init__(self, db_url: str = "sqlite+aiosqlite:///src/database/telegram_clients.db",
+                 echo: bool = DB_ECHO, pool_size: int = DB_POOL_SIZE, max_overflow: int = DB_MAX_OVERFLOW):
+        self.db_url = db_url
+        engine_kwargs: Dict[str, Any] = {'echo': echo}
+        # Пул с ожиданием соединения; база SQLite в памяти использует единственное соединение
+        if ':memory:' not in db_url and 'mode=memory' not in db_url:
+            engine_kwargs.update(pool_size=pool_size, max_overflow=max_overflow)
+        self.engine = create_async_engine(db_url, **engine_kwargs)
+        if self.engine.dialect.name == 'sqlite':
+            event.listen(self.engine.sync_engine, 'connect', self._set_sqlite_pragmas)
         self.async_session = async_sessionmaker(
             self.engine, expire_on_commit=False
         )
         super().__init__()
 
+    def _set_sqlite_pragmas(self, dbapi_connection, connection_record) -> None:
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in self.sqlite_pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+    @classmethod
+    def shared(cls, db_url: str = DATABASE_URL) -> 'Database':
+        """Возвращает общий экземпляр для адреса БД, создавая его при первом обращении."""
+        if db_url not in cls._instances:
+            cls._instances[db_url] = cls(db_url)
+        return cls._instances[db_url]
+
     async def create_tables(self):
         async with self.engine.begin() as conn:
             await conn.run_sync(Base.metadata.create_all)
+            await conn.run_sync(self._add_missing_columns)
+
+    @staticmethod
+    def _add_missing_columns(conn) -> None:
+        """Добавляет в существующие таблицы столбцы, появившиеся в моделях: create_all их не добавляет."""
+        inspector = inspect(conn)
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                default = f" DEFAULT {column.server_default.arg}" if column.server_default is not None else ''
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} "
+                                  f"{column.type.compile(conn.dialect)}{default}"))
 
     async def close(self):
+        if self._instances.get(self.db_url) is self:
+            del self._instances[self.db_url]
         await self.engine.dispose()
 
     # GroupChats CRUD operations
+    @DB_QUERY_SECONDS.time('create_group_chat')
     async def create_group_chat(
             self,
             name: str,
@@ -60,38 +164,102 @@ class Database(BaseDatabase):
             await session.refresh(group_chat)
             return group_chat
 
+    @DB_QUERY_SECONDS.time('get_group_chat')
     async def get_group_chat(self, chat_id: int) -> Optional[GroupChats]:
         async with self.async_session() as session:
             result = await session.execute(
                 select(GroupChats).where(GroupChats.id == chat_id))
             return result.scalar_one_or_none()
 
+    @DB_QUERY_SECONDS.time('get_group_chat_by_name')
     async def get_group_chat_by_name(self, name: str) -> Optional[GroupChats]:
         async with self.async_session() as session:
             result = await session.execute(
                 select(GroupChats).where(GroupChats.name == name))
             return result.scalar_one_or_none()
 
+    @DB_QUERY_SECONDS.time('get_all_group_chats')
     async def get_all_group_chats(self) -> List[GroupChats]:
         async with self.async_session() as session:
             result = await session.execute(select(GroupChats))
             return list(result.scalars())
 
-    async def get_chats_by_status(self, status: str) -> List[GroupChats]:
+    @DB_QUERY_SECONDS.time('get_chats_by_status')
+    async def get_chats_by_status(self, status: str, after_id: Optional[int] = None) -> List[GroupChats]:
         """
         Получить все групповые чаты с указанным статусом
 
         :param status: Значение статуса для фильтрации
+        :param after_id: Только чаты с id больше after_id, по возрастанию id (продолжение задания с курсора)
         :return: Список объектов GroupChats
         """
         async with self.async_session() as session:
-            result = await session.execute(
-                select(GroupChats)
-                .where(GroupChats.status == status)
-                .order_by(GroupChats.created_at)
+            stmt = select(GroupChats).where(GroupChats.status == status)
+            if after_id is None:
+                stmt = stmt.order_by(GroupChats.created_at)
+            else:
+                stmt = stmt.where(GroupChats.id > after_id).order_by(GroupChats.id)
+            result = await session.execute(stmt)
+            return list(result.scalars().all())
+
+    @DB_QUERY_SECONDS.time('get_chats_for_parsing')
+    async def get_chats_for_parsing(
+            self,
+            recheck_statuses: Iterable[str] = (),
+            checked_before: Optional[datetime] = None,
+            after_id: int = 0
+    ) -> List[GroupChats]:
+        """
+        Получить групповые чаты для парсинга: новые ('test') и чаты с recheck_statuses,
+        проверенные раньше checked_before или ещё не проверявшиеся
+
+        :param recheck_statuses: Статусы чатов для повторной проверки
+        :param checked_before: Граница времени прошлой проверки (UTC); None - без повторной проверки
+        :param after_id: Только чаты с id больше after_id (продолжение задания с курсора)
+        :return: Список объектов GroupChats по возрастанию id
+        """
+        condition = GroupChats.status == 'test'
+        recheck_statuses = list(recheck_statuses)
+        if checked_before is not None and recheck_statuses:
+            condition = condition | (
+                GroupChats.status.in_(recheck_statuses)
+                & (GroupChats.last_checked_at.is_(None) | (GroupChats.last_checked_at < checked_before))
             )
+        async with self.async_session() as session:
+            result = await session.execute(
+                select(GroupChats).where(condition, GroupChats.id > after_id).order_by(GroupChats.id))
             return list(result.scalars().all())
 
+    @DB_QUERY_SECONDS.time('get_connected_chat_ids')
+    async def get_connected_chat_ids(self) -> Set[int]:
+        """
+        Получить id чатов Telegram (channel_id) всех групп со статусом 'connected'
+
+        :return: Множество id чатов; группы без сохранённого channel_id пропускаются
+        """
+        async with self.async_session() as session:
+            result = await session.execute(
+                select(GroupChats.channel_id)
+                .where(GroupChats.status == 'connected', GroupChats.channel_id != 0)
+            )
+            return set(result.scalars())
+
+    @DB_QUERY_SECONDS.time('count_connected_chats_without_channel_id')
+    async def count_connected_chats_without_channel_id(self) -> int:
+        """
+        Получить количество групп со статусом 'connected' без сохранённого channel_id
+
+        :return: Количество групп
+        """
+        async with self.async_session() as session:
+            result = await session.execute(
+                select(func.count()).select_from(GroupChats)
+                .where(GroupChats.status == 'connected',
+                       (GroupChats.channel_id == 0) | GroupChats.channel_id.is_(None))
+            )
+            return result.scalar_one()
+
+    @DB_QUERY_SECONDS.time('update_group_chat')
     async def update_group_chat(
             self,
             chat_id: int,
@@ -130,6 +298,46 @@ class Database(BaseDatabase):
         #
         #     return await self.get_group_chat(chat_id)
 
+    @DB_QUERY_SECONDS.time('update_group_chats')
+    async def update_group_chats(self, values: Dict[int, Dict[str, Any]]) -> None:
+        """
+        Обновить несколько групповых чатов одной транзакцией.
+        Чаты с одинаковыми новыми значениями обновляются одним запросом UPDATE ... WHERE id IN (...),
+        остальные - одним executemany на каждый набор полей. Удалённые чаты пропускаются.
+
+        :param values: id чата -> новые значения полей (status, last_message_id, ...)
+        """
+        if not values:
+            return
+        shared: Dict[tuple, List[int]] = {}
+        for chat_id, chat_values in values.items():
+            shared.setdefault(tuple(sorted(chat_values.items())), []).append(chat_id)
+        per_row: Dict[tuple, List[Dict[str, Any]]] = {}
+        async with self.async_session() as session:
+            async with session.begin():
+                for items, chat_ids in shared.items():
+                    if len(chat_ids) == 1:
+                        keys = tuple(key for key, _ in items)
+                        per_row.setdefault(keys, []).append({'_id': chat_ids[0], **dict(items)})
+                        continue
+                    for start in range(0, len(chat_ids), self.IN_CHUNK_SIZE):
+                        await session.execute(
+                            update(GroupChats)
+                            .where(GroupChats.id.in_(chat_ids[start:start + self.IN_CHUNK_SIZE]))
+                            .values(**dict(items)))
+                if not per_row:
+                    return
+                # Core UPDATE ... WHERE id = :_id: один executemany на набор полей. В отличие от ORM-обновления
+                # по первичному ключу, отсутствующая строка не вызывает StaleDataError и не отменяет всю пачку
+                connection = await session.connection()
+                table = GroupChats.__table__
+                for keys, rows in per_row.items():
+                    await connection.execute(
+                        update(table).where(table.c.id == bindparam('_id')).values(
+                            {key: bindparam(key) for key in keys}),
+                        rows)
+
+    @DB_QUERY_SECONDS.time('delete_group_chat')
     async def delete_group_chat(self, chat_id: int) -> bool:
         async with self.async_session() as session:
             result = await session.execute(
@@ -138,6 +346,156 @@ class Database(BaseDatabase):
             await session.commit()
             return result.rowcount > 0
 
+    # BlockedSenders operations
+    @DB_QUERY_SECONDS.time('get_blocked_sender_ids')
+    async def get_blocked_sender_ids(self) -> Set[int]:
+        """
+        Получить id всех заблокированных отправителей
+
+        :return: Множество id отправителей
+        """
+        async with self.async_session() as session:
+            result = await session.execute(select(BlockedSenders.sender_id))
+            return set(result.scalars())
+
+    @DB_QUERY_SECONDS.time('add_blocked_senders')
+    async def add_blocked_senders(self, sender_ids: Iterable[int]) -> int:
+        """
+        Добавить отправителей в список блокировки одной транзакцией, уже заблокированные пропускаются
+
+        :param sender_ids: id отправителей
+        :return: Количество добавленных записей
+        """
+        sender_ids = set(sender_ids)
+        if not sender_ids:
+            return 0
+        async with self.async_session() as session:
+            async with session.begin():
+                result = await session.execute(
+                    select(BlockedSenders.sender_id).where(BlockedSenders.sender_id.in_(sender_ids)))
+                new_ids = sender_ids - set(result.scalars())
+                session.add_all(BlockedSenders(sender_id=sender_id) for sender_id in new_ids)
+            return len(new_ids)
+
+    # ResolvedEntities operations
+    @DB_QUERY_SECONDS.time('get_resolved_entities')
+    async def get_resolved_entities(self) -> List[ResolvedEntities]:
+        """
+        Получить все записи кэша разрешения имён групп
+
+        :return: Список объектов ResolvedEntities
+        """
+        async with self.async_session() as session:
+            result = await session.execute(select(ResolvedEntities))
+            return list(result.scalars())
+
+    @DB_QUERY_SECONDS.time('save_resolved_entity')
+    async def save_resolved_entity(
+            self,
+            account: str,
+            username: str,
+            peer_id: int,
+            access_hash: int,
+            entity_type: str
+    ) -> None:
+        """
+        Сохранить или обновить запись кэша разрешения имени группы
+
+        :param account: Имя аккаунта пула, получившего access_hash
+        :param username: Имя пользователя группы в нижнем регистре
+        :param peer_id: id сущности без префикса типа
+        :param access_hash: access_hash сущности (0 для обычных групп)
+        :param entity_type: Тип сущности: 'channel', 'chat' или 'user'
+        """
+        async with self.async_session() as session:
+            async with session.begin():
+                await session.merge(ResolvedEntities(
+                    account=account,
+                    username=username,
+                    peer_id=peer_id,
+                    access_hash=access_hash,
+                    entity_type=entity_type,
+                    updated_at=datetime.now()
+                ))
+
+    @DB_QUERY_SECONDS.time('delete_resolved_entity')
+    async def delete_resolved_entity(self, username: str, account: Optional[str] = None) -> int:
+        """
+        Удалить записи кэша разрешения имени группы
+
+        :param username: Имя пользователя группы в нижнем регистре
+        :param account: Имя аккаунта; None - записи всех аккаунтов
+        :return: Количество удалённых записей
+        """
+        async with self.async_session() as session:
+            stmt = delete(ResolvedEntities).where(ResolvedEntities.username == username)
+            if account is not None:
+                stmt = stmt.where(ResolvedEntities.account == account)
+            result = await session.execute(stmt)
+            await session.commit()
+            return result.rowcount
+
+    # JobRuns operations
+    @DB_QUERY_SECONDS.time('get_running_jobs')
+    async def get_running_jobs(self, kind: Optional[str] = None) -> List[JobRuns]:
+        """
+        Получить незавершённые запуски заданий
+
+        :param kind: Тип задания; None - все типы
+        :return: Список объектов JobRuns
+        """
+        async with self.async_session() as session:
+            stmt = select(JobRuns).where(JobRuns.status == 'running').order_by(JobRuns.id)
+            if kind is not None:
+                stmt = stmt.where(JobRuns.kind == kind)
+            result = await session.execute(stmt)
+            return list(result.scalars())
+
+    @DB_QUERY_SECONDS.time('create_job')
+    async def create_job(self, kind: str, owner: str, lease_until: datetime) -> JobRuns:
+        async with self.async_session() as session:
+            job = JobRuns(kind=kind, owner=owner, lease_until=lease_until)
+            session.add(job)
+            await session.commit()
+            await session.refresh(job)
+            return job
+
+    @DB_QUERY_SECONDS.time('claim_job')
+    async def claim_job(self, job_id: int, owner: str, lease_until: datetime) -> bool:
+        """
+        Взять аренду незавершённого задания: удаётся, если аренда уже принадлежит owner или истекла
+
+        :param job_id: id запуска
+        :param owner: Идентификатор процесса
+        :param lease_until: Новый срок аренды
+        :return: True, если аренда получена
+        """
+        async with self.async_session() as session:
+            result = await session.execute(
+                update(JobRuns)
+                .where(JobRuns.id == job_id, JobRuns.status == 'running',
+                       (JobRuns.owner == owner) | (JobRuns.lease_until < datetime.now()))
+                .values(owner=owner, lease_until=lease_until, updated_at=datetime.now())
+            )
+            await session.commit()
+            return result.rowcount == 1
+
+    @DB_QUERY_SECONDS.time('update_job')
+    async def update_job(self, job_id: int, owner: str, **values: Any) -> bool:
+        """
+        Обновить запуск задания (курсор, счётчики, статус, срок аренды), если аренда принадлежит owner
+
+        :return: False, если аренду перехватил другой процесс
+        """
+        async with self.async_session() as session:
+            result = await session.execute(
+                update(JobRuns)
+                .where(JobRuns.id == job_id, JobRuns.owner == owner)
+                .values(updated_at=datetime.now(), **values)
+            )
+            await session.commit()
+            return result.rowcount == 1
+
 
 # Пример использования
 async def main():
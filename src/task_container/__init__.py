@@ -1,4 +1,11 @@
 from .tasks import TaskContainer, MessageProcessor
+from .models import BufferedMessage
+from .tracked_chats import TrackedChats
+from .entity_cache import EntityCache
+from .dialog_membership import DialogMembership
+from .join_scheduler import JoinScheduler
+from .jobs import JobManager, BulkJob
+from .group_updates import GroupUpdateQueue
 __all__ = [
-    'TaskContainer','MessageProcessor'
+    'TaskContainer','MessageProcessor','BufferedMessage','TrackedChats','EntityCache','DialogMembership','JoinScheduler','JobManager','BulkJob','GroupUpdateQueue'
 ]
\ No newline at end of file
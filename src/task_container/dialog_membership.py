@@ -0,0 +1,82 @@
+# dialog_membership.py
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Set
+
+from telethon import TelegramClient, events
+
+
+class DialogMembership:
+    """
+    Индекс диалогов, в которых состоит каждый аккаунт пула (id в формате get_peer_id).
+    Список диалогов загружается один раз при старте, дальше индекс обновляется по событиям
+    вступления и выхода аккаунта и по результатам собственных JoinChannelRequest,
+    поэтому проверка членства не требует запроса к Telegram.
+    Заодно запоминаются имена пользователей загруженных диалогов: по ним id группы находится без ResolveUsername.
+    """
+    _ids: Dict[str, Set[int]] = {}
+    _locks: Dict[str, asyncio.Lock] = {}
+    # Имя пользователя диалога (в нижнем регистре) -> id в формате get_peer_id, по всем аккаунтам
+    _usernames: Dict[str, int] = {}
+
+    @classmethod
+    async def ensure_loaded(cls, account: str, client: TelegramClient) -> None:
+        """Загружает диалоги аккаунта, если индекс для него ещё не загружен."""
+        if account in cls._ids:
+            return
+        async with cls._locks.setdefault(account, asyncio.Lock()):
+            if account in cls._ids:
+                return
+            ids = set()
+            async for dialog in client.iter_dialogs():
+                ids.add(dialog.id)
+                for username in cls._entity_usernames(dialog.entity):
+                    cls._usernames[username] = dialog.id
+            cls._ids[account] = ids
+            logging.info(f"Диалогов аккаунта {account}: {len(ids)}")
+
+    @staticmethod
+    def _entity_usernames(entity: Any) -> List[str]:
+        """Основное и дополнительные имена пользователя сущности в нижнем регистре."""
+        usernames = [getattr(entity, 'username', None)]
+        usernames += [item.username for item in getattr(entity, 'usernames', None) or []]
+        return [username.lower() for username in usernames if username]
+
+    @classmethod
+    def find(cls, username: Optional[str]) -> Optional[int]:
+        """
+        Возвращает id загруженного диалога с таким именем пользователя.
+        :param username: Имя пользователя в нижнем регистре (EntityCache.normalize)
+        :return: id в формате get_peer_id или None, если ни один аккаунт не состоит в таком диалоге
+        """
+        return cls._usernames.get(username) if username else None
+
+    @classmethod
+    def contains(cls, account: str, chat_id: int) -> bool:
+        return chat_id in cls._ids.get(account, ())
+
+    @classmethod
+    def add(cls, account: str, chat_id: int) -> None:
+        cls._ids.setdefault(account, set()).add(chat_id)
+
+    @classmethod
+    def discard(cls, account: str, chat_id: int) -> None:
+        cls._ids.get(account, set()).discard(chat_id)
+
+    @classmethod
+    def count(cls, account: str) -> int:
+        return len(cls._ids.get(account, ()))
+
+    @classmethod
+    async def apply_chat_action(cls, account: str, event: events.ChatAction.Event) -> None:
+        """Обновляет индекс по событию вступления или выхода, если оно касается самого аккаунта."""
+        joined = event.user_joined or event.user_added
+        if not (joined or event.user_left or event.user_kicked):
+            return
+        me = await event.client.get_me(input_peer=True)
+        if me is None or me.user_id not in event.user_ids:
+            return
+        if joined:
+            cls.add(account, event.chat_id)
+        else:
+            cls.discard(account, event.chat_id)
@@ -0,0 +1,146 @@
+# entity_cache.py
+import logging
+import time
+from typing import Dict, Optional, Tuple
+
+from telethon import TelegramClient, errors, types
+from telethon.utils import parse_username
+
+from config import ENTITY_CACHE_TTL
+from src.database.database import Database
+from src.utils.metrics import ENTITY_RESOLVES
+
+# (peer_id, access_hash, тип сущности, время разрешения)
+Entry = Tuple[int, int, str, float]
+
+
+class EntityCache:
+    """
+    Кэш разрешения имён групп: имя пользователя -> (id, access_hash, тип) для каждого аккаунта пула.
+    Записи хранятся в БД и загружаются при старте, поэтому входной peer строится без запроса
+    ResolveUsername, который Telegram сильно ограничивает по FloodWait.
+    access_hash действителен только для аккаунта, который его получил, поэтому ключ включает имя аккаунта.
+    Запись удаляется, когда Telegram сообщает, что имя больше не занято или группа стала недоступна.
+    """
+    _entries: Dict[Tuple[str, str], Entry] = {}
+    _ttl: float = ENTITY_CACHE_TTL
+    # Ошибки, после которых сохранённые данные имени считаются устаревшими
+    INVALIDATING_ERRORS = (errors.UsernameNotOccupiedError, errors.UsernameInvalidError,
+                           errors.ChannelPrivateError, errors.ChannelInvalidError, errors.PeerIdInvalidError)
+
+    @staticmethod
+    def normalize(name: str) -> Optional[str]:
+        """
+        Приводит имя группы (@name, t.me/name, name) к имени пользователя в нижнем регистре.
+        :return: Имя или None для ссылок-приглашений, которые не кэшируются
+        """
+        username, is_join_chat = parse_username(name)
+        if not username or is_join_chat:
+            return None
+        return username.lower()
+
+    @classmethod
+    async def load(cls, db: Database) -> None:
+        """Загружает записи кэша из БД."""
+        cls._entries = {
+            (row.account, row.username): (row.peer_id, row.access_hash, row.entity_type, row.updated_at.timestamp())
+            for row in await db.get_resolved_entities()
+        }
+        logging.info(f"Загружено записей кэша имён групп: {len(cls._entries)}")
+
+    @staticmethod
+    def _input_peer(peer_id: int, access_hash: int, entity_type: str) -> Optional[types.TypeInputPeer]:
+        if entity_type == 'channel':
+            return types.InputPeerChannel(peer_id, access_hash)
+        if entity_type == 'chat':
+            return types.InputPeerChat(peer_id)
+        if entity_type == 'user':
+            return types.InputPeerUser(peer_id, access_hash)
+        return None
+
+    @staticmethod
+    def _entry(peer: types.TypeInputPeer) -> Optional[Tuple[int, int, str]]:
+        if isinstance(peer, types.InputPeerChannel):
+            return peer.channel_id, peer.access_hash, 'channel'
+        if isinstance(peer, types.InputPeerChat):
+            return peer.chat_id, 0, 'chat'
+        if isinstance(peer, types.InputPeerUser):
+            return peer.user_id, peer.access_hash, 'user'
+        return None
+
+    @classmethod
+    def get(cls, account: str, name: str) -> Optional[types.TypeInputPeer]:
+        """
+        Возвращает входной peer группы из кэша без обращения к сети.
+        :param account: Имя аккаунта пула
+        :param name: Имя группы
+        :return: InputPeer или None, если записи нет или она устарела
+        """
+        username = cls.normalize(name)
+        entry = cls._entries.get((account, username)) if username else None
+        if entry is None or (cls._ttl and time.time() - entry[3] > cls._ttl):
+            return None
+        return cls._input_peer(*entry[:3])
+
+    @classmethod
+    async def resolve(cls, client: TelegramClient, account: str, name: str,
+                      db: Database) -> types.TypeInputPeer:
+        """
+        Возвращает входной peer группы: из кэша или, при промахе, через Telegram с сохранением в кэш.
+        :param client: Клиент аккаунта account
+        :param account: Имя аккаунта пула
+        :param name: Имя группы
+        :param db: База данных для сохранения записи
+        :return: InputPeer; ссылки-приглашения разрешаются через Telegram без сохранения в кэш
+        """
+        peer = cls.get(account, name)
+        if peer is not None:
+            ENTITY_RESOLVES.inc(1, 'cache')
+            return peer
+        ENTITY_RESOLVES.inc(1, 'telegram')
+        username = cls.normalize(name)
+        if username is None:
+            return await client.get_input_entity(name)
+        try:
+            peer = await client.get_input_entity(name)
+        except ValueError as e:
+            if cls._is_not_found(e):
+                # Имя не занято: устаревшая запись больше не нужна
+                await cls.invalidate(name, db)
+            raise
+        entry = cls._entry(peer)
+        if entry is not None:
+            cls._entries[(account, username)] = (*entry, time.time())
+            try:
+                await db.save_resolved_entity(account, username, *entry)
+            except Exception as e:
+                logging.error(f"Не удалось сохранить запись кэша имени {username}: {e}")
+        return peer
+
+    @staticmethod
+    def _is_not_found(error: ValueError) -> bool:
+        """
+        Сообщает ли ValueError Telethon, что имя никому не принадлежит. Остальные ValueError
+        (например, ошибки запроса) не означают, что сохранённые записи имени устарели.
+        """
+        if isinstance(error.__cause__, errors.UsernameNotOccupiedError):
+            return True
+        return str(error).startswith(('No user has', 'Cannot find any entity corresponding to'))
+
+    @classmethod
+    async def invalidate(cls, name: str, db: Database) -> None:
+        """Удаляет записи имени группы для всех аккаунтов из памяти и БД."""
+        username = cls.normalize(name)
+        if username is None:
+            return
+        for key in [key for key in cls._entries if key[1] == username]:
+            del cls._entries[key]
+        try:
+            await db.delete_resolved_entity(username)
+        except Exception as e:
+            logging.error(f"Не удалось удалить запись кэша имени {username}: {e}")
+        logging.info(f"Запись кэша имени {username} удалена")
+
+    @classmethod
+    def count(cls) -> int:
+        return len(cls._entries)
@@ -0,0 +1,114 @@
+# group_updates.py
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+
+from config import GROUP_UPDATE_BATCH_SIZE, GROUP_UPDATE_FLUSH_INTERVAL
+from src.database.database import Database
+
+
+class GroupUpdateQueue:
+    """
+    Отложенная запись изменений групп (статус, channel_id, водяной знак парсинга) в БД.
+    Изменения парсинга и вступления в группы копятся в памяти и записываются одной транзакцией
+    (Database.update_group_chats), когда накопилось batch_size групп или прошло flush_interval мс
+    с первого незаписанного изменения. Несколько изменений одной группы до записи объединяются.
+    put возвращает future, который завершается после записи пачки с этим изменением:
+    курсор задания сдвигается только по записанным группам.
+    """
+    _instances: Dict[str, 'GroupUpdateQueue'] = {}
+
+    def __init__(self, db: Database, batch_size: int = GROUP_UPDATE_BATCH_SIZE,
+                 flush_interval: float = GROUP_UPDATE_FLUSH_INTERVAL):
+        self.db = db
+        self.batch_size = max(batch_size, 1)
+        self.flush_interval = flush_interval / 1000
+        self._pending: Dict[int, Dict[str, Any]] = {}
+        self._written: Optional[asyncio.Future] = None
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._writing: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self._closed = False
+
+    @classmethod
+    def shared(cls, db: Database) -> 'GroupUpdateQueue':
+        """Возвращает общую очередь для БД, создавая её при первом обращении."""
+        if db.db_url not in cls._instances:
+            cls._instances[db.db_url] = cls(db)
+        return cls._instances[db.db_url]
+
+    @classmethod
+    async def close_all(cls) -> None:
+        """Записывает оставшиеся изменения всех общих очередей и останавливает их."""
+        instances = list(cls._instances.values())
+        cls._instances.clear()
+        for instance in instances:
+            await instance.close()
+
+    def put(self, chat_id: int, values: Dict[str, Any]) -> asyncio.Future:
+        """
+        Добавляет изменение группы в очередь.
+        :param chat_id: id группы в БД
+        :param values: Новые значения полей
+        :return: Future, завершающийся после записи (результат False, если запись не удалась)
+        """
+        if self._task is None or self._task.done():
+            self._closed = False
+            self._task = asyncio.create_task(self._flush_loop())
+        new_chat = chat_id not in self._pending
+        self._pending.setdefault(chat_id, {}).update(values)
+        if self._written is None:
+            self._written = asyncio.get_running_loop().create_future()
+        written = self._written
+        # Первая группа пачки запускает таймер, заполненная пачка записывается сразу. Изменения уже
+        # ожидающей группы объединяются и не будят запись повторно
+        if new_chat and (len(self._pending) == 1 or len(self._pending) >= self.batch_size):
+            self._wakeup.set()
+        return written
+
+    async def _flush_loop(self) -> None:
+        while not self._closed:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if not self._closed and len(self._pending) < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Записывает накопленные изменения одной транзакцией."""
+        async with self._flush_lock:
+            if self._writing is not None and not self._writing.done():
+                # Предыдущая запись продолжилась после отмены ожидавшей её задачи
+                await asyncio.shield(self._writing)
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            written, self._written = self._written, None
+            # Отмена задачи, ожидающей записи, не прерывает транзакцию: изменения не теряются
+            self._writing = asyncio.ensure_future(self._write(pending, written))
+            await asyncio.shield(self._writing)
+
+    async def _write(self, pending: Dict[int, Dict[str, Any]], written: asyncio.Future) -> None:
+        try:
+            await self.db.update_group_chats(pending)
+            written.set_result(True)
+        except Exception as e:
+            logging.error(f"Ошибка записи изменений групп ({len(pending)}): {e}")
+            written.set_result(False)
+
+    async def close(self) -> None:
+        """Записывает оставшиеся изменения и останавливает фоновую запись."""
+        self._closed = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        await self.flush()
+
+    def pending(self) -> int:
+        return len(self._pending)
@@ -0,0 +1,187 @@
+# jobs.py
+import asyncio
+import logging
+import socket
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from telethon import events
+
+from config import JOB_LEASE_SECONDS, SESSION_NAME
+from src.database.database import Database, JobRuns
+
+
+class CursorTracker:
+    """
+    Курсор задания при обработке групп не по порядку: группы выдаются по возрастанию id,
+    а курсор сдвигается только до группы, перед которой все группы уже обработаны.
+    """
+
+    def __init__(self, ids: List[int], cursor: int = 0):
+        self._ids = sorted(ids)
+        self._completed = set()
+        self._position = 0
+        self.cursor = cursor
+
+    def complete(self, chat_id: int) -> None:
+        self._completed.add(chat_id)
+        while self._position < len(self._ids) and self._ids[self._position] in self._completed:
+            self._completed.discard(self._ids[self._position])
+            self.cursor = self._ids[self._position]
+            self._position += 1
+
+
+class BulkJob:
+    """
+    Запуск массового задания: строка job_runs с курсором и арендой.
+    Пока задание выполняется, аренда продлевается каждые lease_seconds / 3 секунд.
+    Отчёты о ходе задания отправляются всем подписчикам - командам, запустившим задание или присоединившимся к нему.
+    """
+
+    def __init__(self, db: Database, row: JobRuns, owner: str, lease_seconds: float):
+        self.db = db
+        self.id = row.id
+        self.kind = row.kind
+        self.cursor = row.cursor
+        self.total = row.total
+        self.done = row.done
+        # Задание продолжено с курсора, а не начато заново
+        self.resumed = bool(row.cursor or row.done)
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self.subscribers: List[events.NewMessage.Event] = []
+        self._heartbeat: Optional[asyncio.Task] = None
+        self.lost = False
+
+    def _lease_until(self) -> datetime:
+        return datetime.now() + timedelta(seconds=self.lease_seconds)
+
+    def start_heartbeat(self) -> None:
+        self._heartbeat = asyncio.create_task(self._renew_loop())
+
+    async def _renew_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                if not await self.db.update_job(self.id, self.owner, lease_until=self._lease_until()):
+                    self.lost = True
+                    logging.error(f"Аренда задания {self.kind} #{self.id} перехвачена другим процессом")
+                    return
+            except Exception as e:
+                logging.error(f"Не удалось продлить аренду задания {self.kind} #{self.id}: {e}")
+
+    def subscribe(self, event: Optional[events.NewMessage.Event]) -> None:
+        if event is not None:
+            self.subscribers.append(event)
+
+    async def notify(self, text: str) -> None:
+        """Отправляет отчёт всем подписчикам; у продолженного после перезапуска задания их может не быть."""
+        logging.info(text)
+        for event in self.subscribers:
+            try:
+                await event.reply(text)
+            except Exception as e:
+                logging.error(f"Не удалось отправить отчёт задания {self.kind}: {e}")
+
+    async def set_total(self, total: int) -> None:
+        self.total = total
+        await self.db.update_job(self.id, self.owner, total=total)
+
+    async def checkpoint(self, cursor: int, done: int) -> None:
+        """Сохраняет курсор и количество обработанных групп; вызывается после записи их результатов в БД."""
+        if cursor == self.cursor and done == self.done:
+            return
+        self.cursor = cursor
+        self.done = done
+        try:
+            await self.db.update_job(self.id, self.owner, cursor=cursor, done=done, lease_until=self._lease_until())
+        except Exception as e:
+            logging.error(f"Не удалось сохранить курсор задания {self.kind} #{self.id}: {e}")
+
+    async def finish(self, status: Optional[str]) -> None:
+        """
+        Завершает запуск.
+        :param status: 'completed' или 'failed'; None - задание прервано и будет продолжено с курсора
+        """
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+        values = {'lease_until': datetime.now()}
+        if status is not None:
+            values['status'] = status
+        try:
+            await self.db.update_job(self.id, self.owner, **values)
+        except Exception as e:
+            logging.error(f"Не удалось сохранить состояние задания {self.kind} #{self.id}: {e}")
+
+    def progress(self) -> str:
+        return f"обработано {self.done} из {self.total}"
+
+
+class JobManager:
+    """
+    Массовые задания процесса. В каждый момент выполняется не больше одного запуска задания каждого типа:
+    повторная команда присоединяется к выполняющемуся запуску, а не запускает второй.
+    Незавершённый запуск с истёкшей арендой (или арендой этого же бота) продолжается с курсора.
+    """
+    _owner: str = f"{socket.gethostname()}:{SESSION_NAME}"
+    _lease_seconds: float = JOB_LEASE_SECONDS
+    _running: Dict[str, BulkJob] = {}
+    _lock = asyncio.Lock()
+
+    @classmethod
+    async def start(cls, db: Database, kind: str, event: Optional[events.NewMessage.Event]) -> Optional[BulkJob]:
+        """
+        Запускает или продолжает задание.
+        :param db: База данных задания
+        :param kind: Тип задания ('parse_groups', 'join_groups')
+        :param event: Команда, запустившая задание (None - продолжение после перезапуска)
+        :return: Запуск; None, если задание уже выполняется (команда присоединена к нему) или занято другим процессом
+        """
+        async with cls._lock:
+            job = cls._running.get(kind)
+            if job is not None:
+                job.subscribe(event)
+                await cls._reply(event, f"Задание {kind} уже выполняется, отчёты будут приходить сюда: "
+                                        f"{job.progress()}")
+                return None
+            lease_until = datetime.now() + timedelta(seconds=cls._lease_seconds)
+            rows = await db.get_running_jobs(kind)
+            if rows:
+                row = rows[-1]
+                if not await db.claim_job(row.id, cls._owner, lease_until):
+                    await cls._reply(event, f"Задание {kind} выполняется другим процессом ({row.owner}): "
+                                            f"обработано {row.done} из {row.total}")
+                    return None
+                logging.info(f"Продолжаем задание {kind} #{row.id} с курсора {row.cursor}")
+            else:
+                row = await db.create_job(kind, cls._owner, lease_until)
+            job = BulkJob(db, row, cls._owner, cls._lease_seconds)
+            job.subscribe(event)
+            job.start_heartbeat()
+            cls._running[kind] = job
+            return job
+
+    @classmethod
+    async def finish(cls, job: BulkJob, status: Optional[str]) -> None:
+        """Завершает запуск и освобождает тип задания."""
+        cls._running.pop(job.kind, None)
+        await job.finish(status)
+
+    @classmethod
+    async def interrupted(cls, db: Database) -> List[str]:
+        """Типы незавершённых заданий, которые этот процесс может продолжить."""
+        now = datetime.now()
+        return [row.kind for row in await db.get_running_jobs()
+                if row.kind not in cls._running and (row.owner == cls._owner or row.lease_until < now)]
+
+    @classmethod
+    def status(cls) -> str:
+        if not cls._running:
+            return "нет"
+        return ', '.join(f"{kind}: {job.progress()}" for kind, job in cls._running.items())
+
+    @staticmethod
+    async def _reply(event: Optional[events.NewMessage.Event], text: str) -> None:
+        logging.info(text)
+        if event is not None:
+            await event.reply(text)
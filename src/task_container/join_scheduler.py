@@ -0,0 +1,170 @@
+# join_scheduler.py
+import json
+import logging
+import os
+import time
+from datetime import timedelta
+from typing import Dict, Optional
+
+from config import JOIN_INTERVAL, JOIN_MIN_INTERVAL, JOIN_MAX_INTERVAL, JOIN_BACKOFF_FACTOR, JOIN_INCREASE_AFTER, \
+    JOIN_STATE_PATH
+from src.telethone_client.client_pool import ClientPool
+from src.utils.rate_limiter import TokenBucket
+
+
+class JoinScheduler:
+    """
+    Адаптивный темп вступления в группы для каждого аккаунта пула.
+    Каждый аккаунт получает ведро токенов ёмкостью в одно вступление. FloodWait уменьшает темп
+    в 1 / JOIN_BACKOFF_FACTOR раз, серия из JOIN_INCREASE_AFTER успешных вступлений увеличивает его
+    на небольшой шаг, но не чаще одного вступления в JOIN_MIN_INTERVAL секунд.
+    Темп, время последнего вступления и окончание FloodWait сохраняются в файл,
+    поэтому после перезапуска темп не начинается заново.
+    Очередь групп - статус 'second' в БД; прерванный запуск продолжается с курсора задания (JobManager).
+    """
+    _path: str = JOIN_STATE_PATH
+    # Состояние аккаунтов: rate, last_join, flood_until, successes
+    _accounts: Dict[str, Dict[str, float]] = {}
+    _buckets: Dict[str, TokenBucket] = {}
+    _running: bool = False
+    _total: int = 0
+    _remaining: int = 0
+
+    @classmethod
+    def load(cls, path: Optional[str] = None) -> None:
+        """Загружает сохранённое состояние."""
+        if path is not None:
+            cls._path = path
+        if not cls._path or not os.path.exists(cls._path):
+            return
+        try:
+            with open(cls._path, encoding='utf-8') as file:
+                state = json.load(file)
+        except (OSError, ValueError) as e:
+            logging.error(f"Не удалось прочитать состояние вступления в группы: {e}")
+            return
+        cls._accounts = state.get('accounts', {})
+        cls._buckets = {}
+        logging.info(f"Темп вступления в группы: {cls.intervals()}")
+
+    @classmethod
+    def _save(cls) -> None:
+        if not cls._path:
+            return
+        tmp_path = cls._path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                json.dump({'accounts': cls._accounts}, file)
+            os.replace(tmp_path, cls._path)
+        except OSError as e:
+            logging.error(f"Не удалось сохранить состояние вступления в группы: {e}")
+
+    @classmethod
+    def _account(cls, name: str) -> Dict[str, float]:
+        return cls._accounts.setdefault(name, {'rate': 1 / JOIN_INTERVAL, 'last_join': 0.0,
+                                               'flood_until': 0.0, 'successes': 0})
+
+    @classmethod
+    def _bucket(cls, name: str) -> TokenBucket:
+        bucket = cls._buckets.get(name)
+        if bucket is None:
+            state = cls._account(name)
+            bucket = TokenBucket(state['rate'], capacity=1)
+            # Токен за время после последнего вступления, в том числе до перезапуска
+            bucket.drain((time.time() - state['last_join']) * state['rate'])
+            cls._buckets[name] = bucket
+        return bucket
+
+    @classmethod
+    def restore_floods(cls, client_pool: ClientPool) -> None:
+        """Передаёт пулу FloodWait аккаунтов, не закончившиеся до перезапуска."""
+        now = time.time()
+        for name, client in client_pool.clients.items():
+            remaining = cls._account(name)['flood_until'] - now
+            if remaining > 0:
+                client_pool.report_flood(client, remaining)
+
+    @classmethod
+    async def acquire(cls, name: str) -> None:
+        """Ждёт очереди аккаунта на следующее вступление."""
+        await cls._bucket(name).acquire()
+
+    @classmethod
+    def _set_rate(cls, name: str, rate: float) -> None:
+        rate = min(max(rate, 1 / JOIN_MAX_INTERVAL), 1 / JOIN_MIN_INTERVAL)
+        cls._account(name)['rate'] = rate
+        cls._bucket(name).rate = rate
+
+    @classmethod
+    def on_join(cls, name: str) -> None:
+        """Учитывает успешное вступление: после серии успехов темп увеличивается."""
+        state = cls._account(name)
+        state['last_join'] = time.time()
+        state['successes'] += 1
+        if state['successes'] >= JOIN_INCREASE_AFTER:
+            state['successes'] = 0
+            cls._set_rate(name, state['rate'] + 1 / JOIN_MAX_INTERVAL)
+        cls._save()
+
+    @classmethod
+    def on_flood(cls, name: str, seconds: float) -> None:
+        """
+        Учитывает FloodWait вступления (JoinChannelRequest): темп аккаунта уменьшается мультипликативно.
+        FloodWait других запросов (например, ResolveUsername) сюда не передаётся: это другое ограничение.
+        """
+        state = cls._account(name)
+        state['successes'] = 0
+        state['flood_until'] = max(state['flood_until'], time.time() + seconds)
+        cls._set_rate(name, state['rate'] * JOIN_BACKOFF_FACTOR)
+        # После окончания FloodWait следующее вступление - не сразу, а через полный интервал
+        cls._bucket(name).drain(0)
+        cls._save()
+        logging.info(f"Темп вступления аккаунта {name}: раз в {round(1 / state['rate'])} с")
+
+    @classmethod
+    def start_run(cls, total: int) -> None:
+        """
+        Отмечает начало запуска вступления в группы (для оценки времени завершения).
+        :param total: Количество групп в очереди
+        """
+        cls._running = True
+        cls._total = cls._remaining = total
+
+    @classmethod
+    def group_done(cls) -> None:
+        cls._remaining = max(cls._remaining - 1, 0)
+
+    @classmethod
+    def finish_run(cls) -> None:
+        """Отмечает окончание запуска."""
+        cls._running = False
+        cls._remaining = 0
+
+    @classmethod
+    def intervals(cls) -> Dict[str, int]:
+        """Текущий интервал между вступлениями по аккаунтам, с."""
+        return {name: round(1 / state['rate']) for name, state in cls._accounts.items()}
+
+    @classmethod
+    def eta(cls, client_pool: ClientPool) -> Optional[float]:
+        """
+        Оценка времени до завершения запуска в секундах: оставшиеся группы при текущем суммарном темпе
+        аккаунтов плюс ожидание FloodWait, если он сейчас у всех аккаунтов.
+        """
+        if not cls._running:
+            return None
+        names = list(client_pool.clients)
+        total_rate = sum(cls._account(name)['rate'] for name in names)
+        flood_wait = min((client_pool.flood_remaining(name) for name in names), default=0)
+        return cls._remaining / total_rate + flood_wait if total_rate else None
+
+    @classmethod
+    def status(cls, client_pool: ClientPool) -> str:
+        """Текстовый статус для /get_status."""
+        eta = cls.eta(client_pool)
+        intervals = {name: round(1 / cls._account(name)['rate']) for name in client_pool.clients}
+        if eta is None:
+            return f"не выполняется, интервал вступлений, с: {intervals}"
+        return (f"осталось {cls._remaining} из {cls._total}, интервал вступлений, с: {intervals}, "
+                f"ожидаемое завершение через {timedelta(seconds=round(eta))}")
+
@@ -0,0 +1,189 @@
+# message_wal.py
+import asyncio
+import base64
+import json
+import logging
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from telethon.extensions import BinaryReader
+
+from src.task_container.models import BufferedMessage
+
+
+def _encode_ranges(seqs: Iterable[int]) -> List[List[int]]:
+    """Сворачивает номера записей в диапазоны [начало, конец] - номера одной пачки обычно идут подряд."""
+    ranges: List[List[int]] = []
+    for seq in sorted(seqs):
+        if ranges and seq == ranges[-1][1] + 1:
+            ranges[-1][1] = seq
+        else:
+            ranges.append([seq, seq])
+    return ranges
+
+
+class MessageWal:
+    """
+    Журнал предзаписи (WAL) очереди сообщений: одна JSON-строка на запись в файле только для дозаписи.
+    Записи и подтверждения копятся в памяти и сбрасываются на диск фоновой задачей раз в flush_interval
+    секунд одним fsync (group commit), поэтому add_message не ждёт диска. Подтверждённые записи
+    (пачка классифицирована и переслана) при следующем сбросе отмечаются в журнале, а когда
+    неподтверждённых не остаётся, файл обрезается. Если файл вырос больше max_bytes, он переписывается
+    только с неподтверждёнными записями.
+    При аварийном завершении теряются только записи, добавленные за последний интервал сброса.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 0.2, max_bytes: int = 4 * 1024 * 1024):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self._seq = 0
+        # Неподтверждённые записи по номеру; сериализуются только при сбросе на диск
+        self._outstanding: Dict[int, BufferedMessage] = {}
+        self._pending: List[int] = []
+        self._acked: List[int] = []
+        self._task: Optional[asyncio.Task] = None
+        self._io_lock = asyncio.Lock()
+
+    def append(self, msg: BufferedMessage) -> int:
+        """
+        Добавляет запись в журнал и присваивает сообщению номер wal_seq.
+        :param msg: Сообщение очереди
+        :return: Номер записи
+        """
+        self._seq += 1
+        msg.wal_seq = self._seq
+        self._outstanding[self._seq] = msg
+        self._pending.append(self._seq)
+        return self._seq
+
+    def ack(self, seqs: Iterable[int]) -> None:
+        """Подтверждает обработку записей; на диске подтверждение появится при следующем сбросе."""
+        for seq in seqs:
+            if self._outstanding.pop(seq, None) is not None:
+                self._acked.append(seq)
+
+    @staticmethod
+    def _serialize(seq: int, msg: BufferedMessage) -> str:
+        peer = base64.b64encode(bytes(msg.input_chat)).decode() if msg.input_chat is not None else None
+        return json.dumps({'s': seq, 'id': msg.id, 'c': msg.chat_id, 'u': msg.sender_id, 't': msg.text, 'p': peer,
+                           'n': msg.account}, ensure_ascii=False)
+
+    @staticmethod
+    def _deserialize(record: dict) -> BufferedMessage:
+        input_chat = BinaryReader(base64.b64decode(record['p'])).tgread_object() if record.get('p') else None
+        msg = BufferedMessage(record['id'], record['c'], record['u'], record['t'], input_chat=input_chat,
+                              account=record.get('n'))
+        msg.wal_seq = record['s']
+        return msg
+
+    def load(self) -> List[BufferedMessage]:
+        """
+        Читает журнал при старте и возвращает неподтверждённые записи в порядке добавления.
+        Они остаются в журнале до подтверждения; оборванная последняя строка пропускается.
+        Вызывается до start(), файл читается и переписывается синхронно.
+        """
+        records: Dict[int, dict] = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        logging.warning(f"Пропущена повреждённая строка журнала {self.path}")
+                        continue
+                    if 'a' in record:
+                        for start, end in record['a']:
+                            for seq in range(start, end + 1):
+                                records.pop(seq, None)
+                    else:
+                        records[record['s']] = record
+                        self._seq = max(self._seq, record['s'])
+        except FileNotFoundError:
+            return []
+        messages = []
+        for seq in sorted(records):
+            try:
+                msg = self._deserialize(records[seq])
+            except Exception as e:
+                logging.error(f"Не удалось восстановить запись {seq} журнала: {e}")
+                continue
+            self._outstanding[seq] = msg
+            messages.append(msg)
+        # Переписываем журнал только с неподтверждёнными записями: заодно убирается оборванная строка,
+        # к которой иначе приклеилась бы следующая запись
+        self._write([self._serialize(msg.wal_seq, msg) + '\n' for msg in messages], rewrite=True)
+        return messages
+
+    def _write(self, lines: List[str], rewrite: bool) -> None:
+        """Записывает строки в журнал и выполняет fsync. Выполняется в отдельном потоке."""
+        if rewrite:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                file.writelines(lines)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, self.path)
+            return
+        with open(self.path, 'a', encoding='utf-8') as file:
+            file.writelines(lines)
+            file.flush()
+            os.fsync(file.fileno())
+
+    def _prepare(self) -> Tuple[List[str], bool, List[int], List[int]]:
+        """
+        Забирает накопленные записи и подтверждения и формирует строки для записи на диск.
+        :return: Строки, признак перезаписи файла, забранные номера записей и подтверждений
+        """
+        pending, acked = self._pending, self._acked
+        self._pending, self._acked = [], []
+        if not self._outstanding:
+            # Всё подтверждено - журнал можно обрезать
+            return [], True, pending, acked
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            size = 0
+        if size > self.max_bytes:
+            lines = [self._serialize(seq, msg) + '\n' for seq, msg in self._outstanding.items()]
+            return lines, True, pending, acked
+        # Записи, подтверждённые до сброса, на диск не попадают
+        lines = [self._serialize(seq, self._outstanding[seq]) + '\n' for seq in pending if seq in self._outstanding]
+        if acked:
+            lines.append(json.dumps({'a': _encode_ranges(acked)}) + '\n')
+        return lines, False, pending, acked
+
+    async def flush(self) -> None:
+        """Сбрасывает накопленные записи и подтверждения на диск одним fsync."""
+        async with self._io_lock:
+            if not self._pending and not self._acked:
+                return
+            lines, rewrite, pending, acked = self._prepare()
+            try:
+                await asyncio.to_thread(self._write, lines, rewrite)
+            except OSError as e:
+                logging.error(f"Ошибка записи журнала сообщений {self.path}: {e}")
+                # Записи и подтверждения не попали на диск: повторяем их при следующем сбросе
+                self._pending = pending + self._pending
+                self._acked = acked + self._acked
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self) -> None:
+        """Запускает фоновую задачу периодического сброса журнала."""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def close(self) -> None:
+        """Останавливает фоновую задачу и сбрасывает остаток журнала на диск."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
@@ -0,0 +1,70 @@
+# models.py
+import asyncio
+from typing import Any, Dict, List, Optional, Tuple
+
+from telethon import TelegramClient, events
+
+
+class BufferedMessage:
+    """
+    Компактная запись сообщения в очереди обработки.
+    Вместо всего события Telethon (клиент, сырые TL-объекты, сущности) хранит только поля,
+    нужные для классификации, и входной peer чата с клиентом для пересылки.
+    wal_seq - номер записи в журнале предзаписи (0, если журнал отключён).
+    account - имя аккаунта пула, получившего сообщение: access_hash в input_chat действителен только для него.
+    """
+    __slots__ = ('id', 'chat_id', 'sender_id', 'text', 'input_chat', 'client', 'wal_seq', 'account')
+
+    def __init__(
+            self,
+            id: int,
+            chat_id: Optional[int],
+            sender_id: Optional[int],
+            text: str,
+            input_chat: Any = None,
+            client: Optional[TelegramClient] = None,
+            account: Optional[str] = None
+    ):
+        self.id = id
+        self.chat_id = chat_id
+        self.sender_id = sender_id
+        self.text = text
+        self.input_chat = input_chat
+        self.client = client
+        self.wal_seq = 0
+        self.account = account
+
+    @classmethod
+    def from_event(cls, event: events.NewMessage.Event, account: Optional[str] = None) -> 'BufferedMessage':
+        """Создаёт запись из события нового сообщения, полученного аккаунтом account."""
+        return cls(
+            id=event.id,
+            chat_id=event.chat_id,
+            sender_id=event.sender_id,
+            text=event.text or '',
+            input_chat=event.input_chat,
+            client=event.client,
+            account=account,
+        )
+
+    def __repr__(self) -> str:
+        return f"BufferedMessage(id={self.id}, chat_id={self.chat_id}, sender_id={self.sender_id})"
+
+
+class MessageBatch:
+    """Состояние обработки одной пачки сообщений: индекс сообщений, кластеры и запущенные пересылки."""
+
+    def __init__(self, messages: List[BufferedMessage]):
+        self.messages = messages
+        # Индекс сообщений пачки по (chat_id, message_id) для поиска вердикта за O(1);
+        # сообщение удаляется из индекса при первом вердикте, повторные вердикты игнорируются
+        self.index: Dict[Tuple[int, int], BufferedMessage] = {(msg.chat_id, msg.id): msg for msg in messages}
+        # Кластер почти одинаковых сообщений -> сообщения пачки; в Mistral уходит только первое из них
+        self.cluster_members: Dict[int, List[BufferedMessage]] = {}
+        self.message_clusters: Dict[Tuple[int, int], int] = {}
+        self.forward_tasks: List[asyncio.Task] = []
+        self.invalid_verdicts = 0
+        # Сообщения чанков, на которые Mistral не ответил, и не пересланные сообщения: журнал их не подтверждает
+        self.failed: List[BufferedMessage] = []
+        # Сообщения кластеров, представитель которых получил неизвестную категорию: повторный запрос к Mistral
+        self.retry: List[BufferedMessage] = []
@@ -0,0 +1,295 @@
+# parse_pipeline.py
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from telethon import errors
+
+from config import PARSE_FETCH_RATE, PARSE_QUEUE_SIZE, PARSE_PROGRESS_INTERVAL, PARSE_HISTORY_LIMIT, \
+    MISTRAL_MAX_CONCURRENCY
+from src.database.database import Database, GroupChats
+from src.telethone_client.client_pool import ClientPool
+from src.task_container.entity_cache import EntityCache
+from src.task_container.group_updates import GroupUpdateQueue
+from src.task_container.jobs import BulkJob, CursorTracker
+from src.utils.metrics import FLOOD_WAIT_SECONDS
+from src.utils.mistralAi import MistralAI, get_count_message
+from src.utils.rate_limiter import TokenBucket
+
+
+class GroupParsePipeline:
+    """
+    Конвейер парсинга групп: загрузка истории -> классификация в Mistral -> запись статусов в БД.
+    Этапы связаны ограниченными очередями, поэтому в памяти одновременно находится не больше
+    queue_size групп на этап, а медленный этап притормаживает предыдущие.
+    - Загрузчики (по одному на аккаунт пула) берут аккаунт через ClientPool.lease и запрашивают историю
+      не чаще fetch_rate раз в секунду на аккаунт. Запрашиваются только сообщения окна since, которые
+      новее водяного знака группы (last_message_id), не больше history_limit. Водяной знак внутри окна
+      бывает у групп, повторно проверяемых раньше, чем их прошлая проверка вышла из окна.
+    - Классификаторы (classify_concurrency штук) отправляют сообщения группы в Mistral.
+    - Один писатель передаёт статусы, водяные знаки и статистику групп в общую очередь отложенной
+      записи (GroupUpdateQueue), которая записывает их пачками одной транзакцией.
+    Ход парсинга отправляется подписчикам задания каждые progress_interval секунд. После каждой записи
+    пачки курсор задания сдвигается до группы, перед которой все группы обработаны и записаны, поэтому
+    после перезапуска задание продолжается с этого места.
+    """
+
+    def __init__(self, client_pool: ClientPool, db: Database, mistral_client: MistralAI, prompt: str,
+                 since: datetime, job: Optional[BulkJob] = None,
+                 fetch_rate: float = PARSE_FETCH_RATE, classify_concurrency: int = MISTRAL_MAX_CONCURRENCY,
+                 queue_size: int = PARSE_QUEUE_SIZE, progress_interval: float = PARSE_PROGRESS_INTERVAL, history_limit: int = PARSE_HISTORY_LIMIT):
+        self.client_pool = client_pool
+        self.db = db
+        self.mistral_client = mistral_client
+        self.prompt = prompt
+        self.since = since
+        # Даты в БД хранятся без часового пояса, в UTC
+        self._since_naive = since.astimezone(timezone.utc).replace(tzinfo=None)
+        self.history_limit = history_limit
+        self.job = job
+        self._cursor: Optional[CursorTracker] = None
+        self.classify_concurrency = max(classify_concurrency, 1)
+        self.updates = GroupUpdateQueue.shared(db)
+        self.progress_interval = progress_interval
+        self._buckets = {name: TokenBucket(fetch_rate, capacity=1) for name in client_pool.clients}
+        self._chats: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._fetched: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._results: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.total = 0
+        # Обработано групп (статус записан или определить его не удалось), включая обработанные
+        # до перезапуска задания, и новые статусы этого запуска по количеству
+        self.done = 0
+        self._done_before = 0
+        # Группы, изменения которых записаны (или записывать нечего): по ним сдвигается курсор задания
+        self._completed = 0
+        self.statuses: Dict[str, int] = {}
+        self._started = time.monotonic()
+
+    async def _notify(self, text: str) -> None:
+        if self.job is not None:
+            await self.job.notify(text)
+        else:
+            logging.info(text)
+
+    def progress(self) -> str:
+        elapsed = time.monotonic() - self._started
+        rate = (self.done - self._done_before) / elapsed if elapsed > 0 else 0.0
+        return (f"обработано {self.done} из {self.total}, статусы: {self.statuses}, "
+                f"скорость {rate * 60:.1f} групп/мин")
+
+    async def _produce(self, chats: List[GroupChats]) -> None:
+        for chat in chats:
+            if self.job is not None and self.job.lost:
+                # Задание продолжает другой процесс
+                break
+            await self._chats.put(chat)
+
+    def _watermark_in_window(self, chat: GroupChats) -> bool:
+        return chat.last_message_date is not None and chat.last_message_date >= self._since_naive
+
+    def _history_kwargs(self, chat: GroupChats) -> Dict[str, Any]:
+        """
+        Параметры запроса истории: сообщения от старых к новым, только из окна и новее водяного знака.
+        Telethon отдаёт приоритет min_id перед offset_date, поэтому min_id используется, только если
+        водяной знак внутри окна; иначе все сообщения окна и так новее водяного знака.
+        """
+        kwargs: Dict[str, Any] = {'limit': self.history_limit, 'reverse': True}
+        if self._watermark_in_window(chat):
+            kwargs['min_id'] = chat.last_message_id
+        else:
+            kwargs['offset_date'] = self.since
+        return kwargs
+
+    async def _fetch(self, chat: GroupChats) -> list:
+        """Загружает новые сообщения группы свободным аккаунтом пула с учётом темпа аккаунта."""
+        while True:
+            async with self.client_pool.lease(chat.name) as client:
+                name = self.client_pool.name(client)
+                try:
+                    await self._buckets[name].acquire()
+                    # Входной peer из кэша имён: без запроса ResolveUsername на каждом запуске
+                    peer = await EntityCache.resolve(client, name, chat.name, self.db)
+                    return await client.get_messages(peer, **self._history_kwargs(chat))
+                except EntityCache.INVALIDATING_ERRORS:
+                    await EntityCache.invalidate(chat.name, self.db)
+                    raise
+                except errors.FloodWaitError as e:
+                    logging.error(f"Ошибка: {e}")
+                    FLOOD_WAIT_SECONDS.inc(e.seconds, 'parse_groups')
+                    self.client_pool.report_flood(client, e.seconds)
+                    await self._notify(f"Ошибка FloodWaitError ({name}): {e.seconds}")
+
+    async def _fetcher(self) -> None:
+        while True:
+            chat = await self._chats.get()
+            if chat is None:
+                return
+            try:
+                messages = await self._fetch(chat)
+            except Exception as e:
+                logging.error(f"Ошибка: {e}")
+                await self._results.put((chat, 'bad', {'status': 'bad'}))
+                continue
+            await self._fetched.put((chat, messages))
+
+    async def _classify(self, chat: GroupChats, messages: list) -> Optional[str]:
+        """
+        Определяет статус группы по новым сообщениям окна.
+        Если водяной знак внутри окна (повторная проверка), Mistral получает только сообщения после прошлой
+        проверки, а часть сообщений окна уже учтена в текущем статусе. Поэтому порог применяется к новым
+        сообщениям только для повышения до 'second'; иначе статус не меняется до проверки, на которой
+        прошлые сообщения вышли из окна и статус определяется по всему окну заново.
+        :return: Статус; None - статус не меняется (нет новых сообщений или их недостаточно для повышения)
+        :raises Exception: Ошибка Mistral
+        """
+        message_list = ''
+        for message in messages:
+            if message.text and (message.date >= self.since):
+                message_list += f"id:{message.sender_id}, message: {message.message}\n"
+        if not message_list:
+            # Сообщения окна уже классифицированы на прошлой проверке - новых данных нет
+            return None if self._watermark_in_window(chat) else 'bad_second'
+        text_mistral = await self.mistral_client.chat(message_list, self.prompt)
+        logging.info(f'Mistral: {text_mistral}')
+        if await get_count_message(text_mistral) > 3:
+            logging.info(f"group: {chat.name}, status: second")
+            return 'second'
+        if self._watermark_in_window(chat):
+            logging.info(f"group: {chat.name}, status: {chat.status} (без изменений)")
+            return None
+        logging.info(f"group: {chat.name}, status: bad second")
+        return 'bad_second'
+
+    async def _classifier(self) -> None:
+        while True:
+            item = await self._fetched.get()
+            if item is None:
+                return
+            chat, messages = item
+            try:
+                status = await self._classify(chat, messages)
+                values = self._chat_values(chat, messages, status)
+            except Exception as e:
+                # Водяной знак не сдвигается: сообщения будут загружены и классифицированы снова
+                logging.info(f'Ошибка Mistral{e}')
+                await self._results.put((chat, None, None))
+                continue
+            await self._results.put((chat, status, values))
+
+    @staticmethod
+    def _chat_values(chat: GroupChats, messages: list, status: Optional[str]) -> Dict[str, Any]:
+        """Новые значения полей группы: статус, водяной знак и статистика активности."""
+        values: Dict[str, Any] = {'last_checked_at': datetime.now(timezone.utc).replace(tzinfo=None)}
+        if status is not None:
+            values['status'] = status
+        if messages:
+            newest = max(messages, key=lambda message: message.id)
+            values['last_message_id'] = newest.id
+            values['last_message_date'] = newest.date.astimezone(timezone.utc).replace(tzinfo=None)
+            values['message_count'] = (chat.message_count or 0) + len(messages)
+        return values
+
+    async def _checkpoint(self, unwritten: Deque[Tuple[asyncio.Future, int]]) -> None:
+        """
+        Сдвигает курсор задания по группам, изменения которых уже записаны в БД.
+        Группа, запись которой не удалась, остаётся за курсором: продолженное задание обработает её снова.
+        """
+        while unwritten and unwritten[0][0].done():
+            written, chat_id = unwritten.popleft()
+            if written.result():
+                self._complete(chat_id)
+        if self.job is not None:
+            await self.job.checkpoint(self._cursor.cursor, self._done_before + self._completed)
+
+    def _complete(self, chat_id: int) -> None:
+        self._cursor.complete(chat_id)
+        self._completed += 1
+
+    async def _writer(self) -> None:
+        """
+        Единственный писатель: изменения групп уходят в очередь отложенной записи, остаток
+        записывается по окончании. Ожидание результатов с таймаутом сдвигает курсор при паузах.
+        """
+        unwritten: Deque[Tuple[asyncio.Future, int]] = deque()
+        while True:
+            try:
+                item = await asyncio.wait_for(self._results.get(), timeout=1.0)
+            except asyncio.TimeoutError:
+                item = ()
+            if item is None:
+                break
+            if item:
+                chat, status, values = item
+                self.done += 1
+                if status is not None:
+                    self.statuses[status] = self.statuses.get(status, 0) + 1
+                if values is None:
+                    self._complete(chat.id)
+                else:
+                    unwritten.append((self.updates.put(chat.id, values), chat.id))
+            await self._checkpoint(unwritten)
+        await self.updates.flush()
+        await self._checkpoint(unwritten)
+
+    async def _report(self) -> None:
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            await self._notify(f"Парсинг групп: {self.progress()}")
+
+    async def run(self, chats: List[GroupChats]) -> Dict[str, int]:
+        """
+        Обрабатывает группы и дожидается записи всех статусов.
+        :param chats: Группы для парсинга
+        :return: Количество групп по новым статусам
+        """
+        self.total = len(chats)
+        self._cursor = CursorTracker([chat.id for chat in chats])
+        if self.job is not None:
+            # Продолженное задание: счётчики и курсор - с учётом групп, обработанных до перезапуска
+            self.total = self.job.total
+            self.done = self._done_before = self.job.done
+            self._cursor.cursor = self.job.cursor
+        self._started = time.monotonic()
+        fetchers = [asyncio.create_task(self._fetcher()) for _ in self._buckets]
+        classifiers = [asyncio.create_task(self._classifier()) for _ in range(self.classify_concurrency)]
+        writer = asyncio.create_task(self._writer())
+        reporter = asyncio.create_task(self._report()) if self.progress_interval > 0 else None
+        stages = asyncio.create_task(self._run_stages(chats, fetchers, classifiers, writer))
+        try:
+            await self._supervise(stages, [*fetchers, *classifiers, writer])
+        finally:
+            for task in [stages, *fetchers, *classifiers, writer, reporter]:
+                if task is not None and not task.done():
+                    task.cancel()
+        return self.statuses
+
+    async def _run_stages(self, chats: List[GroupChats], fetchers: List[asyncio.Task],
+                          classifiers: List[asyncio.Task], writer: asyncio.Task) -> None:
+        await self._produce(chats)
+        # Каждый этап завершается по None после того, как завершились все обработчики предыдущего
+        await self._shutdown(self._chats, fetchers)
+        await self._shutdown(self._fetched, classifiers)
+        await self._shutdown(self._results, [writer])
+
+    @staticmethod
+    async def _supervise(stages: asyncio.Task, workers: List[asyncio.Task]) -> None:
+        """
+        Ждёт завершения конвейера. Обработчик, завершившийся с ошибкой, прерывает запуск:
+        иначе очередь перед его этапом заполнилась бы и конвейер ждал бы бесконечно.
+        """
+        pending = {stages, *workers}
+        while stages in pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task is not stages and not task.cancelled() and task.exception() is not None:
+                    raise task.exception()
+        stages.result()
+
+    @staticmethod
+    async def _shutdown(queue: asyncio.Queue, workers: List[asyncio.Task]) -> None:
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
@@ -1,16 +1,40 @@
 import asyncio
+import time
 from datetime import datetime, timedelta, timezone
-from typing import List
+from typing import List, Dict, Optional, Set, Any, Iterable
 
 from telethon.tl.functions.channels import JoinChannelRequest
+from telethon.utils import get_peer_id
 
-from src.utils.json_utils import JsonUtils
+from src.utils.json_utils import JsonUtils, JsonObjectStreamParser
+from src.utils.classification_cache import ClassificationCache, normalize_text
+from src.utils.near_duplicates import NearDuplicateIndex
+from src.utils.prefilter import MessagePrefilter
+from src.utils.prompts import PromptRegistry
+from src.utils.metrics import BUFFER_DEPTH, BATCH_SIZE, BATCH_SECONDS, MESSAGES_DROPPED, VERDICTS, \
+    INVALID_VERDICTS, FORWARDS, FLOOD_WAIT_SECONDS
 
 from telethon import TelegramClient, events, errors
-from src.database.database import Database
-from config import DATABASE_URL, MISTRAL_API_KEY, MISTRAL_API_MODEL, MISTRAL_API_KEY_PARSING_GROUP, FORWARD_CHAT_ID
+from src.database.database import Database, GroupChats
+from src.telethone_client.client_pool import ClientPool
+from src.task_container.models import BufferedMessage, MessageBatch
+from src.task_container.message_wal import MessageWal
+from src.task_container.tracked_chats import TrackedChats
+from src.task_container.entity_cache import EntityCache
+from src.task_container.dialog_membership import DialogMembership
+from src.task_container.join_scheduler import JoinScheduler
+from src.task_container.parse_pipeline import GroupParsePipeline
+from src.task_container.jobs import BulkJob, CursorTracker, JobManager
+from src.task_container.group_updates import GroupUpdateQueue
+from config import DATABASE_URL, MISTRAL_API_KEY, MISTRAL_API_MODEL, MISTRAL_API_KEY_PARSING_GROUP, FORWARD_CHAT_ID, \
+    MESSAGE_BATCH_SIZE, MESSAGE_BATCH_MAX_AGE, MESSAGE_QUEUE_MAXSIZE, MISTRAL_CHUNK_TOKEN_BUDGET, MISTRAL_MAX_CONCURRENCY, \
+    CLASSIFICATION_CACHE_TTL, CLASSIFICATION_CACHE_MAX_SIZE, NEAR_DUPLICATE_WINDOW, NEAR_DUPLICATE_MAX_DISTANCE, \
+    NEAR_DUPLICATE_MAX_SIZE, NEAR_DUPLICATE_MIN_FEATURES, PREFILTER_ENABLED, PREFILTER_RULES_PATH, \
+    MISTRAL_STREAMING, MESSAGE_WAL_PATH, MESSAGE_WAL_FLUSH_INTERVAL, MESSAGE_WAL_MAX_BYTES, PARSE_WINDOW_HOURS, \
+    PARSE_RECHECK_HOURS
 import logging
-from src.utils.mistralAi import MistralAI, get_count_message
+from src.utils.mistralAi import MistralAI, estimate_tokens, split_into_chunk_ranges, join_chunk, \
+    MIN_CHUNK_TOKEN_BUDGET
 
 PROMPT = """
                     Ты — модель для классификации сообщений на три категории: спам, обычные и рекламные. Критерии:
@@ -48,111 +72,239 @@ class TaskContainer:
     """Класс-контейнер для хранения задач"""
 
     @staticmethod
-    async def parse_groups(client: TelegramClient, event: events.NewMessage.Event) -> None:
+    async def parse_groups(client_pool: ClientPool, event: Optional[events.NewMessage.Event]) -> None:
         """
-        Парсинг групп
-        :param : client: TelegramClient, event: events
+        Парсинг групп.
+        Группы проходят конвейер GroupParsePipeline: загрузка истории аккаунтами пула (каждая группа получает
+        аккаунт по консистентному хешированию, при FloodWait - следующий по кольцу), классификация в Mistral
+        с ограничением параллельности и запись статусов в БД пачками. Ход парсинга отправляется периодически.
+        Кроме новых групп ('test') повторно проверяются группы 'bad_second', проверенные больше PARSE_RECHECK_HOURS
+        часов назад: по сообщениям после прошлой проверки (см. GroupParsePipeline._classify). Группы 'second'
+        ждут вступления (join_group_or_channel) и не перепроверяются, чтобы не менять его результат.
+        Запуск - задание JobManager: повторная команда присоединяется к нему, а запуск, прерванный остановкой
+        бота, продолжается с курсора после перезапуска (event в этом случае None).
+        :param : client_pool: ClientPool, event: events
         :return: None
         """
-        # нужно открыть текстовый файл prompt для mistral
-        try:
-            with open('../prompts/prompt_mistral.txt', 'r', encoding='utf-8') as file:
-                prompt = file.read()
-        except FileNotFoundError:
-            logging.info("Файл 'prompt_mistral.txt' не найден.")
-            prompt = PROMPT
-        mistral_client = MistralAI(MISTRAL_API_KEY_PARSING_GROUP, MISTRAL_API_MODEL)
-        db = Database(DATABASE_URL)
-        twenty_four_hours_ago = datetime.now(timezone.utc) - timedelta(hours=24)
+        # Общий движок БД процесса: соединения пула переиспользуются между запусками
+        db = Database.shared(DATABASE_URL)
+        job = await JobManager.start(db, 'parse_groups', event)
+        if job is None:
+            return
+        prompt = PromptRegistry.get('prompt_mistral.txt', PROMPT)
+        mistral_client = MistralAI.shared(MISTRAL_API_KEY_PARSING_GROUP, MISTRAL_API_MODEL)
+        now = datetime.now(timezone.utc)
+        since = now - timedelta(hours=PARSE_WINDOW_HOURS)
+        # last_checked_at хранится в UTC без часового пояса
+        checked_before = (now - timedelta(hours=PARSE_RECHECK_HOURS)).replace(tzinfo=None) \
+            if PARSE_RECHECK_HOURS > 0 else None
+        pipeline = GroupParsePipeline(client_pool, db, mistral_client, prompt, since, job)
+        status = None
         try:
-            # принимаем данные из бд
-            chats_db = (await db.get_chats_by_status(status='test'))
-            await event.reply(f"Количество чатов для парсинга: {len(chats_db)}")
-            for chat in chats_db:
-                try:
-                    messages = await client.get_messages(chat.name, limit=10)
-                    # Обработка сообщений через мистраль
-                    message_list = ''
-                    list_messages = []
-                    for message in messages:
-                        if message.text and (message.date >= twenty_four_hours_ago):
-                            message_list += f"id:{message.sender_id}, message: {message.message}\n"
-                            list_messages.append(message.sender_id)
-                    if list_messages:
-                        try:
-                            text_mistral = await mistral_client.chat(message_list, prompt)
-                            logging.info(f'Mistral: {text_mistral}')
-                            count_message_mistral = await get_count_message(text_mistral)
-                            if count_message_mistral > 3:
-                                logging.info(f"group: {chat.name}, status: second")
-                                await db.update_group_chat(chat.id, status='second')
-                            else:
-                                await db.update_group_chat(chat.id, status='bad_second')
-                                logging.info(f"group: {chat.name}, status: bad second")
-                        except Exception as e:
-                            logging.info(f'Ошибка Mistral{e}')
-                    else:
-                        await db.update_group_chat(chat.id, status='bad_second')
-                        continue
-                except errors.FloodWaitError as e:
-                    logging.error(f"Ошибка: {e}")
-                    await event.reply(f"Ошибка FloodWaitError: {e.seconds}")
-                    await asyncio.sleep(e.seconds)
-                    continue
-                except Exception as e:
-                    logging.error(f"Ошибка: {e}")
-                    await db.update_group_chat(chat.id, status='bad')
+            # принимаем данные из бд: новые и давно проверенные группы после курсора задания
+            chats_db = await db.get_chats_for_parsing(
+                recheck_statuses=('bad_second',), checked_before=checked_before, after_id=job.cursor)
+            if job.resumed:
+                await job.notify(f"Продолжаю парсинг групп: осталось {len(chats_db)}, {job.progress()}")
+            else:
+                await job.set_total(len(chats_db))
+                await job.notify(f"Количество чатов для парсинга: {len(chats_db)}")
+            await pipeline.run(chats_db)
+            status = 'completed'
         except Exception as e:
+            status = 'failed'
             logging.error(f"Ошибка при работе с бд: {e}")
-            return
         finally:
-            logging.info("Закрытие подключения к бд")
-            await db.close()
-            logging.info("Парсинг групп завершен")
-            await event.reply("Парсинг групп завершен")
+            # При отмене (остановка бота) status остаётся None: задание продолжится с курсора
+            await JobManager.finish(job, status)
+            if status is not None:
+                logging.info("Парсинг групп завершен")
+                await job.notify(f"Парсинг групп завершен: {pipeline.progress()}")
 
     @staticmethod
-    async def join_group_or_channel(event: events.NewMessage.Event):
-        """Присоединяется к группе или чату."""
+    async def join_group_or_channel(client_pool: ClientPool, event: Optional[events.NewMessage.Event]):
+        """
+        Присоединяется к группам и каналам.
+        Группа закрепляется за аккаунтом пула по консистентному хешированию; аккаунты вступают параллельно,
+        каждый в своём темпе (JoinScheduler), а при FloodWait группа уходит следующему по кольцу аккаунту.
+        Запуск - задание JobManager: повторная команда присоединяется к нему, а запуск, прерванный остановкой
+        бота, продолжается с курсора после перезапуска (event в этом случае None).
+        """
+        db = Database.shared(DATABASE_URL)
+        job = await JobManager.start(db, 'join_groups', event)
+        if job is None:
+            return
         # получаем из бд все группы и каналы со статусом second
-        await event.reply("Присоединяюсь к группам и каналам...")
-        db = Database(DATABASE_URL)
+        await job.notify("Присоединяюсь к группам и каналам...")
+        status = None
         try:
-            # получаем список групп и каналов из бд
-            groups_list = await db.get_chats_by_status(status='second')
-            # получаем список всех подключенных групп
-            connected_groups = await event.client.get_dialogs()
-            # формируем список id подключенных групп
-            connected_groups_ids = [group.id for group in connected_groups]
-            count_groups_connect = 0
-            for group in groups_list:
-                try:
-                    channel = await event.client.get_entity(group.name)
-                    if channel.id not in connected_groups_ids:
-                        await event.client(JoinChannelRequest(channel))
-                        await asyncio.sleep(60 * 5)
-                    # меняем статус группы в бд на 'connected'
-                    await db.update_group_chat(group.id, status='connected')
-                except errors.FloodWaitError as e:
-                    logging.error(f"Ошибка: {e}")
-                    await event.reply(f"Ошибка FloodWaitError: {e.seconds}")
-                    await asyncio.sleep(e.seconds)
-                    continue
-                except Exception as e:
-                    logging.info("Ошибка при присоединении к группе или чату: " + str(e))
+            # получаем список групп и каналов из бд: группы после курсора задания
+            groups_list = await db.get_chats_by_status(status='second', after_id=job.cursor)
+            if not job.resumed:
+                await job.set_total(len(groups_list))
+            JoinScheduler.start_run(len(groups_list))
+            cursor = CursorTracker([group.id for group in groups_list], job.cursor)
+            # Статусы вступивших групп записываются пачками через общую очередь отложенной записи
+            updates = GroupUpdateQueue.shared(db)
+            await asyncio.gather(*(
+                TaskContainer._join_group(client_pool, job, cursor, db, updates, group)
+                for group in groups_list
+            ))
+            status = 'completed'
         except Exception as e:
+            status = 'failed'
             logging.info("Ошибка при получении списка групп и каналов из БД: " + str(e))
         finally:
-            await db.close()
-            await event.reply("Присоединение к группам и каналам завершено")
+            # При отмене (остановка бота) status остаётся None: задание продолжится с курсора
+            JoinScheduler.finish_run()
+            await JobManager.finish(job, status)
+            if status is not None:
+                await job.notify("Присоединение к группам и каналам завершено")
+
+    @staticmethod
+    async def _join_group(client_pool: ClientPool, job: BulkJob, cursor: CursorTracker, db: Database,
+                          updates: GroupUpdateQueue, group: GroupChats) -> None:
+        """Вступает в группу свободным аккаунтом пула и отмечает её в БД как 'connected'."""
+        written = None
+        try:
+            while not job.lost:
+                async with client_pool.lease(group.name) as client:
+                    name = client_pool.name(client)
+                    try:
+                        # Индекс диалогов загружается при старте; здесь - только если аккаунт ещё не загружен
+                        await DialogMembership.ensure_loaded(name, client)
+                        try:
+                            channel = await EntityCache.resolve(client, name, group.name, db)
+                        except errors.FloodWaitError as e:
+                            # Ограничение ResolveUsername, а не вступлений: темп JoinScheduler не меняется
+                            logging.error(f"Ошибка FloodWaitError при получении группы {group.name}: {e.seconds}")
+                            FLOOD_WAIT_SECONDS.inc(e.seconds, 'resolve_chats')
+                            client_pool.report_flood(client, e.seconds)
+                            continue
+                        # id диалогов в формате get_peer_id, поэтому сравниваем с ним, а не с channel.id
+                        chat_id = get_peer_id(channel)
+                        if not DialogMembership.contains(name, chat_id):
+                            # Ждём очереди аккаунта: аккаунт остаётся занятым, остальные продолжают работу
+                            await JoinScheduler.acquire(name)
+                            await client(JoinChannelRequest(channel))
+                            DialogMembership.add(name, chat_id)
+                            JoinScheduler.on_join(name)
+                        # меняем статус группы в бд на 'connected' и сохраняем id чата для индекса отслеживаемых групп
+                        written = updates.put(group.id, {'status': 'connected', 'channel_id': chat_id})
+                        TrackedChats.add(chat_id)
+                        return
+                    except EntityCache.INVALIDATING_ERRORS as e:
+                        await EntityCache.invalidate(group.name, db)
+                        logging.info("Группа недоступна: " + str(e))
+                        return
+                    except errors.FloodWaitError as e:
+                        logging.error(f"Ошибка: {e}")
+                        FLOOD_WAIT_SECONDS.inc(e.seconds, 'join_groups')
+                        client_pool.report_flood(client, e.seconds)
+                        JoinScheduler.on_flood(name, e.seconds)
+                        await job.notify(f"Ошибка FloodWaitError ({name}): {e.seconds}")
+                    except Exception as e:
+                        logging.info("Ошибка при присоединении к группе или чату: " + str(e))
+                        return
+        finally:
+            JoinScheduler.group_done()
+            # Курсор сдвигается только после записи статуса группы; не записанная группа остаётся за курсором
+            if written is not None and not await written:
+                logging.error(f"Статус группы {group.name} не записан, группа будет обработана повторно")
+            elif not job.lost:
+                cursor.complete(group.id)
+                await job.checkpoint(cursor.cursor, job.done + 1)
+
+    @staticmethod
+    async def resolve_connected_chat_ids(client: TelegramClient, db: Database, account: str = 'main') -> None:
+        """
+        Заполняет channel_id групп со статусом 'connected', подключённых до появления индекса
+        отслеживаемых групп, и обновляет индекс.
+        id берётся из диалогов аккаунтов, загруженных при старте (DialogMembership), по имени пользователя;
+        остальные группы разрешаются запросом, при FloodWait - повторно после ожидания. Пока id группы
+        неизвестен, TrackedChats пропускает сообщения из всех групп.
+        :param account: Имя аккаунта client в пуле, для кэша имён групп
+        """
+        try:
+            groups = [group for group in await db.get_chats_by_status(status='connected') if not group.channel_id]
+            if not groups:
+                return
+            values = {}
+            for group in groups:
+                chat_id = DialogMembership.find(EntityCache.normalize(group.name))
+                if chat_id is not None:
+                    values[group.id] = {'channel_id': chat_id}
+            logging.info(f"Групп без id чата: {len(groups)}, найдено в диалогах: {len(values)}")
+            for group in groups:
+                while group.id not in values:
+                    try:
+                        channel = await EntityCache.resolve(client, account, group.name, db)
+                        values[group.id] = {'channel_id': get_peer_id(channel)}
+                    except errors.FloodWaitError as e:
+                        logging.error(f"Ошибка FloodWaitError при получении группы {group.name}: {e.seconds}")
+                        FLOOD_WAIT_SECONDS.inc(e.seconds, 'resolve_chats')
+                        # Найденное до ожидания записываем сразу
+                        await TaskContainer._save_chat_ids(db, values)
+                        await asyncio.sleep(e.seconds)
+                    except Exception as e:
+                        logging.info(f"Не удалось получить группу {group.name}: {e}")
+                        break
+            await TaskContainer._save_chat_ids(db, values)
+        except Exception as e:
+            logging.error(f"Ошибка обновления индекса отслеживаемых групп: {e}")
+
+    @staticmethod
+    async def _save_chat_ids(db: Database, values: Dict[int, Dict[str, Any]]) -> None:
+        """Записывает найденные id чатов групп и перечитывает индекс отслеживаемых групп."""
+        await db.update_group_chats(values)
+        await TrackedChats.refresh(db)
 
 
 class MessageProcessor:
-    _messages_buffer: List[events.NewMessage.Event] = []
-    _blocked_ids: [int] = set()
-    _last_processed: datetime = datetime.now(timezone.utc)
-    _processing_interval: int = 30  # Интервал обработки в секундах (1 минута)
-    _lock = asyncio.Lock()
+    # Очередь ограничена по размеру: при заполнении add_message ждёт, пока loop заберёт пачку
+    _messages_queue: asyncio.Queue = asyncio.Queue(maxsize=MESSAGE_QUEUE_MAXSIZE)
+    # Заблокированные отправители: загружаются из БД при старте, новые копятся в _pending_blocked_ids
+    # и записываются в БД одной транзакцией после обработки пачки
+    _blocked_ids: Set[int] = set()
+    _pending_blocked_ids: Set[int] = set()
+    _db: Optional[Database] = None
+    # Журнал предзаписи очереди: открывается при старте клиента (open_wal)
+    _wal: Optional[MessageWal] = None
+    # Процессы-классификаторы (ClassifierWorkers): если заданы, сообщения уходят им, а не в _messages_queue
+    _workers: Optional[Any] = None
+    _batch_size: int = MESSAGE_BATCH_SIZE  # Сброс при накоплении стольких сообщений
+    _batch_max_age: float = MESSAGE_BATCH_MAX_AGE  # ...или когда самому старому сообщению столько секунд
+    _chunk_token_budget: int = MISTRAL_CHUNK_TOKEN_BUDGET  # Бюджет токенов одного запроса (промпт + сообщения)
+    _mistral_semaphore = asyncio.Semaphore(MISTRAL_MAX_CONCURRENCY)
+    # Кэш категорий по тексту: одинаковые сообщения из разных групп классифицируются один раз
+    _classification_cache = ClassificationCache(CLASSIFICATION_CACHE_TTL, CLASSIFICATION_CACHE_MAX_SIZE)
+    # Индекс почти одинаковых сообщений (репосты с другими эмодзи, форматом телефона, одним словом)
+    _near_duplicates = NearDuplicateIndex(NEAR_DUPLICATE_WINDOW, NEAR_DUPLICATE_MAX_DISTANCE,
+                                          NEAR_DUPLICATE_MAX_SIZE, NEAR_DUPLICATE_MIN_FEATURES)
+    # Быстрый фильтр по правилам (длина, язык, ключевые слова) перед Mistral
+    _prefilter_enabled: bool = PREFILTER_ENABLED
+    _prefilter = MessagePrefilter(PREFILTER_RULES_PATH)
+    # Потоковый режим: вердикты обрабатываются по мере получения ответа Mistral
+    _streaming: bool = MISTRAL_STREAMING
+    # Категории из промпта классификации; любое другое значение Mistral считается категорией 'invalid'
+    VERDICT_CATEGORIES = frozenset({
+        'spam', 'advertising', 'offer_job', 'seeking_ok', 'irrelevant', 'scam', 'request_quote', 'partnership',
+        'question', 'feedback', 'other',
+    })
+
+    @staticmethod
+    def _category(value: Any) -> str:
+        """Приводит категорию вердикта к известному значению, чтобы метки метрик и кэш не росли без предела."""
+        category = str(value).strip().lower()
+        return category if category in MessageProcessor.VERDICT_CATEGORIES else 'invalid'
+
+    # Схема вердикта Mistral: поле -> (приведение типа, допускается ли None)
+    _verdict_schema = {
+        'message_id': (int, False),
+        'chanel_id': (int, False),
+        'sender_id': (int, True),
+        'category': (_category, False),
+    }
     _prompt_message_default = """
         Верни json. 
         Твоя задача определить спам, рекламу и так далее. Самое основное, это понять что сообщение подходит нашим критериям.
@@ -174,91 +326,433 @@ class MessageProcessor:
         """
 
     @classmethod
-    async def add_message(cls, event: events.NewMessage.Event) -> None:
-        """Добавляет сообщение в буфер для последующей обработки."""
-        async with cls._lock:
-            cls._messages_buffer.append(event)
+    async def add_message(cls, event: events.NewMessage.Event, account: Optional[str] = None) -> None:
+        """
+        Добавляет сообщение в очередь для последующей обработки.
+        В очередь кладётся компактная запись BufferedMessage, а не всё событие.
+        Если очередь заполнена, ожидает освобождения места (backpressure).
+        В многопроцессном режиме запись передаётся процессу-классификатору.
+        :param account: Имя аккаунта пула, получившего сообщение (сохраняется в журнале для пересылки)
+        """
+        msg = BufferedMessage.from_event(event, account)
+        if cls._wal is not None:
+            cls._wal.append(msg)
+        if cls._workers is not None:
+            cls._workers.submit(msg)
+            return
+        await cls._messages_queue.put((time.monotonic(), msg))
 
     @classmethod
-    async def _process_buffered_messages(cls) -> None:
-        """Обрабатывает все накопленные сообщения."""
-        async with cls._lock:
-            cls._last_processed = datetime.now(timezone.utc)
+    async def _collect_batch(cls) -> List[BufferedMessage]:
+        """
+        Собирает пачку сообщений из очереди.
+        Ждёт первое сообщение без таймаута, затем добирает сообщения, пока пачка не заполнится
+        или самому старому сообщению не исполнится _batch_max_age секунд.
+        None в очереди - сигнал сбросить пачку немедленно (используется при остановке обработчика).
+        """
+        enqueued_at, message = await cls._messages_queue.get()
+        if message is None:
+            return []
+        batch = [message]
+        deadline = enqueued_at + cls._batch_max_age
+        while len(batch) < cls._batch_size:
+            # Сначала забираем всё, что уже лежит в очереди, без ожидания
+            try:
+                _, message = cls._messages_queue.get_nowait()
+                if message is None:
+                    break
+                batch.append(message)
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                _, message = await asyncio.wait_for(cls._messages_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if message is None:
+                break
+            batch.append(message)
+        return batch
 
-            if not cls._messages_buffer:
-                logging.info("Буфер пуст, нет сообщений для обработки.")
-                return
-            _messages_buffer = cls._messages_buffer.copy()
-            cls._messages_buffer.clear()
+    @classmethod
+    async def _classify_chunk(cls, mistral_client: MistralAI, message_list: str, prompt: str,
+                              batch: MessageBatch) -> bool:
+        """
+        Классифицирует один чанк сообщений в Mistral и применяет вердикты.
+        В потоковом режиме каждый вердикт обрабатывается сразу, как только его объект пришёл целиком.
+        Количество одновременных запросов ограничено семафором _mistral_semaphore.
+        :return: False, если Mistral не ответил (ошибка, таймаут)
+        """
+        parser = JsonObjectStreamParser()
+        try:
+            async with cls._mistral_semaphore:
+                if cls._streaming:
+                    async for text in mistral_client.chat_stream(message_list, prompt):
+                        cls._handle_verdicts(batch, parser.feed(text), from_mistral=True)
+                    return True
+                text_mistral = await mistral_client.chat(message_list, prompt)
+            # Ответ целиком разбираем уже после освобождения семафора
+            cls._handle_verdicts(batch, parser.feed(text_mistral), from_mistral=True)
+            return True
+        except Exception as e:
+            logging.info(f'Ошибка Mistral{e}')
+            return False
+        finally:
+            batch.invalid_verdicts += parser.errors
+
+    @classmethod
+    async def _process_buffered_messages(cls, _messages_buffer: List[BufferedMessage]) -> None:
+        """Обрабатывает пачку накопленных сообщений."""
+        if not _messages_buffer:
+            return
 
         # Здесь ваша логика обработки сообщений
         logging.info(f"Обрабатываю {len(_messages_buffer)} сообщений...")
-        message_list = "{"
-        count_message_mistral = 0
-        for msg in _messages_buffer:
-            if msg.sender_id not in cls._blocked_ids:
-                count_message_mistral += 1
-                message_list += f"Message id: {msg.id}, chanel_id: {msg.chat_id}, sender_id: {msg.sender_id}, text: {msg.text}\n"
-
-        # Здесь вы можете выполнить любую логику обработки сообщений
-        # print(msg.stringify())
-        logging.info(f"Количество сообщений для обработки в Mistral: {count_message_mistral}")
-        message_list += '}'
+        BATCH_SIZE.observe(len(_messages_buffer))
+        batch = MessageBatch(_messages_buffer)
+        with BATCH_SECONDS.time():
+            await cls._process_batch(batch)
+        # Сообщения чанков без ответа Mistral и не пересланные сообщения остаются в журнале
+        # и будут обработаны после перезапуска
+        failed = {id(msg) for msg in batch.failed}
+        if failed:
+            logging.info(f"Не обработано из-за ошибки Mistral или пересылки: {len(failed)}, "
+                         f"сообщения остаются в журнале")
+        cls._on_batch_done([msg for msg in _messages_buffer if id(msg) not in failed])
 
-        try:
-            with open('src/prompts/prompt_message.txt', 'r', encoding='utf-8') as file:
-                prompt = file.read()
-        except FileNotFoundError:
-            logging.info("Файл 'prompt_message.txt' не найден.")
-            prompt = cls._prompt_message_default
+    @classmethod
+    def _on_batch_done(cls, messages: List[BufferedMessage]) -> None:
+        """Вызывается, когда сообщения пачки классифицированы и пересланы: их записи журнала больше не нужны."""
+        cls.ack_wal(msg.wal_seq for msg in messages)
+
+    @classmethod
+    def ack_wal(cls, seqs: Iterable[int]) -> None:
+        """Подтверждает записи журнала предзаписи, если журнал открыт."""
+        if cls._wal is not None:
+            cls._wal.ack(seqs)
 
-        mistral_client = MistralAI(MISTRAL_API_KEY, MISTRAL_API_MODEL)
+    @classmethod
+    async def _process_batch(cls, batch: MessageBatch) -> None:
+        """Классифицирует сообщения пачки, пересылает подходящие и записывает новых заблокированных отправителей."""
+        # Вердикты для сообщений, текст которых уже классифицирован (кэш или кластер почти одинаковых
+        # сообщений), в Mistral не отправляем
+        cached_verdicts = []
+        # Сообщения, которые отправляются в Mistral
+        requested: List[BufferedMessage] = []
+        dropped_by_prefilter = 0
+        dropped_blocked = 0
+        cls._prefilter.reload_if_changed()
+        for msg in batch.messages:
+            if cls.is_blocked(msg.sender_id):
+                dropped_blocked += 1
+                continue
+            # Заведомо нерелевантные сообщения (короткие реплики, без строительных слов) отбрасываем сразу
+            if cls._prefilter_enabled and cls._prefilter.check(msg.text) is not None:
+                dropped_by_prefilter += 1
+                continue
+            cluster_id = None
+            category = None
+            if cls._cacheable(msg.text):
+                category = cls._classification_cache.get(msg.text)
+                if category is None:
+                    cluster_id, category = cls._near_duplicates.match(msg.text)
+            if category is not None:
+                cached_verdicts.append(cls._local_verdict(msg, category))
+                continue
+            if cluster_id is not None:
+                members = batch.cluster_members.setdefault(cluster_id, [])
+                members.append(msg)
+                if len(members) > 1:
+                    continue
+                batch.message_clusters[(msg.chat_id, msg.id)] = cluster_id
+            requested.append(msg)
+        MESSAGES_DROPPED.inc(dropped_blocked, 'blocked')
+        MESSAGES_DROPPED.inc(dropped_by_prefilter, 'prefilter')
+        logging.info(f"Количество сообщений для обработки в Mistral: {len(requested)}, "
+                     f"из кэша: {len(cached_verdicts)}, отброшено фильтром: {dropped_by_prefilter}, "
+                     f"статистика кэша: {cls._classification_cache.stats()}")
+
+        # Вердикты из кэша известны сразу, пересылку по ним запускаем до запросов к Mistral
+        cls._handle_verdicts(batch, cached_verdicts, from_mistral=False)
+        if requested:
+            await cls._classify_messages(batch, requested)
+        # Сообщения кластеров, представитель которых получил неизвестную категорию, классифицируются отдельно
+        retry = [msg for msg in batch.retry if (msg.chat_id, msg.id) in batch.index]
+        if retry:
+            logging.info(f"Повторно в Mistral (неизвестная категория кластера): {len(retry)}")
+            await cls._classify_messages(batch, retry)
+        if batch.invalid_verdicts:
+            INVALID_VERDICTS.inc(batch.invalid_verdicts)
+            logging.info(f"Пропущено некорректных вердиктов Mistral: {batch.invalid_verdicts}")
+        for not_forwarded in await asyncio.gather(*batch.forward_tasks, return_exceptions=True):
+            if isinstance(not_forwarded, list):
+                batch.failed += not_forwarded
+        await cls._flush_blocked_ids()
+
+    @classmethod
+    async def _classify_messages(cls, batch: MessageBatch, messages: List[BufferedMessage]) -> None:
+        """
+        Классифицирует сообщения в Mistral чанками, каждый из которых вместе с промптом укладывается
+        в бюджет токенов. Сообщения чанков без ответа Mistral добавляются в batch.failed.
+        """
+        prompt = PromptRegistry.get('prompt_message.txt', cls._prompt_message_default)
+        message_lines = [f"Message id: {msg.id}, chanel_id: {msg.chat_id}, sender_id: {msg.sender_id}, "
+                         f"text: {msg.text}\n" for msg in messages]
+
+        # Делим пачку на чанки, чтобы каждый запрос вместе с промптом уложился в бюджет токенов
+        token_budget = max(cls._chunk_token_budget - estimate_tokens(prompt), MIN_CHUNK_TOKEN_BUDGET)
+        chunk_ranges = split_into_chunk_ranges(message_lines, token_budget)
+        logging.info(f"Сообщения разбиты на {len(chunk_ranges)} чанков для Mistral")
+
+        mistral_client = MistralAI.shared(MISTRAL_API_KEY, MISTRAL_API_MODEL)
+        chunks = (join_chunk(message_lines, chunk_range, token_budget) for chunk_range in chunk_ranges)
+        results = await asyncio.gather(
+            *(cls._classify_chunk(mistral_client, '{' + chunk + '}', prompt, batch) for chunk in chunks)
+        )
+        for succeeded, chunk_range in zip(results, chunk_ranges):
+            if not succeeded:
+                batch.failed += cls._unclassified(batch, [messages[index] for index in chunk_range])
+
+    @staticmethod
+    def _unclassified(batch: MessageBatch, messages: List[BufferedMessage]) -> List[BufferedMessage]:
+        """
+        Сообщения чанка без вердикта вместе с сообщениями их кластеров, которые ждали вердикт того же запроса.
+        В потоковом режиме часть вердиктов могла прийти до ошибки - такие сообщения уже обработаны.
+        """
+        unclassified = []
+        for msg in messages:
+            key = (msg.chat_id, msg.id)
+            if key not in batch.index:
+                continue
+            cluster_id = batch.message_clusters.get(key)
+            members = batch.cluster_members[cluster_id] if cluster_id is not None else [msg]
+            unclassified += [member for member in members if (member.chat_id, member.id) in batch.index]
+        return unclassified
+
+    @classmethod
+    def _handle_verdicts(cls, batch: MessageBatch, objects: List[Any], from_mistral: bool) -> None:
+        """
+        Проверяет вердикты по схеме, применяет их к сообщениям пачки и запускает пересылку подходящих.
+        Вердикт, не прошедший проверку, пропускается без влияния на остальные.
+        """
+        to_forward = []
+        for obj in objects:
+            verdict = JsonUtils.validate(obj, cls._verdict_schema)
+            if verdict is None:
+                batch.invalid_verdicts += 1
+                continue
+            to_forward += cls._apply_verdict(batch, verdict, from_mistral)
+        if to_forward:
+            # Сообщения группируем по исходному чату для пересылки одним запросом
+            forward_groups: Dict[int, List[BufferedMessage]] = {}
+            for msg in to_forward:
+                forward_groups.setdefault(msg.chat_id, []).append(msg)
+            batch.forward_tasks.append(asyncio.create_task(cls._forward_messages(forward_groups)))
+
+    @classmethod
+    def _apply_verdict(cls, batch: MessageBatch, verdict: dict, from_mistral: bool) -> List[BufferedMessage]:
+        """
+        Применяет вердикт к сообщению пачки: кэширует категорию, распространяет её на кластер
+        почти одинаковых сообщений, блокирует отправителей спама.
+        :return: Сообщения, которые нужно переслать
+        """
+        key = (verdict['chanel_id'], verdict['message_id'])
+        msg_obg = batch.index.pop(key, None)
+        if msg_obg is None:
+            return []
+        status_msg = verdict['category']
+        VERDICTS.inc(1, status_msg, 'mistral' if from_mistral else 'cache')
+        affected = [msg_obg]
+        cluster_id = batch.message_clusters.get(key)
+        if status_msg == 'invalid':
+            # Неизвестную категорию не кэшируем и не переносим на кластер: остальные сообщения кластера
+            # отправляются в Mistral отдельно после основного запроса
+            if cluster_id is not None:
+                batch.retry += batch.cluster_members[cluster_id][1:]
+        elif from_mistral:
+            if cls._cacheable(msg_obg.text):
+                cls._classification_cache.put(msg_obg.text, status_msg)
+            if cluster_id is not None:
+                cls._near_duplicates.set_category(cluster_id, status_msg)
+                for member in batch.cluster_members[cluster_id][1:]:
+                    if batch.index.pop((member.chat_id, member.id), None) is not None:
+                        if cls._cacheable(member.text):
+                            cls._classification_cache.put(member.text, status_msg)
+                        VERDICTS.inc(1, status_msg, 'cluster')
+                        affected.append(member)
+        if status_msg in ['scam', 'spam']:
+            for msg in affected:
+                cls._block_sender(msg.sender_id)
+        if status_msg == 'seeking_ok':
+            for msg in affected:
+                logging.info(f'Пересылаю сообщение: {msg.text}')
+            return affected
+        return []
+
+    @classmethod
+    async def load_blocked_ids(cls, db: Database) -> None:
+        """Загружает список заблокированных отправителей из БД. Вызывается при старте клиента."""
+        cls._db = db
+        cls._blocked_ids |= await db.get_blocked_sender_ids()
+        logging.info(f"Загружено заблокированных отправителей: {len(cls._blocked_ids)}")
+
+    @classmethod
+    def open_wal(cls, path: str = MESSAGE_WAL_PATH) -> List[BufferedMessage]:
+        """
+        Открывает журнал предзаписи очереди и запускает его периодический сброс на диск.
+        :param path: Путь к файлу журнала; пустой путь отключает журнал
+        :return: Сообщения, не обработанные до прошлой остановки
+        """
+        if not path or cls._wal is not None:
+            return []
+        cls._wal = MessageWal(path, MESSAGE_WAL_FLUSH_INTERVAL, MESSAGE_WAL_MAX_BYTES)
+        messages = cls._wal.load()
+        cls._wal.start()
+        if messages:
+            logging.info(f"В журнале найдено необработанных сообщений: {len(messages)}")
+        return messages
+
+    @classmethod
+    async def replay_messages(cls, messages: List[BufferedMessage], client_pool: ClientPool,
+                              default_client: TelegramClient) -> None:
+        """
+        Возвращает в очередь сообщения из журнала. Для пересылки подставляется подключённый клиент
+        аккаунта, получившего сообщение: access_hash входного peer чата действителен только для него.
+        Если аккаунта больше нет в пуле, peer чата разрешается клиентом default_client по id из его сессии;
+        сообщения, чат которых ему неизвестен, подтверждаются и отбрасываются.
+        Записи в журнале остаются под прежними номерами до подтверждения.
+        :param client_pool: Пул подключённых аккаунтов
+        :param default_client: Основной клиент пула (и клиент записей журнала без имени аккаунта)
+        """
+        dropped = []
+        for msg in messages:
+            client = client_pool.clients.get(msg.account) if msg.account is not None else default_client
+            if client is None:
+                try:
+                    msg.input_chat = await default_client.get_input_entity(msg.chat_id)
+                except (ValueError, TypeError) as e:
+                    logging.info(f"Сообщение {msg.id} из чата {msg.chat_id} аккаунта {msg.account} "
+                                 f"не восстановлено: {e}")
+                    dropped.append(msg.wal_seq)
+                    continue
+                client = default_client
+                msg.account = client_pool.name(default_client)
+            msg.client = client
+            if cls._workers is not None:
+                cls._workers.submit(msg)
+            else:
+                await cls._messages_queue.put((time.monotonic(), msg))
+        if dropped:
+            logging.info(f"Отброшено сообщений журнала исключённых аккаунтов: {len(dropped)}")
+            cls.ack_wal(dropped)
+
+    @classmethod
+    def set_workers(cls, workers: Optional[Any]) -> None:
+        """Включает (ClassifierWorkers) или отключает (None) многопроцессный режим классификации."""
+        cls._workers = workers
+
+    @classmethod
+    async def close_wal(cls) -> None:
+        """Сбрасывает журнал на диск и закрывает его."""
+        if cls._wal is not None:
+            await cls._wal.close()
+            cls._wal = None
+
+    @classmethod
+    def is_blocked(cls, sender_id: Optional[int]) -> bool:
+        """Проверяет, заблокирован ли отправитель."""
+        return sender_id in cls._blocked_ids
+
+    @classmethod
+    def _block_sender(cls, sender_id: Any) -> None:
+        """Блокирует отправителя. Некорректные id (None, не число) пропускаются."""
         try:
-            text_mistral = await mistral_client.chat(message_list, prompt)
-            #logging.info(text_mistral)
-            # ПРЕОБРАЗУЕМ В JSON
-            mistral_dict = JsonUtils.text_to_json(text_mistral)
-            list_msg_dict = []
-            if type(mistral_dict) is dict:
-                # logging.info(f'Mistral: {mistral_dict}')
-                status_msg = mistral_dict.get('category', None)
-                if status_msg in ['scam', 'spam']:
-                    cls._blocked_ids.add(mistral_dict.get('sender_id', None))
-                if status_msg == 'seeking_ok':
-                    list_msg_dict.append(mistral_dict)
-                    #logging.info(mistral_dict)
-            elif type(mistral_dict) is list:
-                # logging.info(f'Mistral: {mistral_dict}')
-                for msg_dict in mistral_dict:
-                    status_msg = msg_dict.get('category', None)
-                    if status_msg in ['scam', 'spam']:
-                        cls._blocked_ids.add(msg_dict.get('sender_id', None))
-                    if status_msg == 'seeking_ok':
-                        #logging.info(msg_dict)
-                        list_msg_dict.append(msg_dict)
-            if list_msg_dict:
-                for msg_forward in list_msg_dict:
-                    chanel_id_forward = msg_forward.get('chanel_id', None)
-                    message_id_forward = msg_forward.get('message_id', None)
-                    for msg_obg in _messages_buffer:
-                        if (msg_obg.chat_id == chanel_id_forward) and (msg_obg.id == message_id_forward):
-                            logging.info(f'Пересылаю сообщение: {msg_obg.text}')
-                            if FORWARD_CHAT_ID:
-                                for chat_id in FORWARD_CHAT_ID:
-                                    await msg_obg.message.forward_to(chat_id)
-                                #await msg_obg.message.forward_to(FORWARD_CHAT_ID)
+            sender_id = int(sender_id)
+        except (TypeError, ValueError):
+            return
+        if sender_id not in cls._blocked_ids:
+            cls._blocked_ids.add(sender_id)
+            cls._pending_blocked_ids.add(sender_id)
 
+    @classmethod
+    async def _flush_blocked_ids(cls) -> None:
+        """Записывает в БД отправителей, заблокированных с момента прошлой записи."""
+        if not cls._pending_blocked_ids or cls._db is None:
+            return
+        pending = cls._pending_blocked_ids
+        cls._pending_blocked_ids = set()
+        try:
+            await cls._db.add_blocked_senders(pending)
         except Exception as e:
-            logging.info(f'Ошибка Mistral{e}')
+            logging.error(f"Ошибка записи заблокированных отправителей в БД: {e}")
+            cls._pending_blocked_ids |= pending
+
+    @classmethod
+    def cache_stats(cls) -> Dict[str, float]:
+        """Статистика кэша классификации: попадания, промахи, размер, доля попаданий."""
+        return cls._classification_cache.stats()
+
+    @classmethod
+    def prefilter_stats(cls) -> Dict[str, int]:
+        """Статистика предварительного фильтра: пропущено в Mistral и отброшено по каждому правилу."""
+        return cls._prefilter.stats()
+
+    @staticmethod
+    def _cacheable(text: Optional[str]) -> bool:
+        """
+        Можно ли кэшировать категорию текста. У всех пустых текстов (медиа без подписи) один ключ кэша,
+        поэтому их категория не переносится на другие сообщения.
+        """
+        return bool(normalize_text(text))
+
+    @staticmethod
+    def _local_verdict(msg: BufferedMessage, category: str) -> dict:
+        """Формирует вердикт в формате ответа Mistral для сообщения, классифицированного без запроса к Mistral."""
+        return {'message_id': msg.id, 'chanel_id': msg.chat_id, 'sender_id': msg.sender_id, 'category': category}
+
+    @classmethod
+    async def _forward_messages(cls, forward_groups: Dict[int, List[BufferedMessage]]) -> List[BufferedMessage]:
+        """
+        Пересылает сообщения получателям из FORWARD_CHAT_ID.
+        Для каждой пары (исходный чат, получатель) выполняется один запрос forward_messages.
+        :return: Сообщения, которые не удалось переслать хотя бы одному получателю (журнал их не подтверждает)
+        """
+        not_forwarded = []
+        for source_chat_id, messages in forward_groups.items():
+            first = messages[0]
+            from_peer = first.input_chat or source_chat_id
+            message_ids = [msg.id for msg in messages]
+            failed = False
+            for chat_id in FORWARD_CHAT_ID:
+                try:
+                    await first.client.forward_messages(chat_id, message_ids, from_peer=from_peer)
+                    FORWARDS.inc(len(message_ids), 'ok')
+                except errors.FloodWaitError as e:
+                    FLOOD_WAIT_SECONDS.inc(e.seconds, 'forward')
+                    FORWARDS.inc(len(message_ids), 'error')
+                    logging.info(f'FloodWait при пересылке сообщений из {source_chat_id} в {chat_id}: {e.seconds} с')
+                    failed = True
+                except Exception as e:
+                    FORWARDS.inc(len(message_ids), 'error')
+                    logging.info(f'Ошибка пересылки сообщений из {source_chat_id} в {chat_id}: {e}')
+                    failed = True
+            if failed:
+                not_forwarded += messages
+        return not_forwarded
 
     @classmethod
     async def processing_loop(cls) -> None:
-        """Фоновая задача, которая периодически вызывает обработку сообщений."""
+        """
+        Фоновая задача обработки сообщений.
+        Пока очередь пуста, задача спит на ожидании первого сообщения и не выполняет никакой работы.
+        """
         while True:
-            now = datetime.now(timezone.utc)
-            time_since_last = (now - cls._last_processed).total_seconds()
+            batch = await cls._collect_batch()
+            await cls._process_buffered_messages(batch)
 
-            if time_since_last >= cls._processing_interval:
-                await cls._process_buffered_messages()
 
-            await asyncio.sleep(1)
+# Глубина очереди считается при выгрузке метрик, add_message её не обновляет
+BUFFER_DEPTH.set_function(MessageProcessor._messages_queue.qsize)
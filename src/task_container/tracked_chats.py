@@ -0,0 +1,56 @@
+# tracked_chats.py
+import logging
+from typing import Iterable, Optional, Set
+
+from src.database.database import Database
+
+
+class TrackedChats:
+    """
+    Индекс отслеживаемых групп: id чатов (в формате Telethon, как event.chat_id) со статусом 'connected' в БД.
+    Сообщения из остальных групп отбрасываются до постановки в очередь.
+    Индекс загружается из БД при старте и обновляется при смене статуса группы.
+    Пока у части подключённых групп id чата неизвестен (подключены до появления индекса и ещё не разрешены),
+    сообщения пропускаются из всех групп: иначе сообщения этих групп терялись бы.
+    """
+    _ids: Set[int] = set()
+    _enabled: bool = True
+    _unresolved: int = 0
+
+    @classmethod
+    async def refresh(cls, db: Database) -> None:
+        """Перечитывает из БД id групп со статусом 'connected' и количество групп без id чата."""
+        cls._ids = await db.get_connected_chat_ids()
+        cls._unresolved = await db.count_connected_chats_without_channel_id()
+        logging.info(f"Отслеживаемых групп: {len(cls._ids)}, без id чата: {cls._unresolved}")
+
+    @classmethod
+    def set_enabled(cls, enabled: bool) -> None:
+        """Включает или отключает фильтрацию сообщений по индексу."""
+        cls._enabled = enabled
+
+    @classmethod
+    def is_tracked(cls, chat_id: Optional[int]) -> bool:
+        """Проверяет, нужно ли обрабатывать сообщения из чата."""
+        return not cls._enabled or cls._unresolved > 0 or chat_id in cls._ids
+
+    @classmethod
+    def has_unresolved(cls) -> bool:
+        """Есть ли подключённые группы без id чата."""
+        return cls._unresolved > 0
+
+    @classmethod
+    def add(cls, chat_id: int) -> None:
+        cls._ids.add(chat_id)
+
+    @classmethod
+    def discard(cls, chat_id: int) -> None:
+        cls._ids.discard(chat_id)
+
+    @classmethod
+    def replace(cls, chat_ids: Iterable[int]) -> None:
+        cls._ids = set(chat_ids)
+
+    @classmethod
+    def count(cls) -> int:
+        return len(cls._ids)
@@ -0,0 +1,282 @@
+# workers.py
+import asyncio
+import logging
+import multiprocessing
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from telethon import TelegramClient
+
+from config import LOG_LEVEL
+from src.task_container.models import BufferedMessage
+from src.task_container.tasks import MessageProcessor
+from src.utils.mistralAi import MistralAI
+
+# Запись сообщения для процесса-классификатора: (номер записи, id, chat_id, sender_id, text).
+# Номер записи присваивает ClassifierWorkers; в процессе-классификаторе он хранится в wal_seq сообщения
+# и возвращается в командах 'forward' и 'done', а процесс с клиентом сопоставляет его с записью журнала
+Record = Tuple[int, int, Optional[int], Optional[int], str]
+
+
+class WorkerMessageProcessor(MessageProcessor):
+    """
+    MessageProcessor в процессе-классификаторе.
+    Классификация та же, но пересылка, блокировка отправителей и подтверждение журнала выполняются
+    процессом с клиентом Telegram: вместо них в очередь результатов отправляются команды.
+    Пересылаемые сообщения процесс с клиентом подтверждает после успешной пересылки, а не по команде 'done'.
+    """
+    _results: Optional[multiprocessing.Queue] = None
+    _forwarded: Set[int] = set()
+
+    @classmethod
+    def _send(cls, kind: str, payload: Any) -> None:
+        cls._results.put((kind, payload))
+
+    @classmethod
+    async def _forward_messages(cls, forward_groups: Dict[int, List[BufferedMessage]]) -> List[BufferedMessage]:
+        cls._send('forward', [(chat_id, [(msg.id, msg.wal_seq) for msg in messages])
+                              for chat_id, messages in forward_groups.items()])
+        cls._forwarded.update(msg.wal_seq for messages in forward_groups.values() for msg in messages)
+        return []
+
+    @classmethod
+    async def _flush_blocked_ids(cls) -> None:
+        if cls._pending_blocked_ids:
+            cls._send('block', list(cls._pending_blocked_ids))
+            cls._pending_blocked_ids = set()
+
+    @classmethod
+    def _on_batch_done(cls, messages: List[BufferedMessage]) -> None:
+        cls._send('done', [msg.wal_seq for msg in messages if msg.wal_seq not in cls._forwarded])
+        cls._forwarded.clear()
+
+    @classmethod
+    async def _feed(cls, inbox: multiprocessing.Queue) -> None:
+        """Перекладывает записи из межпроцессной очереди в очередь обработки до получения None."""
+        while True:
+            records = await asyncio.to_thread(inbox.get)
+            now = time.monotonic()
+            if records is None:
+                await cls._messages_queue.put((now, None))
+                return
+            for number, message_id, chat_id, sender_id, text in records:
+                msg = BufferedMessage(message_id, chat_id, sender_id, text)
+                msg.wal_seq = number
+                await cls._messages_queue.put((now, msg))
+
+    @classmethod
+    async def serve(cls, inbox: multiprocessing.Queue, results: multiprocessing.Queue, blocked_ids: Set[int]) -> None:
+        """Обрабатывает пачки, пока не получен сигнал остановки и очередь не опустела."""
+        cls._results = results
+        cls._blocked_ids = set(blocked_ids)
+        feeder = asyncio.create_task(cls._feed(inbox))
+        cls._send('ready', None)
+        while True:
+            batch = await cls._collect_batch()
+            await cls._process_buffered_messages(batch)
+            if feeder.done() and cls._messages_queue.empty():
+                break
+        await feeder
+        await MistralAI.close_all()
+        cls._send('stopped', None)
+
+
+def run_worker(index: int, inbox: multiprocessing.Queue, results: multiprocessing.Queue, blocked_ids: Set[int]) -> None:
+    """Точка входа процесса-классификатора."""
+    logging.basicConfig(level=getattr(logging, LOG_LEVEL),
+                        format=f'%(asctime)s - classifier-{index} - %(name)s - %(levelname)s - %(message)s')
+    try:
+        asyncio.run(WorkerMessageProcessor.serve(inbox, results, blocked_ids))
+    except KeyboardInterrupt:
+        pass
+
+
+class ClassifierWorkers:
+    """
+    Процессы-классификаторы для многопроцессного режима.
+    Процесс с клиентом Telegram только принимает обновления и передаёт компактные записи сообщений
+    процессам-классификаторам; те выполняют логику MessageProcessor и возвращают команды пересылки,
+    блокировки отправителей и подтверждения журнала. Записи копятся и передаются пачками раз
+    в flush_interval секунд, чтобы не платить за межпроцессную передачу каждого сообщения.
+    Сообщения распределяются по процессам по тексту, поэтому одинаковые тексты попадают в один кэш.
+    Процесс, завершившийся с ошибкой, перезапускается с новой очередью записей, и ему заново передаются
+    записи, которые он не подтвердил.
+    """
+
+    def __init__(self, processes: int, flush_interval: float = 0.02, max_chunk: int = 500,
+                 supervise_interval: float = 1.0):
+        context = multiprocessing.get_context('spawn')
+        self.flush_interval = flush_interval
+        self.max_chunk = max_chunk
+        self.supervise_interval = supervise_interval
+        self._inboxes = [context.Queue() for _ in range(processes)]
+        self._results = context.Queue()
+        self._buffers: List[List[Record]] = [[] for _ in range(processes)]
+        self._context = context
+        self._processes: List[multiprocessing.Process] = []
+        # Входной peer и клиент последнего сообщения каждого чата: нужны для пересылки
+        self._peers: Dict[int, Tuple[Any, Optional[TelegramClient]]] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._forward_tasks: Set[asyncio.Task] = set()
+        # Номер записи -> (индекс процесса, wal_seq, запись) для записей, ещё не подтверждённых
+        # процессом-классификатором: после его падения они передаются перезапущенному процессу
+        self._number = 0
+        self._inflight: Dict[int, Tuple[int, int, Record]] = {}
+        self._stopping = False
+        self.restarts = 0
+        self._ready = 0
+        self._all_ready = asyncio.Event()
+        self._stopped = 0
+        self._all_stopped = asyncio.Event()
+        self.processed = 0
+
+    def start(self, blocked_ids: Iterable[int] = ()) -> None:
+        """Запускает процессы-классификаторы и задачи обмена с ними."""
+        blocked_ids = set(blocked_ids)
+        self._processes = [self._spawn(index, blocked_ids) for index in range(len(self._inboxes))]
+        self._tasks = [asyncio.create_task(self._flush_loop()), asyncio.create_task(self._results_loop()),
+                       asyncio.create_task(self._supervise_loop())]
+        logging.info(f"Запущено процессов-классификаторов: {len(self._processes)}")
+
+    def _spawn(self, index: int, blocked_ids: Set[int]) -> multiprocessing.Process:
+        process = self._context.Process(target=run_worker,
+                                        args=(index, self._inboxes[index], self._results, blocked_ids),
+                                        name=f'classifier-{index}', daemon=True)
+        process.start()
+        return process
+
+    async def _supervise_loop(self) -> None:
+        """Перезапускает процессы-классификаторы, завершившиеся с ошибкой."""
+        while True:
+            await asyncio.sleep(self.supervise_interval)
+            for index, process in enumerate(self._processes):
+                # Код 0 - штатное завершение после сигнала остановки
+                if not process.is_alive() and process.exitcode != 0:
+                    self._restart(index)
+
+    def _restart(self, index: int) -> None:
+        """
+        Запускает процесс-классификатор вместо упавшего. Очередь записей создаётся заново: упавший процесс
+        мог оставить её заблокированной. Неподтверждённые записи процесса передаются новому процессу.
+        """
+        logging.error(f"Процесс-классификатор {index} завершился с кодом {self._processes[index].exitcode}, "
+                      f"перезапускаю")
+        self.restarts += 1
+        self._inboxes[index] = self._context.Queue()
+        records = [record for worker, _, record in self._inflight.values() if worker == index]
+        for start in range(0, len(records), self.max_chunk):
+            self._inboxes[index].put(records[start:start + self.max_chunk])
+        if self._stopping:
+            self._inboxes[index].put(None)
+        self._processes[index] = self._spawn(index, set(MessageProcessor._blocked_ids))
+        logging.info(f"Процессу-классификатору {index} передано неподтверждённых записей: {len(records)}")
+
+    def submit(self, msg: BufferedMessage) -> None:
+        """Передаёт сообщение процессу-классификатору. Не блокирует: запись уходит со следующим сбросом."""
+        self._peers[msg.chat_id] = (msg.input_chat, msg.client)
+        index = hash(msg.text) % len(self._buffers)
+        buffer = self._buffers[index]
+        self._number += 1
+        record = (self._number, msg.id, msg.chat_id, msg.sender_id, msg.text)
+        self._inflight[self._number] = (index, msg.wal_seq, record)
+        buffer.append(record)
+        if len(buffer) >= self.max_chunk:
+            self._flush(index)
+
+    def _flush(self, index: int) -> None:
+        buffer = self._buffers[index]
+        if buffer:
+            self._buffers[index] = []
+            self._inboxes[index].put(buffer)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            for index in range(len(self._buffers)):
+                self._flush(index)
+
+    async def _results_loop(self) -> None:
+        while True:
+            kind, payload = await asyncio.to_thread(self._results.get)
+            if kind == 'exit':
+                return
+            try:
+                await self._handle(kind, payload)
+            except Exception as e:
+                logging.error(f"Ошибка обработки команды процесса-классификатора {kind}: {e}")
+
+    async def _handle(self, kind: str, payload: Any) -> None:
+        if kind == 'forward':
+            forward_groups: Dict[int, List[BufferedMessage]] = {}
+            for chat_id, messages in payload:
+                input_chat, client = self._peers.get(chat_id, (None, None))
+                forward_groups[chat_id] = []
+                for message_id, number in messages:
+                    msg = BufferedMessage(message_id, chat_id, None, '', input_chat, client)
+                    msg.wal_seq = self._wal_seq(number)
+                    forward_groups[chat_id].append(msg)
+                self.processed += len(messages)
+            # Пересылка не должна задерживать обработку остальных команд
+            task = asyncio.create_task(self._forward(forward_groups))
+            self._forward_tasks.add(task)
+            task.add_done_callback(self._forward_tasks.discard)
+        elif kind == 'block':
+            for sender_id in payload:
+                MessageProcessor._block_sender(sender_id)
+            await MessageProcessor._flush_blocked_ids()
+        elif kind == 'done':
+            self.processed += len(payload)
+            MessageProcessor.ack_wal([self._wal_seq(number) for number in payload])
+        elif kind == 'ready':
+            self._ready += 1
+            if self._ready >= len(self._processes) and not self._all_ready.is_set():
+                self._all_ready.set()
+                logging.info("Процессы-классификаторы готовы")
+        elif kind == 'stopped':
+            self._stopped += 1
+            if self._stopped == len(self._processes):
+                self._all_stopped.set()
+
+    def _wal_seq(self, number: int) -> int:
+        """Снимает запись с учёта неподтверждённых и возвращает её wal_seq."""
+        _, wal_seq, _ = self._inflight.pop(number, (None, 0, None))
+        return wal_seq
+
+    @staticmethod
+    async def _forward(forward_groups: Dict[int, List[BufferedMessage]]) -> None:
+        """Пересылает сообщения и подтверждает в журнале только пересланные."""
+        not_forwarded = {id(msg) for msg in await MessageProcessor._forward_messages(forward_groups)}
+        MessageProcessor.ack_wal(msg.wal_seq for messages in forward_groups.values() for msg in messages
+                                 if id(msg) not in not_forwarded)
+
+    async def wait_ready(self, timeout: float = 60) -> bool:
+        """Ждёт, пока все процессы-классификаторы запустятся. Записи, отправленные раньше, не теряются."""
+        try:
+            await asyncio.wait_for(self._all_ready.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def stop(self, timeout: float = 60) -> None:
+        """
+        Останавливает классификаторы: передаёт остаток записей, ждёт обработки всех пачек
+        и завершения пересылок, затем завершает процессы.
+        """
+        self._stopping = True
+        self._tasks[0].cancel()
+        for index, inbox in enumerate(self._inboxes):
+            self._flush(index)
+            inbox.put(None)
+        try:
+            await asyncio.wait_for(self._all_stopped.wait(), timeout)
+        except asyncio.TimeoutError:
+            logging.error("Процессы-классификаторы не завершили обработку вовремя")
+        self._tasks[2].cancel()
+        self._results.put(('exit', None))
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await asyncio.gather(*self._forward_tasks, return_exceptions=True)
+        for process in self._processes:
+            await asyncio.to_thread(process.join, 5)
+            if process.is_alive():
+                process.terminate()
+        logging.info("Процессы-классификаторы остановлены")
@@ -0,0 +1,129 @@
+import asyncio
+import bisect
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Hashable, List, Sequence, Tuple
+
+from telethon import TelegramClient, events, types
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """
+    Консистентное хеширование: каждый узел занимает replicas точек на кольце, ключ принадлежит
+    ближайшей точке по часовой стрелке. При добавлении или удалении узла переезжает только его доля ключей.
+    """
+
+    def __init__(self, nodes: Sequence[str], replicas: int = 100):
+        self.nodes = list(nodes)
+        self._ring: List[Tuple[int, str]] = sorted(
+            (_hash(f'{node}#{replica}'), node) for node in self.nodes for replica in range(replicas))
+        self._points = [point for point, _ in self._ring]
+
+    def preference(self, key: str) -> List[str]:
+        """
+        Возвращает узлы в порядке предпочтения для ключа: владелец, затем следующие по кольцу.
+        :param key: Ключ (например, имя группы)
+        :return: Список различных узлов
+        """
+        if not self._ring:
+            return []
+        start = bisect.bisect(self._points, _hash(key))
+        result: List[str] = []
+        for offset in range(len(self._ring)):
+            node = self._ring[(start + offset) % len(self._ring)][1]
+            if node not in result:
+                result.append(node)
+                if len(result) == len(self.nodes):
+                    break
+        return result
+
+
+class ClientPool:
+    """
+    Пул Telegram-аккаунтов одного процесса.
+    Группы распределяются по аккаунтам консистентным хешированием; работа с группой выдаётся
+    первому по кольцу аккаунту, который не ждёт FloodWait. Каждый аккаунт выполняет одну задачу за раз,
+    поэтому N аккаунтов обрабатывают до N групп параллельно, каждый в пределах своих лимитов.
+    """
+
+    def __init__(self, clients: Dict[str, TelegramClient]):
+        self.clients = clients
+        self._names = {id(client): name for name, client in clients.items()}
+        self._ring = HashRing(list(clients))
+        self._locks = {name: asyncio.Lock() for name in clients}
+        self._flood_until: Dict[str, float] = {}
+
+    def name(self, client: TelegramClient) -> str:
+        return self._names[id(client)]
+
+    def report_flood(self, client: TelegramClient, seconds: float) -> None:
+        """Отмечает, что аккаунт получил FloodWait и не должен получать работу seconds секунд."""
+        name = self.name(client)
+        self._flood_until[name] = max(self._flood_until.get(name, 0), time.monotonic() + seconds)
+        logging.warning(f"Аккаунт {name} ждёт FloodWait {seconds} с")
+
+    def flood_remaining(self, name: str) -> float:
+        return max(0.0, self._flood_until.get(name, 0) - time.monotonic())
+
+    def owner(self, key: str) -> TelegramClient:
+        """Возвращает аккаунт, за которым закреплён ключ (без учёта FloodWait)."""
+        return self.clients[self._ring.preference(key)[0]]
+
+    @asynccontextmanager
+    async def lease(self, key: str) -> AsyncIterator[TelegramClient]:
+        """
+        Выдаёт аккаунт для работы с группой key на время блока with.
+        Берётся первый по кольцу аккаунт без FloodWait; если FloodWait у всех, ждём ближайшего окончания.
+        """
+        while True:
+            preference = self._ring.preference(key)
+            name = next((name for name in preference if not self.flood_remaining(name)), None)
+            if name is None:
+                await asyncio.sleep(min(self.flood_remaining(name) for name in preference))
+                continue
+            async with self._locks[name]:
+                # Пока ждали освобождения аккаунта, он мог получить FloodWait в другой задаче
+                if self.flood_remaining(name):
+                    continue
+                yield self.clients[name]
+                return
+
+    def status(self) -> Dict[str, float]:
+        """Оставшееся время FloodWait по аккаунтам, с."""
+        return {name: round(self.flood_remaining(name), 1) for name in self.clients}
+
+
+class MessageDeduplicator:
+    """
+    Отбрасывает повторные доставки одного сообщения группы, когда в группе состоят несколько аккаунтов пула.
+    В супергруппах id сообщения общий для всех участников, в обычных группах у каждого аккаунта свой,
+    поэтому там сообщение определяется по отправителю, времени и тексту.
+    """
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._seen: OrderedDict[Hashable, None] = OrderedDict()
+
+    @staticmethod
+    def _key(event: events.NewMessage.Event) -> Hashable:
+        message = event.message
+        if isinstance(message.peer_id, types.PeerChannel):
+            return event.chat_id, message.id
+        return event.chat_id, event.sender_id, message.date, message.message
+
+    def first_delivery(self, event: events.NewMessage.Event) -> bool:
+        """Возвращает True, если сообщение получено впервые."""
+        key = self._key(event)
+        if key in self._seen:
+            return False
+        self._seen[key] = None
+        if len(self._seen) > self.max_size:
+            self._seen.popitem(last=False)
+        return True
@@ -1,10 +1,19 @@
+import io
 import logging
+import os
+from typing import Optional
 from telethon import events
 from telethon.tl.functions.channels import JoinChannelRequest
 
 from src.task_manager import TaskScheduler
 from src.telethone_client.handlers.base_handlers import BaseHandlers
 from src.task_container.tasks import TaskContainer, MessageProcessor
+from src.task_container.tracked_chats import TrackedChats
+from src.task_container.join_scheduler import JoinScheduler
+from src.task_container.jobs import JobManager
+from src.utils.prompts import PromptRegistry
+from src.utils.metrics import MetricsRegistry
+from src.telethone_client.client_pool import ClientPool
 
 
 class MainHandlers(BaseHandlers):
@@ -14,33 +23,45 @@ class MainHandlers(BaseHandlers):
         super().__init__()
         self.task_scheduler = TaskScheduler()
         self.task_container = TaskContainer()
+        # Пул аккаунтов задаёт клиент; без него задачи выполняются аккаунтом, получившим команду
+        self.client_pool: Optional[ClientPool] = None
+        # Таблица команд: команда -> обработчик
+        self.commands = {
+            '/help': self.help_command,
+            '/start_pars': self.handle_pars_command,
+            '/get_status': self.handle_status_tasks,
+            '/get_prompt_msg': self.get_prompt_filter,
+            '/set_prompt_msg': self.set_prompt_filter,
+            '/join_groups': self.handle_join_groups,
+            '/metrics': self.handle_metrics,
+        }
 
     async def handle_group_message(self, event: events.NewMessage.Event) -> None:
         """Обработчик групповых сообщений"""
-        await MessageProcessor.add_message(event)
+        # Сообщения из неотслеживаемых групп и от заблокированных отправителей не попадают в очередь
+        if not TrackedChats.is_tracked(event.chat_id) or MessageProcessor.is_blocked(event.sender_id):
+            return
+        await MessageProcessor.add_message(event, self._account(event))
+
+    def _account(self, event: events.NewMessage.Event) -> Optional[str]:
+        """Имя аккаунта пула, получившего событие; None, если пула нет или аккаунт исключён из него."""
+        if self.client_pool is None:
+            return None
+        try:
+            return self.client_pool.name(event.client)
+        except KeyError:
+            return None
 
     async def handle_command(self, event: events.NewMessage.Event) -> None:
         """Обработчик команд"""
-        if not hasattr(event, 'message') or not event.message.text:
+        if not hasattr(event, 'message') or not event.message.message:
             return
         try:
-            command = event.message.text.lower().split()[0].strip()
+            command = event.message.message.lower().split()[0].strip()
         except IndexError:
             return
-        if command == '/help':
-            await self.help_command(event)
-        elif command == '/start_pars':
-            await self.handle_pars_command(event)
-        elif command == '/get_status':
-            await self.handle_status_tasks(event)
-        elif command == '/get_prompt_msg':
-            await self.get_prompt_filter(event)
-        elif command == '/set_prompt_msg':
-            await self.set_prompt_filter(event)
-        elif command == '/join_groups':
-            await self.handle_join_groups(event)
-        else:
-            await self.handle_no_command(event)
+        handler = self.commands.get(command, self.handle_no_command)
+        await handler(event)
 
     async def help_command(self, event: events.NewMessage.Event) -> None:
         """Обработчик команды /help"""
@@ -49,20 +70,23 @@ class MainHandlers(BaseHandlers):
                 '/get_status - возвращает статус задач\n'
                 '/get_prompt_msg - запросить промпт фильтрации сообщений\n'
                 '/set_prompt_msg - задать промпт фильтрации сообщений. Нужно выбрать файл с названием prompt_message.txt\n'
-                '/join_groups - вступить в группы')
+                '/join_groups - вступить в группы\n'
+                '/metrics - метрики бота в формате Prometheus')
         await event.reply(text)
 
     async def handle_pars_command(self, event: events.NewMessage.Event) -> None:
         """Обработчик команды /start"""
         logging.info("Добавляем задачу на парсинг групп")
-        id_task = await self.task_scheduler.add_task(self.task_container.parse_groups(event.client, event),
+        id_task = await self.task_scheduler.add_task(self.task_container.parse_groups(self._pool(event), event),
                                                      "parsing_groups")
         # await  self.task_scheduler.run_all_pending()
         await self.task_scheduler.run_task(id_task)
         logging.info(f'Задача запущена: {id_task}')
         all_tasks = self.task_scheduler.task_status(id_task.id)
         logging.info(f'Все задачи: {all_tasks}')
-        await event.reply('Задача парсинга групп запущена')
+
+    def _pool(self, event: events.NewMessage.Event) -> ClientPool:
+        return self.client_pool or ClientPool({'main': event.client})
 
     async def handle_status_tasks(self, event: events.NewMessage.Event) -> None:
         """Обработчик команды /get_status"""
@@ -71,7 +95,25 @@ class MainHandlers(BaseHandlers):
         for task in all_tasks:
             logging.info(f'Задача: {task.name} - {task.status}')
         text = '\n'.join([f'Задача: {task.name} - {task.status} \n' for task in all_tasks])
-        await event.reply(f'Все задачи: {text}')
+        cache_stats = MessageProcessor.cache_stats()
+        await event.reply(f'Все задачи: {text}\n'
+                          f'Кэш классификации: попаданий {cache_stats["hits"]}, промахов {cache_stats["misses"]}, '
+                          f'записей {cache_stats["size"]}, доля попаданий {cache_stats["hit_rate"]}\n'
+                          f'Предварительный фильтр: {MessageProcessor.prefilter_stats()}\n'
+                          f'Отслеживаемых групп: {TrackedChats.count()}\n'
+                          f'FloodWait аккаунтов, с: {self._pool(event).status()}\n'
+                          f'Вступление в группы: {JoinScheduler.status(self._pool(event))}\n'
+                          f'Задания: {JobManager.status()}')
+
+    async def handle_metrics(self, event: events.NewMessage.Event) -> None:
+        """Обработчик команды /metrics. Длинная выгрузка отправляется файлом."""
+        text = MetricsRegistry.render()
+        if len(text) <= 4000:
+            await event.reply(f'```\n{text}```')
+            return
+        file = io.BytesIO(text.encode())
+        file.name = 'metrics.txt'
+        await event.client.send_file(event.message.chat_id, file, force_document=True, caption="Метрики бота")
 
     async def handle_no_command(self, event: events.NewMessage.Event) -> None:
         """Обработчик отсутствующих команд"""
@@ -80,7 +122,7 @@ class MainHandlers(BaseHandlers):
     async def get_prompt_filter(self, event: events.NewMessage.Event):
         """Получает текст из сообщения и возвращает его"""
         try:
-            path_file = 'src/prompts/prompt_message.txt'
+            path_file = PromptRegistry.path('prompt_message.txt')
             await event.client.send_file(event.message.chat_id, path_file, force_document=True,
                                          caption="Промпт фильтра сообщений")
         except Exception as e:
@@ -89,15 +131,18 @@ class MainHandlers(BaseHandlers):
     async def set_prompt_filter(self, event: events.NewMessage.Event):
         message = event.message
         client = event.client
-        if message.file:
-            file_path = f'src/prompts/{message.file.name}'
+        if message.file and message.file.name:
+            file_path = PromptRegistry.path(message.file.name)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
             await client.download_media(message, file_path)
-            await client.send_message(message.chat_id, f"Файл {file_path} успешно загружен.")
+            # Сбрасываем кэш, чтобы новый промпт применился со следующей пачки
+            PromptRegistry.invalidate(message.file.name)
+            await client.send_message(message.chat_id, f"Файл {message.file.name} успешно загружен.")
         else:
             await client.send_message(message.chat_id, "Пожалуйста, отправьте файл.")
 
     async def handle_join_groups(self, event: events.NewMessage.Event):
         logging.info('Добавляем задачу на вступление в группы')
-        id_task = await self.task_scheduler.add_task(self.task_container.join_group_or_channel(event),
-                                                     "join_groups")
+        id_task = await self.task_scheduler.add_task(
+            self.task_container.join_group_or_channel(self._pool(event), event), "join_groups")
         await self.task_scheduler.run_task(id_task)
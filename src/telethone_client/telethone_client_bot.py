@@ -1,7 +1,18 @@
+import asyncio
 import logging
+from typing import Dict, List, Optional
+
 from telethon import TelegramClient, events
 
-from src.task_container import MessageProcessor
+from config import DATABASE_URL, METRICS_HOST, METRICS_PORT, TRACKED_CHATS_ONLY, EXTRA_SESSION_NAMES, \
+    CLASSIFIER_PROCESSES
+from src.database.database import Database
+from src.task_container import MessageProcessor, TaskContainer, TrackedChats, EntityCache, \
+    DialogMembership, JoinScheduler, JobManager, GroupUpdateQueue
+from src.task_container.workers import ClassifierWorkers
+from src.utils.mistralAi import MistralAI
+from src.utils.metrics import MetricsRegistry
+from src.telethone_client.client_pool import ClientPool, MessageDeduplicator
 from src.telethone_client.handlers.base_handlers import BaseHandlers
 from src.telethone_client.handlers.main_handlers import MainHandlers
 
@@ -13,50 +24,212 @@ class BaseTelegramClient:
         self.client = TelegramClient(session_name, api_id, api_hash, system_version=system_version)
         # Mistral AI
         self.handlers = BaseHandlers()
+        # Отбрасывает повторные доставки групповых сообщений, если их получают несколько аккаунтов
+        self.deduplicator: Optional[MessageDeduplicator] = None
 
-    async def start(self):
-        async with self.client:
-            logging.info("Telegram client started")
+    def register_handlers(self) -> None:
+        """Регистрирует обработчик событий в клиенте. Подключение к Telegram для этого не нужно."""
+        self.client.add_event_handler(self.route_message, events.NewMessage())
 
-            # Регистрируем обработчик приватных сообщений
-            @self.client.on(
-                events.NewMessage(func=lambda e: e.is_private & (not e.message.text.strip().startswith('/'))))
-            async def handler_private(event):
+    async def route_message(self, event: events.NewMessage.Event) -> None:
+        """
+        Единый обработчик новых сообщений: тип события определяется один раз.
+        Групповые сообщения - в handle_group_message, команды (приватные сообщения, начинающиеся с '/')
+        - в handle_command, остальные приватные сообщения - в handle_private_message.
+        Для распознавания команды берётся исходный текст сообщения без разбора разметки.
+        """
+        if event.is_group:
+            if self.deduplicator is not None and not self.deduplicator.first_delivery(event):
+                return
+            await self.handlers.handle_group_message(event=event)
+        elif event.is_private:
+            if (event.message.message or '').lstrip().startswith('/'):
+                await self.handlers.handle_command(event=event)
+            else:
                 await self.handlers.handle_private_message(event=event)
 
-            # Регистрируем обработчик групповых сообщений
-            @self.client.on(events.NewMessage(func=lambda e: e.is_group))
-            async def handler_group(event):
-                await self.handlers.handle_group_message(event=event)
+    async def on_started(self) -> None:
+        """Вызывается после подключения клиента и регистрации обработчиков."""
+        pass
 
-            # Регистрируем обработчик команд
-            @self.client.on(events.NewMessage(func=lambda e: e.is_private & e.message.text.strip().startswith('/')))
-            async def handler_command(event:events.NewMessage.Event):
-                await self.handlers.handle_command(event=event)
+    async def on_stopping(self) -> None:
+        """Вызывается при остановке, пока клиент ещё подключён: можно завершить пересылки."""
+        pass
 
-            # Запускаем клиент
+    async def start(self):
+        async with self.client:
+            logging.info("Telegram client started")
+            self.register_handlers()
             try:
-                await self.client.run_until_disconnected()
-            except KeyboardInterrupt:
-                logging.info("Получен сигнал прерывания. Завершение работы...")
-                # raise KeyboardInterrupt('Программа завершена пользователем')
+                await self.on_started()
+
+                # Запускаем клиент
+                try:
+                    await self.client.run_until_disconnected()
+                except KeyboardInterrupt:
+                    logging.info("Получен сигнал прерывания. Завершение работы...")
+                    # raise KeyboardInterrupt('Программа завершена пользователем')
+            finally:
+                await self.on_stopping()
 
 
 class MainTelegramClient(BaseTelegramClient):
 
-    def __init__(self, api_id, api_hash, session_name, system_version='4.16.30-debian'):
+    def __init__(self, api_id, api_hash, session_name, system_version='4.16.30-debian',
+                 extra_session_names: Optional[List[str]] = None):
         super().__init__(api_id, api_hash, session_name, system_version)
 
         # handlers
         self.handlers = MainHandlers()
         self.logger = logging.getLogger(__name__)
+        self._wal_messages = []
+        self._db = None
+        self._workers: Optional[ClassifierWorkers] = None
+        # Пул аккаунтов: основной клиент и дополнительные сессии на том же event loop
+        if extra_session_names is None:
+            extra_session_names = EXTRA_SESSION_NAMES
+        self.clients: Dict[str, TelegramClient] = {
+            session_name if isinstance(session_name, str) else 'main': self.client}
+        for name in extra_session_names:
+            self.clients[name] = TelegramClient(name, api_id, api_hash, system_version=system_version)
+        self._set_pool(self.clients)
+        if len(self.clients) > 1:
+            self.deduplicator = MessageDeduplicator()
+
+    def _set_pool(self, clients: Dict[str, TelegramClient]) -> None:
+        self.pool = ClientPool(clients)
+        self.handlers.client_pool = self.pool
+
+    def register_handlers(self) -> None:
+        """Регистрирует обработчики событий во всех аккаунтах пула."""
+        for client in self.clients.values():
+            client.add_event_handler(self.route_message, events.NewMessage())
+            client.add_event_handler(self.on_chat_action, events.ChatAction())
+
+    async def on_chat_action(self, event: events.ChatAction.Event) -> None:
+        """Поддерживает индекс диалогов аккаунтов по событиям вступления и выхода."""
+        try:
+            await DialogMembership.apply_chat_action(self.pool.name(event.client), event)
+        except KeyError:
+            # Аккаунт исключён из пула
+            pass
+
+    async def _load_dialogs(self) -> None:
+        """Загружает индекс диалогов всех аккаунтов пула."""
+        async def load(name: str, client: TelegramClient) -> None:
+            try:
+                await DialogMembership.ensure_loaded(name, client)
+            except Exception as e:
+                logging.error(f"Не удалось загрузить диалоги аккаунта {name}: {e}")
+
+        await asyncio.gather(*(load(name, client) for name, client in self.pool.clients.items()))
+
+    async def _start_extra_clients(self) -> None:
+        """
+        Подключает дополнительные аккаунты; аккаунты, которые не удалось подключить, исключаются из пула.
+        Сессия аккаунта должна быть авторизована заранее: client.start() для неавторизованной сессии
+        запросил бы номер телефона в консоли и остановил бы event loop.
+        """
+        started = {}
+        for name, client in self.clients.items():
+            if client is not self.client:
+                try:
+                    await client.connect()
+                    if not await client.is_user_authorized():
+                        logging.error(f"Сессия аккаунта {name} не авторизована, аккаунт исключён из пула")
+                        await client.disconnect()
+                        continue
+                except Exception as e:
+                    logging.error(f"Не удалось подключить аккаунт {name}: {e}")
+                    continue
+            started[name] = client
+        if len(started) != len(self.clients):
+            self._set_pool(started)
+        logging.info(f"Аккаунтов в пуле: {len(started)}")
+
+    async def _stop_extra_clients(self) -> None:
+        for client in self.clients.values():
+            if client is not self.client and client.is_connected():
+                await client.disconnect()
+
+    async def on_started(self) -> None:
+        """
+        Подключает дополнительные аккаунты, загружает индекс их диалогов и возвращает в очередь
+        сообщения из журнала предзаписи: пересылать их можно только подключённым клиентом.
+        Продолжает вступление в группы, прерванное остановкой бота.
+        """
+        await self._start_extra_clients()
+        await self._load_dialogs()
+        JoinScheduler.restore_floods(self.pool)
+        messages, self._wal_messages = self._wal_messages, []
+        await MessageProcessor.replay_messages(messages, self.pool, self.client)
+        if TRACKED_CHATS_ONLY and TrackedChats.has_unresolved():
+            # При FloodWait разрешение имён ждёт, поэтому выполняется отдельной задачей
+            task = await self.handlers.task_scheduler.add_task(
+                TaskContainer.resolve_connected_chat_ids(self.client, self._db, self.pool.name(self.client)),
+                "resolve_connected_chats")
+            await self.handlers.task_scheduler.run_task(task)
+        # Задания, прерванные остановкой бота, продолжаются с курсора
+        for kind in await JobManager.interrupted(self._db):
+            logging.info(f"Продолжаем прерванное задание {kind}")
+            if kind == 'parse_groups':
+                coroutine, name = TaskContainer.parse_groups(self.pool, None), "parsing_groups"
+            elif kind == 'join_groups':
+                coroutine, name = TaskContainer.join_group_or_channel(self.pool, None), "join_groups"
+            else:
+                continue
+            task = await self.handlers.task_scheduler.add_task(coroutine, name)
+            await self.handlers.task_scheduler.run_task(task)
+
+    async def on_stopping(self) -> None:
+        """
+        Останавливает процессы-классификаторы, пока клиенты подключены: они дообрабатывают очередь,
+        а последние пересылки выполняются до отключения. Не пересланные сообщения остаются в журнале.
+        """
+        if self._workers is not None:
+            workers, self._workers = self._workers, None
+            MessageProcessor.set_workers(None)
+            await workers.stop()
 
     async def start(self):
         """Запускает планировщик задач и клиент."""
+        # Создаём недостающие таблицы и загружаем список заблокированных отправителей
+        # Общий движок БД процесса: его используют и задачи, закрывается при остановке бота
+        db = Database.shared(DATABASE_URL)
+        await db.create_tables()
+        await MessageProcessor.load_blocked_ids(db)
+        TrackedChats.set_enabled(TRACKED_CHATS_ONLY)
+        await TrackedChats.refresh(db)
+        # Имена групп, разрешённые на прошлых запусках: повторно ResolveUsername не нужен
+        await EntityCache.load(db)
+        JoinScheduler.load()
+        self._db = db
+        # Сообщения, не обработанные до прошлой остановки, вернутся в очередь после подключения клиента
+        self._wal_messages = MessageProcessor.open_wal()
+        await MetricsRegistry.start_server(METRICS_HOST, METRICS_PORT)
         await self.handlers.task_scheduler.start()
-        # добавляем задачу на обработку групповых сообщений
-        id_task = await self.handlers.task_scheduler.add_task(MessageProcessor.processing_loop(), "processing_loop")
-        # активируем задачу
-        #await self.handlers.task_scheduler.run_all_pending()
-        await self.handlers.task_scheduler.run_task(id_task)
-        await super().start()  # Запускаем клиент
+        if CLASSIFIER_PROCESSES > 0:
+            # Классификация в отдельных процессах, здесь остаются только приём обновлений и пересылка
+            self._workers = ClassifierWorkers(CLASSIFIER_PROCESSES)
+            self._workers.start(MessageProcessor._blocked_ids)
+            MessageProcessor.set_workers(self._workers)
+        else:
+            # добавляем задачу на обработку групповых сообщений
+            id_task = await self.handlers.task_scheduler.add_task(MessageProcessor.processing_loop(),
+                                                                  "processing_loop")
+            # активируем задачу
+            #await self.handlers.task_scheduler.run_all_pending()
+            await self.handlers.task_scheduler.run_task(id_task)
+        try:
+            await super().start()  # Запускаем клиент
+        finally:
+            # Если клиент не запустился, on_stopping не вызывался
+            await self.on_stopping()
+            await self.handlers.task_scheduler.shutdown()
+            await self._stop_extra_clients()
+            await MessageProcessor.close_wal()
+            await MetricsRegistry.stop_server()
+            await MistralAI.close_all()
+            # Отложенные изменения групп записываются до закрытия БД
+            await GroupUpdateQueue.close_all()
+            await db.close()
@@ -0,0 +1,76 @@
+import hashlib
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_text(text: Optional[str]) -> str:
+    """
+    Нормализует текст сообщения для сравнения копий: нижний регистр, схлопнутые пробелы.
+    :param text: Текст сообщения
+    :return: Нормализованный текст
+    """
+    if not text:
+        return ''
+    return _WHITESPACE_RE.sub(' ', text.lower()).strip()
+
+
+class ClassificationCache:
+    """
+    Кэш категорий сообщений по хешу нормализованного текста.
+    Записи вытесняются по времени жизни (TTL) и по давности использования (LRU) при переполнении.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items: OrderedDict[bytes, Tuple[float, str]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(text: Optional[str]) -> bytes:
+        return hashlib.blake2b(normalize_text(text).encode('utf-8'), digest_size=16).digest()
+
+    def get(self, text: Optional[str]) -> Optional[str]:
+        """
+        Возвращает закэшированную категорию сообщения.
+        :param text: Текст сообщения
+        :return: Категория или None, если записи нет или она устарела
+        """
+        key = self._key(text)
+        item = self._items.get(key)
+        if item is not None:
+            expires_at, category = item
+            if expires_at > time.monotonic():
+                self._items.move_to_end(key)
+                self.hits += 1
+                return category
+            del self._items[key]
+        self.misses += 1
+        return None
+
+    def put(self, text: Optional[str], category: str) -> None:
+        """
+        Сохраняет категорию сообщения.
+        :param text: Текст сообщения
+        :param category: Категория, которую вернул классификатор
+        """
+        key = self._key(text)
+        self._items[key] = (time.monotonic() + self.ttl, category)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        """Возвращает счётчики попаданий и промахов кэша."""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._items),
+            'hit_rate': round(self.hits / total, 3) if total else 0.0,
+        }
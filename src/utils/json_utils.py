@@ -1,4 +1,5 @@
 import json
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 
 class JsonUtils:
@@ -19,3 +20,85 @@ class JsonUtils:
             return json.loads(text_dict)
         except json.JSONDecodeError:
             return {}
+
+    @staticmethod
+    def validate(data: Any, schema: Dict[str, Tuple[Callable[[Any], Any], bool]]) -> Optional[dict]:
+        """
+        Проверяет словарь по простой схеме и приводит типы полей.
+        :param data: Проверяемый объект
+        :param schema: Поле -> (функция приведения типа, может ли значение быть None)
+        :return: Словарь с приведёнными полями или None, если объект не подходит под схему
+        """
+        if not isinstance(data, dict):
+            return None
+        result = dict(data)
+        for field, (cast, nullable) in schema.items():
+            value = data.get(field)
+            if value is None:
+                if not nullable:
+                    return None
+                result[field] = None
+                continue
+            try:
+                result[field] = cast(value)
+            except (TypeError, ValueError):
+                return None
+        return result
+
+
+class JsonObjectStreamParser:
+    """
+    Инкрементальный разбор JSON-объектов из потока текста.
+    Возвращает каждый объект, лежащий непосредственно в массиве (или объект верхнего уровня),
+    сразу после его закрывающей скобки, не дожидаясь конца ответа. Текст вне JSON (```json, пояснения модели)
+    пропускается, объект с ошибкой пропускается без потери остальных.
+    """
+
+    def __init__(self):
+        self._buffer = ''
+        self._position = 0
+        # Стек открытых скобок: ('[', None) или ('{', начало объекта, если его нужно вернуть, иначе None)
+        self._stack: List[Tuple[str, Optional[int]]] = []
+        self._in_string = False
+        self._escape = False
+        self.errors = 0
+
+    def feed(self, text: str) -> List[Any]:
+        """
+        Добавляет очередной фрагмент текста.
+        :param text: Фрагмент ответа
+        :return: Объекты, закончившиеся в этом фрагменте
+        """
+        self._buffer += text
+        objects = []
+        buffer = self._buffer
+        for position in range(self._position, len(buffer)):
+            char = buffer[position]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                # Кавычки вне JSON (в пояснениях модели) не считаем началом строки
+                self._in_string = bool(self._stack)
+            elif char == '[':
+                self._stack.append(('[', None))
+            elif char == '{':
+                is_item = not self._stack or self._stack[-1][0] == '['
+                self._stack.append(('{', position if is_item else None))
+            elif char in ']}' and self._stack:
+                _, start = self._stack.pop()
+                if char == '}' and start is not None:
+                    try:
+                        objects.append(json.loads(buffer[start:position + 1]))
+                    except json.JSONDecodeError:
+                        self.errors += 1
+        self._position = len(buffer)
+        # Когда все скобки закрыты, разобранный текст больше не нужен
+        if not self._stack:
+            self._buffer = ''
+            self._position = 0
+        return objects
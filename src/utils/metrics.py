@@ -0,0 +1,289 @@
+import abc
+import asyncio
+import functools
+import logging
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Границы корзин гистограмм по умолчанию, секунды
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(abc.ABC):
+    """
+    Базовый класс метрики. Значения хранятся в словаре по кортежу значений меток,
+    поэтому обновление метрики - это поиск в словаре и сложение, без блокировок (всё в одном event loop).
+    """
+    type_name = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    @abc.abstractmethod
+    def samples(self) -> List[Tuple[str, str, float]]:
+        """Возвращает выборки метрики: (суффикс имени, метки, значение)."""
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+        for suffix, labels, value in self.samples():
+            lines.append(f'{self.name}{suffix}{labels} {_format_value(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """Монотонно растущий счётчик. Имя по соглашению Prometheus заканчивается на _total."""
+    type_name = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, *labelvalues: str) -> None:
+        """
+        Увеличивает счётчик.
+        :param amount: Величина увеличения
+        :param labelvalues: Значения меток в порядке labelnames
+        """
+        self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def get(self, *labelvalues: str) -> float:
+        return self._values.get(labelvalues, 0)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        if not self.labelnames:
+            return [('', '', self._values.get((), 0))]
+        return [('', _format_labels(self.labelnames, labels), value)
+                for labels, value in sorted(self._values.items())]
+
+
+class Gauge(Metric):
+    """
+    Текущее значение величины. Может вычисляться функцией в момент выгрузки (set_function),
+    тогда на горячем пути обновлять её не нужно.
+    """
+    type_name = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, *labelvalues: str) -> None:
+        self._values[labelvalues] = value
+
+    def inc(self, amount: float = 1, *labelvalues: str) -> None:
+        self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """Задаёт функцию, которая возвращает значение метрики без меток в момент выгрузки."""
+        self._function = function
+
+    def get(self, *labelvalues: str) -> float:
+        if self._function is not None and not labelvalues:
+            return self._function()
+        return self._values.get(labelvalues, 0)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        if self._function is not None:
+            try:
+                return [('', '', self._function())]
+            except Exception as e:
+                logging.error(f"Ошибка вычисления метрики {self.name}: {e}")
+                return []
+        return [('', _format_labels(self.labelnames, labels), value)
+                for labels, value in sorted(self._values.items())]
+
+
+class Histogram(Metric):
+    """Гистограмма с фиксированными корзинами: количество наблюдений, сумма и накопленные счётчики корзин."""
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Значения меток -> [счётчики корзин (последняя - +Inf), сумма]
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        """
+        Добавляет наблюдение.
+        :param value: Наблюдаемое значение
+        :param labelvalues: Значения меток в порядке labelnames
+        """
+        state = self._values.get(labelvalues)
+        if state is None:
+            state = self._values[labelvalues] = ([0] * (len(self.buckets) + 1), [0.0])
+        # Счётчики храним по корзинам, накопленные суммы считаются только при выгрузке
+        state[0][bisect_left(self.buckets, value)] += 1
+        state[1][0] += value
+
+    def time(self, *labelvalues: str) -> '_Timer':
+        """Возвращает таймер: контекстный менеджер или декоратор асинхронной функции."""
+        return _Timer(self, labelvalues)
+
+    def count(self, *labelvalues: str) -> int:
+        state = self._values.get(labelvalues)
+        return sum(state[0]) if state else 0
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        samples = []
+        bounds = self.buckets + (float('inf'),)
+        for labels, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                samples.append(('_bucket', _format_labels(self.labelnames, labels, f'le="{_format_value(bound)}"'),
+                                cumulative))
+            samples.append(('_sum', _format_labels(self.labelnames, labels), total[0]))
+            samples.append(('_count', _format_labels(self.labelnames, labels), cumulative))
+        return samples
+
+
+class _Timer:
+    """Замеряет длительность блока кода или вызова асинхронной функции и записывает её в гистограмму."""
+    __slots__ = ('_histogram', '_labelvalues', '_started')
+
+    def __init__(self, histogram: Histogram, labelvalues: Tuple[str, ...]):
+        self._histogram = histogram
+        self._labelvalues = labelvalues
+        self._started = 0.0
+
+    def __enter__(self) -> '_Timer':
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._histogram.observe(time.perf_counter() - self._started, *self._labelvalues)
+
+    def __call__(self, function: Callable) -> Callable:
+        histogram, labelvalues = self._histogram, self._labelvalues
+
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, *labelvalues)
+
+        return wrapper
+
+
+class MetricsRegistry:
+    """
+    Реестр метрик процесса. Метрики создаются один раз при импорте модуля
+    и выгружаются в текстовом формате Prometheus через HTTP-сервер или команду /metrics.
+    """
+    _metrics: Dict[str, Metric] = {}
+    _server: Optional[asyncio.AbstractServer] = None
+
+    @classmethod
+    def register(cls, metric: Metric) -> Metric:
+        if metric.name in cls._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        cls._metrics[metric.name] = metric
+        return metric
+
+    @classmethod
+    def counter(cls, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return cls.register(Counter(name, documentation, labelnames))
+
+    @classmethod
+    def gauge(cls, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return cls.register(Gauge(name, documentation, labelnames))
+
+    @classmethod
+    def histogram(cls, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return cls.register(Histogram(name, documentation, labelnames, buckets))
+
+    @classmethod
+    def render(cls) -> str:
+        """Возвращает все метрики в текстовом формате Prometheus."""
+        return '\n'.join(metric.render() for metric in cls._metrics.values()) + '\n'
+
+    @classmethod
+    async def _handle(cls, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = (await reader.readline()).decode(errors='replace')
+            # Заголовки запроса не нужны, но их нужно дочитать
+            while (await reader.readline()).strip():
+                pass
+            parts = request_line.split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                status, content_type, body = '200 OK', 'text/plain; version=0.0.4; charset=utf-8', cls.render()
+            else:
+                status, content_type, body = '404 Not Found', 'text/plain; charset=utf-8', 'not found\n'
+            data = body.encode()
+            writer.write(f'HTTP/1.1 {status}\r\ncontent-type: {content_type}\r\n'
+                         f'content-length: {len(data)}\r\nconnection: close\r\n\r\n'.encode() + data)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @classmethod
+    async def start_server(cls, host: str, port: int) -> None:
+        """
+        Запускает HTTP-сервер выгрузки метрик (GET /metrics).
+        :param host: Адрес, по умолчанию только локальный
+        :param port: Порт; 0 или меньше отключает сервер
+        """
+        if port <= 0 or cls._server is not None:
+            return
+        try:
+            cls._server = await asyncio.start_server(cls._handle, host, port)
+            logging.info(f"Метрики доступны по адресу http://{host}:{port}/metrics")
+        except OSError as e:
+            logging.error(f"Не удалось запустить сервер метрик на {host}:{port}: {e}")
+
+    @classmethod
+    async def stop_server(cls) -> None:
+        if cls._server is not None:
+            cls._server.close()
+            await cls._server.wait_closed()
+            cls._server = None
+
+
+# Метрики бота. Размер очереди вычисляется при выгрузке, поэтому обработчик сообщений метрики не обновляет
+BUFFER_DEPTH = MetricsRegistry.gauge('telegram_bot_buffer_depth', 'Сообщений в очереди обработки')
+BATCH_SIZE = MetricsRegistry.histogram('telegram_bot_batch_size', 'Размер пачки сообщений',
+                                       buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000))
+BATCH_SECONDS = MetricsRegistry.histogram('telegram_bot_batch_seconds', 'Время обработки пачки сообщений')
+MESSAGES_DROPPED = MetricsRegistry.counter('telegram_bot_messages_dropped_total', 'Сообщений отброшено до Mistral',
+                                           ['reason'])
+VERDICTS = MetricsRegistry.counter('telegram_bot_verdicts_total', 'Вердиктов по категориям', ['category', 'source'])
+INVALID_VERDICTS = MetricsRegistry.counter('telegram_bot_invalid_verdicts_total', 'Некорректных вердиктов Mistral')
+MISTRAL_REQUEST_SECONDS = MetricsRegistry.histogram('telegram_bot_mistral_request_seconds',
+                                                    'Длительность запроса к Mistral', ['mode'])
+MISTRAL_ERRORS = MetricsRegistry.counter('telegram_bot_mistral_errors_total', 'Ошибок запросов к Mistral', ['kind'])
+MISTRAL_RETRIES = MetricsRegistry.counter('telegram_bot_mistral_retries_total', 'Повторов запросов к Mistral')
+FORWARDS = MetricsRegistry.counter('telegram_bot_forwarded_messages_total', 'Пересланных сообщений', ['status'])
+FLOOD_WAIT_SECONDS = MetricsRegistry.counter('telegram_bot_flood_wait_seconds_total', 'Секунд ожидания FloodWait',
+                                             ['operation'])
+DB_QUERY_SECONDS = MetricsRegistry.histogram('telegram_bot_db_query_seconds', 'Длительность запроса к БД',
+                                             ['operation'])
+ENTITY_RESOLVES = MetricsRegistry.counter('telegram_bot_entity_resolves_total', 'Разрешений имён групп в сущности',
+                                          ['source'])
@@ -1,12 +1,21 @@
 import asyncio
+import logging
 import os
 import json
+import random
 from pathlib import Path
+from typing import List, Dict, Tuple, Optional, Callable, Awaitable, Any, AsyncIterator
 
+import httpx
 from dotenv import load_dotenv
 from mistralai import Mistral
 import json
 
+from config import MISTRAL_SERVER_URL, MISTRAL_REQUESTS_PER_SECOND, MISTRAL_TOKENS_PER_SECOND, MISTRAL_MAX_RETRIES, \
+    MISTRAL_TIMEOUT, MISTRAL_BASE_BACKOFF, MISTRAL_MAX_BACKOFF, MISTRAL_MAX_CONCURRENCY
+from src.utils.rate_limiter import TokenBucket
+from src.utils.metrics import MISTRAL_REQUEST_SECONDS, MISTRAL_ERRORS, MISTRAL_RETRIES
+
 
 async def get_count_message(input_text: str) -> int:
     text = input_text.replace("```json", "").replace("```", "").strip()
@@ -19,14 +28,189 @@ async def get_count_message(input_text: str) -> int:
         return 0
 
 
+# Грубая оценка: для смеси кириллицы и латиницы токенайзер Mistral даёт около 3 символов на токен
+CHARS_PER_TOKEN = 3
+# Минимальный бюджет на сообщения в чанке, даже если промпт занимает почти весь бюджет запроса
+MIN_CHUNK_TOKEN_BUDGET = 500
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Оценивает количество токенов в тексте без обращения к токенайзеру.
+    :param text: Текст
+    :return: Приблизительное количество токенов
+    """
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def split_into_chunk_ranges(lines: List[str], token_budget: int) -> List[range]:
+    """
+    Делит строки на чанки так, чтобы каждый чанк укладывался в бюджет токенов.
+    Строка, которая одна не помещается в бюджет, уходит отдельным чанком (и обрезается в split_into_chunks).
+    :param lines: Строки с сообщениями
+    :param token_budget: Бюджет токенов на один чанк
+    :return: Диапазоны индексов строк каждого чанка
+    """
+    ranges = []
+    start = 0
+    current_tokens = 0
+    for index, line in enumerate(lines):
+        line_tokens = min(estimate_tokens(line), token_budget)
+        if index > start and current_tokens + line_tokens > token_budget:
+            ranges.append(range(start, index))
+            start = index
+            current_tokens = 0
+        current_tokens += line_tokens
+    if start < len(lines):
+        ranges.append(range(start, len(lines)))
+    return ranges
+
+
+def _fit_line(line: str, token_budget: int) -> str:
+    if estimate_tokens(line) > token_budget:
+        return line[:(token_budget - 1) * CHARS_PER_TOKEN - 1] + '\n'
+    return line
+
+
+def join_chunk(lines: List[str], chunk: range, token_budget: int) -> str:
+    """
+    Склеивает строки одного чанка из split_into_chunk_ranges; строка больше бюджета обрезается.
+    :param lines: Строки с сообщениями
+    :param chunk: Диапазон индексов строк чанка
+    :param token_budget: Бюджет токенов на один чанк
+    :return: Текст чанка
+    """
+    return ''.join(_fit_line(lines[index], token_budget) for index in chunk)
+
+
+def split_into_chunks(lines: List[str], token_budget: int) -> List[str]:
+    """
+    Склеивает строки в чанки так, чтобы каждый чанк укладывался в бюджет токенов.
+    Строка, которая одна не помещается в бюджет, обрезается и уходит отдельным чанком.
+    :param lines: Строки с сообщениями
+    :param token_budget: Бюджет токенов на один чанк
+    :return: Список чанков
+    """
+    return [join_chunk(lines, chunk, token_budget) for chunk in split_into_chunk_ranges(lines, token_budget)]
+
+
+class MistralError(Exception):
+    """Базовое исключение клиента Mistral"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        self.status_code = status_code
+        super().__init__(message)
+
+
+class MistralRateLimitError(MistralError):
+    """Исключение, возникающее когда Mistral отвечает 429 и попытки повтора исчерпаны"""
+    pass
+
+
+class MistralServerError(MistralError):
+    """Исключение, возникающее когда Mistral отвечает 5xx и попытки повтора исчерпаны"""
+    pass
+
+
+class MistralConnectionError(MistralError):
+    """Исключение, возникающее при сетевой ошибке или таймауте, когда попытки повтора исчерпаны"""
+    pass
+
+
 class MistralAI:
     """
     Класс для взаимодействия с API Mistral.
+    Держит долгоживущий HTTP-клиент с keep-alive соединениями, ограничивает скорость запросов и токенов
+    и повторяет запросы при 429/5xx и сетевых ошибках с экспоненциальной задержкой и джиттером.
+    Для общего клиента на ключ API используйте MistralAI.shared().
     """
+    _instances: Dict[Tuple[str, str], 'MistralAI'] = {}
 
-    def __init__(self, mistral_api_key: str, model: str):
-        self.client = Mistral(api_key=mistral_api_key)
+    def __init__(
+            self,
+            mistral_api_key: str,
+            model: str,
+            server_url: Optional[str] = MISTRAL_SERVER_URL,
+            requests_per_second: float = MISTRAL_REQUESTS_PER_SECOND,
+            tokens_per_second: float = MISTRAL_TOKENS_PER_SECOND,
+            max_retries: int = MISTRAL_MAX_RETRIES,
+            timeout: float = MISTRAL_TIMEOUT,
+            max_connections: int = MISTRAL_MAX_CONCURRENCY
+    ):
+        self._http_client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+        self.client = Mistral(api_key=mistral_api_key, server_url=server_url or None, async_client=self._http_client)
         self.model = model
+        self.max_retries = max_retries
+        self._request_bucket = TokenBucket(requests_per_second)
+        # Ёмкость ведра токенов - запас на несколько секунд, чтобы большой чанк не ждал бесконечно
+        self._token_bucket = TokenBucket(tokens_per_second, capacity=tokens_per_second * 10)
+
+    @classmethod
+    def shared(cls, mistral_api_key: str, model: str) -> 'MistralAI':
+        """Возвращает общий клиент для пары (ключ API, модель), создавая его при первом обращении."""
+        key = (mistral_api_key, model)
+        if key not in cls._instances:
+            cls._instances[key] = cls(mistral_api_key, model)
+        return cls._instances[key]
+
+    @classmethod
+    async def close_all(cls) -> None:
+        """Закрывает HTTP-соединения всех общих клиентов."""
+        instances = list(cls._instances.values())
+        cls._instances.clear()
+        for instance in instances:
+            await instance.close()
+
+    async def close(self) -> None:
+        await self._http_client.aclose()
+
+    @staticmethod
+    def _retry_after(error: Exception) -> Optional[float]:
+        """Возвращает задержку из заголовка Retry-After ответа, если он есть."""
+        headers = getattr(getattr(error, 'raw_response', None), 'headers', None) or {}
+        try:
+            return float(headers.get('retry-after'))
+        except (TypeError, ValueError):
+            return None
+
+    async def _request(self, make_request: Callable[[], Awaitable[Any]], tokens: int) -> Any:
+        """
+        Выполняет запрос к Mistral с ограничением скорости и повторами.
+        :param make_request: Функция, создающая корутину запроса
+        :param tokens: Оценка количества токенов запроса для ограничителя
+        :return: Ответ SDK
+        """
+        for attempt in range(self.max_retries + 1):
+            await self._request_bucket.acquire()
+            await self._token_bucket.acquire(tokens)
+            retry_after = None
+            try:
+                return await make_request()
+            except httpx.TransportError as e:
+                MISTRAL_ERRORS.inc(1, 'connection')
+                error = MistralConnectionError(f"Ошибка соединения с Mistral: {e!r}")
+            except Exception as e:
+                status_code = getattr(e, 'status_code', None)
+                if status_code == 429:
+                    MISTRAL_ERRORS.inc(1, 'rate_limit')
+                    error = MistralRateLimitError(f"Превышен лимит запросов Mistral: {e}", status_code)
+                elif status_code is not None and status_code >= 500:
+                    MISTRAL_ERRORS.inc(1, 'server')
+                    error = MistralServerError(f"Ошибка сервера Mistral: {e}", status_code)
+                else:
+                    MISTRAL_ERRORS.inc(1, 'request')
+                    raise MistralError(f"Ошибка запроса к Mistral: {e}", status_code) from e
+                retry_after = self._retry_after(e)
+            if attempt == self.max_retries:
+                raise error
+            MISTRAL_RETRIES.inc()
+            delay = retry_after if retry_after is not None else \
+                random.uniform(0, min(MISTRAL_MAX_BACKOFF, MISTRAL_BASE_BACKOFF * 2 ** attempt))
+            logging.warning(f"{error}. Повтор через {delay:.1f} с (попытка {attempt + 1} из {self.max_retries})")
+            await asyncio.sleep(delay)
 
     async def chat(self, message: str, prompt: str) -> str:
         """
@@ -34,16 +218,52 @@ class MistralAI:
         :param prompt: Промпт для AI
         :param message:  Сообщение для чата.
         :return: Ответ от модели.
+        :raises MistralError: Если запрос не удался после всех повторов или ответ пустой
         """
         messages = [
             {"role": "user", "content": message},
             {"role": "system", "content": prompt}
         ]
-        try:
-            response = await self.client.chat.complete_async(model=self.model, messages=messages)
-            return response.choices[0].message.content
-        except Exception as e:
-            return f"Возникла ошибка в запросе к Mistral : {e}"
+        with MISTRAL_REQUEST_SECONDS.time('chat'):
+            response = await self._request(
+                lambda: self.client.chat.complete_async(model=self.model, messages=messages),
+                estimate_tokens(message) + estimate_tokens(prompt),
+            )
+        if not response or not response.choices or not response.choices[0].message.content:
+            MISTRAL_ERRORS.inc(1, 'empty')
+            raise MistralError("Пустой ответ Mistral")
+        return response.choices[0].message.content
+
+    async def chat_stream(self, message: str, prompt: str) -> AsyncIterator[str]:
+        """
+        Выполняет чат в потоковом режиме.
+        Повторы выполняются только до начала потока; обрыв потока приводит к MistralConnectionError.
+        :param prompt: Промпт для AI
+        :param message:  Сообщение для чата.
+        :return: Асинхронный итератор фрагментов ответа модели
+        :raises MistralError: Если запрос не удался после всех повторов или поток оборвался
+        """
+        messages = [
+            {"role": "user", "content": message},
+            {"role": "system", "content": prompt}
+        ]
+        # Длительность потокового запроса - до получения последнего фрагмента ответа
+        with MISTRAL_REQUEST_SECONDS.time('stream'):
+            stream = await self._request(
+                lambda: self.client.chat.stream_async(model=self.model, messages=messages),
+                estimate_tokens(message) + estimate_tokens(prompt),
+            )
+            try:
+                async for event in stream:
+                    choices = event.data.choices
+                    if choices and choices[0].delta.content:
+                        content = choices[0].delta.content
+                        # content может прийти списком частей, берём текстовые
+                        yield content if isinstance(content, str) else ''.join(
+                            getattr(part, 'text', '') for part in content)
+            except httpx.TransportError as e:
+                MISTRAL_ERRORS.inc(1, 'connection')
+                raise MistralConnectionError(f"Поток ответа Mistral оборвался: {e!r}") from e
 
 
 async def main():
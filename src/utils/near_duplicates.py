@@ -0,0 +1,134 @@
+import hashlib
+import re
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+FINGERPRINT_BITS = 64
+
+# Эмодзи, пунктуация и прочие символы не влияют на отпечаток, любая группа цифр считается одним токеном
+_NON_WORD_RE = re.compile(r'[^\w\s]+|_')
+_DIGITS_RE = re.compile(r'\d+')
+
+
+def text_features(text: Optional[str]) -> List[str]:
+    """
+    Разбивает текст на признаки для SimHash: слова и пары соседних слов.
+    Номера телефонов в разном формате ("+7 (999) 123-45-67", "89991234567") сводятся к одинаковым токенам.
+    :param text: Текст сообщения
+    :return: Список признаков
+    """
+    if not text:
+        return []
+    text = _NON_WORD_RE.sub(' ', text.lower())
+    words = _DIGITS_RE.sub('0', text).split()
+    # Подряд идущие группы цифр склеиваем в один токен
+    tokens = []
+    for word in words:
+        if word == '0' and tokens and tokens[-1] == '0':
+            continue
+        tokens.append(word)
+    return tokens + [f'{first} {second}' for first, second in zip(tokens, tokens[1:])]
+
+
+def simhash(features: List[str]) -> int:
+    """
+    Вычисляет 64-битный SimHash по списку признаков.
+    :param features: Признаки текста
+    :return: Отпечаток текста
+    """
+    weights = [0] * FINGERPRINT_BITS
+    for feature in features:
+        feature_hash = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'big')
+        for bit in range(FINGERPRINT_BITS):
+            weights[bit] += 1 if feature_hash >> bit & 1 else -1
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+class NearDuplicateIndex:
+    """
+    Потоковый индекс почти одинаковых сообщений на SimHash.
+    Отпечаток делится на max_distance + 1 полос: у отпечатков, отличающихся не более чем на max_distance бит,
+    хотя бы одна полоса совпадает, поэтому кандидаты ищутся по корзинам полос без полного перебора.
+    Записи хранятся в скользящем окне window секунд и не более max_size штук.
+    """
+
+    def __init__(self, window: float, max_distance: int = 6, max_size: int = 50000, min_features: int = 5):
+        self.window = window
+        self.max_distance = max_distance
+        self.max_size = max_size
+        self.min_features = min_features
+        bands = max_distance + 1
+        band_bits = FINGERPRINT_BITS // bands
+        self._band_masks = [
+            (shift, (1 << (band_bits if band < bands - 1 else FINGERPRINT_BITS - shift)) - 1)
+            for band, shift in enumerate(range(0, band_bits * bands, band_bits))
+        ]
+        # Записи в порядке добавления: (время добавления, отпечаток, кластер)
+        self._entries: Deque[Tuple[float, int, int]] = deque()
+        # (номер полосы, значение полосы) -> {отпечаток: кластер}
+        self._buckets: Dict[Tuple[int, int], Dict[int, int]] = {}
+        self._cluster_sizes: Dict[int, int] = {}
+        self._categories: Dict[int, str] = {}
+        self._next_cluster_id = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _bands(self, fingerprint: int) -> List[Tuple[int, int]]:
+        return [(band, fingerprint >> shift & mask) for band, (shift, mask) in enumerate(self._band_masks)]
+
+    def _expire(self) -> None:
+        """Удаляет записи старше окна и самые старые записи сверх max_size."""
+        threshold = time.monotonic() - self.window
+        while self._entries and (self._entries[0][0] < threshold or len(self._entries) > self.max_size):
+            _, fingerprint, cluster_id = self._entries.popleft()
+            for band_key in self._bands(fingerprint):
+                bucket = self._buckets.get(band_key)
+                if bucket is not None:
+                    bucket.pop(fingerprint, None)
+                    if not bucket:
+                        del self._buckets[band_key]
+            self._cluster_sizes[cluster_id] -= 1
+            if not self._cluster_sizes[cluster_id]:
+                del self._cluster_sizes[cluster_id]
+                self._categories.pop(cluster_id, None)
+
+    def match(self, text: Optional[str]) -> Tuple[Optional[int], Optional[str]]:
+        """
+        Находит кластер почти одинаковых сообщений для текста, при необходимости создаёт новый.
+        :param text: Текст сообщения
+        :return: (id кластера, категория кластера); (None, None), если текст слишком короткий для сравнения
+        """
+        features = text_features(text)
+        if len(features) < self.min_features:
+            return None, None
+        self._expire()
+        fingerprint = simhash(features)
+        bands = self._bands(fingerprint)
+        cluster_id = None
+        for band_key in bands:
+            for candidate, candidate_cluster in self._buckets.get(band_key, {}).items():
+                if (candidate ^ fingerprint).bit_count() <= self.max_distance:
+                    cluster_id = candidate_cluster
+                    break
+            if cluster_id is not None:
+                break
+        if cluster_id is None:
+            cluster_id = self._next_cluster_id
+            self._next_cluster_id += 1
+        if fingerprint not in self._buckets.get(bands[0], {}):
+            self._entries.append((time.monotonic(), fingerprint, cluster_id))
+            self._cluster_sizes[cluster_id] = self._cluster_sizes.get(cluster_id, 0) + 1
+            for band_key in bands:
+                self._buckets.setdefault(band_key, {})[fingerprint] = cluster_id
+        return cluster_id, self._categories.get(cluster_id)
+
+    def set_category(self, cluster_id: int, category: str) -> None:
+        """Запоминает категорию кластера, она применяется ко всем его сообщениям в окне."""
+        if cluster_id in self._cluster_sizes:
+            self._categories[cluster_id] = category
@@ -0,0 +1,107 @@
+import json
+import logging
+import os
+import re
+from typing import Dict, List, Optional, Pattern
+
+_CYRILLIC_RE = re.compile(r'[а-яё]', re.IGNORECASE)
+
+# Строительные ключевые слова для правила keywords. По умолчанию правило выключено: сообщение без этих слов
+# отбрасывается до Mistral, поэтому включать его (в файле правил) стоит после проверки статистики отбрасываний
+# на реальном потоке сообщений.
+CONSTRUCTION_KEYWORDS = [
+    'строи', 'строй', 'постро', 'пристро', 'ремонт', 'дом', 'дач', 'бан[яиюеь]', 'гараж', 'фундамент',
+    'кровл', 'крыш', 'сруб', 'брус', 'кирпич', 'бетон', 'плитк', 'отделк', 'штукатур', 'стяжк', 'утепл',
+    'фасад', 'септик', 'скважин', 'котлован', 'забор', 'веранд', 'террас', 'смет', 'прораб', 'бригад',
+    'подрядчик', 'проект', 'сантехн', 'электрик', 'каркас', 'газобетон', 'пеноблок', 'коттедж',
+]
+
+# Правила по умолчанию, используются если файла с правилами нет.
+# keywords и stop_keywords - фрагменты регулярных выражений, совпадение ищется с начала слова;
+# пустой список keywords выключает правило.
+DEFAULT_RULES = {
+    'min_length': 12,
+    'require_cyrillic': True,
+    'keywords': [],
+    'stop_keywords': [],
+}
+
+
+class MessagePrefilter:
+    """
+    Быстрый предварительный фильтр сообщений перед Mistral.
+    Отбрасывает короткие сообщения, сообщения без кириллицы и, если в правилах заданы ключевые слова,
+    сообщения без них.
+    Ключевые слова собираются в одно регулярное выражение, поэтому текст проверяется за один проход.
+    Правила перечитываются из файла при изменении его mtime.
+    """
+
+    def __init__(self, rules_path: Optional[str] = None):
+        self.rules_path = rules_path
+        self._mtime: Optional[float] = None
+        self.drop_counts: Dict[str, int] = {}
+        self.passed = 0
+        self._apply_rules(DEFAULT_RULES)
+        self.reload_if_changed()
+
+    @staticmethod
+    def _compile(fragments: List[str]) -> Optional[Pattern]:
+        if not fragments:
+            return None
+        return re.compile(r'\b(?:' + '|'.join(f'(?:{fragment})' for fragment in fragments) + ')', re.IGNORECASE)
+
+    def _apply_rules(self, rules: dict) -> None:
+        # Сначала компилируем всё, чтобы ошибка в файле не оставила фильтр в наполовину обновлённом состоянии
+        rules = {**DEFAULT_RULES, **rules}
+        keywords = self._compile(rules['keywords'])
+        stop_keywords = self._compile(rules['stop_keywords'])
+        min_length = int(rules['min_length'])
+        require_cyrillic = bool(rules['require_cyrillic'])
+        self.min_length = min_length
+        self.require_cyrillic = require_cyrillic
+        self._keywords = keywords
+        self._stop_keywords = stop_keywords
+
+    def reload_if_changed(self) -> None:
+        """Перечитывает правила из файла, если он изменился. При ошибке в файле остаются прежние правила."""
+        if not self.rules_path:
+            return
+        try:
+            mtime = os.stat(self.rules_path).st_mtime
+        except FileNotFoundError:
+            return
+        if mtime == self._mtime:
+            return
+        self._mtime = mtime
+        try:
+            with open(self.rules_path, 'r', encoding='utf-8') as file:
+                self._apply_rules(json.load(file))
+            logging.info(f"Правила предварительного фильтра загружены из {self.rules_path}")
+        except (OSError, ValueError, TypeError, KeyError, re.error) as e:
+            logging.error(f"Ошибка загрузки правил предварительного фильтра {self.rules_path}: {e}")
+
+    def check(self, text: Optional[str]) -> Optional[str]:
+        """
+        Проверяет, может ли сообщение подходить под критерии.
+        :param text: Текст сообщения
+        :return: None, если сообщение нужно отправить в Mistral, иначе название сработавшего правила
+        """
+        text = (text or '').strip()
+        if len(text) < self.min_length:
+            rule = 'min_length'
+        elif self.require_cyrillic and not _CYRILLIC_RE.search(text):
+            rule = 'require_cyrillic'
+        elif self._stop_keywords is not None and self._stop_keywords.search(text):
+            rule = 'stop_keywords'
+        elif self._keywords is not None and not self._keywords.search(text):
+            rule = 'keywords'
+        else:
+            self.passed += 1
+            return None
+        self.drop_counts[rule] = self.drop_counts.get(rule, 0) + 1
+        return rule
+
+    def stats(self) -> Dict[str, int]:
+        """Возвращает количество пропущенных сообщений и отброшенных по каждому правилу."""
+        return {'passed': self.passed, **self.drop_counts}
+
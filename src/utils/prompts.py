@@ -0,0 +1,55 @@
+import logging
+import os
+from typing import Dict, Optional, Tuple
+
+from config import PROMPTS_DIR
+
+
+class PromptRegistry:
+    """
+    Общий реестр промптов из каталога PROMPTS_DIR.
+    Файл читается один раз и хранится в памяти; повторно читается только при изменении mtime
+    или после явного сброса через invalidate (например, после загрузки файла командой /set_prompt_msg).
+    """
+    _prompts: Dict[str, Tuple[Optional[float], Optional[str]]] = {}
+
+    @staticmethod
+    def path(name: str) -> str:
+        """Возвращает абсолютный путь к файлу промпта. Из имени берётся только последний компонент."""
+        return os.path.join(PROMPTS_DIR, os.path.basename(name))
+
+    @classmethod
+    def get(cls, name: str, default: str) -> str:
+        """
+        Возвращает текст промпта.
+        :param name: Имя файла промпта в PROMPTS_DIR
+        :param default: Промпт по умолчанию, если файла нет
+        :return: Текст промпта
+        """
+        path = cls.path(name)
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            mtime = None
+        cached = cls._prompts.get(name)
+        if cached is not None and cached[0] == mtime:
+            return cached[1] if cached[1] is not None else default
+
+        text = None
+        if mtime is not None:
+            try:
+                with open(path, 'r', encoding='utf-8') as file:
+                    text = file.read()
+                logging.info(f"Промпт '{name}' загружен из {path}")
+            except OSError as e:
+                logging.error(f"Ошибка чтения промпта {path}: {e}")
+                mtime = None
+        if text is None:
+            logging.info(f"Файл '{name}' не найден, используется промпт по умолчанию.")
+        cls._prompts[name] = (mtime, text)
+        return text if text is not None else default
+
+    @classmethod
+    def invalidate(cls, name: str) -> None:
+        """Сбрасывает закэшированный промпт, при следующем обращении файл будет прочитан заново."""
+        cls._prompts.pop(os.path.basename(name), None)
@@ -0,0 +1,44 @@
+import asyncio
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """
+    Асинхронный ограничитель скорости "ведро токенов".
+    Ведро пополняется со скоростью rate токенов в секунду и вмещает не больше capacity токенов.
+    rate <= 0 отключает ограничение.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount: float = 1.0) -> None:
+        """
+        Ожидает, пока в ведре наберётся amount токенов, и забирает их.
+        Запрос больше ёмкости ведра ограничивается ёмкостью, чтобы не ждать бесконечно.
+        """
+        if self.rate <= 0:
+            return
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                await asyncio.sleep((amount - self._tokens) / self.rate)
+
+    def drain(self, tokens: float = 0.0) -> None:
+        """Оставляет в ведре не больше tokens токенов (например, после FloodWait или при восстановлении состояния)."""
+        self._refill()
+        self._tokens = min(self._tokens, max(tokens, 0.0))